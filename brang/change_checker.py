@@ -1,26 +1,51 @@
+import codecs
+import collections
 import datetime
 import hashlib
 import logging
 import os
-import smtplib
 import time
-from email.message import EmailMessage
 from abc import ABC, abstractmethod
 
-import requests
-
 import brang.config as config
 from brang.database import SQLiteDatabase, Database, Site
-from brang.exceptions import RequestError
-from brang.exceptions import SiteChangeNotFoundException, SettingNotFoundException
+from brang.engine import CheckEngine, run_check_steps, host_of
+from brang.intervals import ADAPTIVE, get_interval_policy
+from brang.metrics import Metrics, get_metrics, set_metrics
+from brang.notifier import Notifier
+from brang.regions import create_region_extractor
+from brang.fetcher import Fetcher, get_default_fetcher, parse_retry_after, THROTTLING_STATUS_CODES
+from brang.retention import compact
+from brang.segments import Segments, pattern_fits, pattern_mask
+from brang.simhash import SimHasher, create_simhash, simhash_distance
+from brang.snapshots import SnapshotStore, get_default_snapshot_store
+from brang.segments import ALIGNED_PATTERN_PREFIX, align, format_aligned_pattern, learn_run_lengths
+from brang.excerpts import create_excerpts
+from brang.exceptions import RequestError, ThrottledError
+from brang.exceptions import SiteChangeNotFoundException
 
 log = logging.getLogger(__name__)
 
+# Magnitude of a detected change: the simhash distance (bits) of the current body to the
+# baseline, which is the simhash of the version of the site that has been notified last
+ChangeMagnitude = collections.namedtuple('ChangeMagnitude', ['distance', 'baseline', 'simhash'])
+
+
+# Fingerprints of raw bytes carry this version marker. Fingerprints without it
+# (version 1) have been taken of the decoded text, encoded as utf-8.
+FINGERPRINT_VERSION_MARKER = 'v2:'
+# Fingerprints of a region of a site (see RegionCheckStrategy) carry this marker,
+# followed by the digest of the region selector.
+REGION_FINGERPRINT_MARKER = 'r:'
+
 
 def create_fingerprint(text: str):
     """
     Creates a fingerprint for a given string.
 
+    This is the (version 1) fingerprint of decoded text. It is only needed to
+    compare content with SiteChange entries created by earlier versions.
+
     :param text:
     :return:
     """
@@ -28,22 +53,269 @@ def create_fingerprint(text: str):
     return fingerprint
 
 
-def request_site(site: Site):
+def create_raw_fingerprint(data: bytes):
     """
-    Requests the content of a site from the world wide web.
+    Creates a fingerprint for the raw bytes of a site.
+
+    No decoding is involved, so no charset detection has to run.
+
+    :param data:
+    :return: fingerprint with version marker
+    """
+    with get_metrics().timer('hash'):
+        return FINGERPRINT_VERSION_MARKER + hashlib.sha224(data).hexdigest()
+
+
+def is_legacy_fingerprint(fingerprint: str):
+    """
+    Tells if a fingerprint has been created of decoded text (see create_fingerprint).
+
+    :param fingerprint:
+    :return:
+    """
+    return not fingerprint.startswith((FINGERPRINT_VERSION_MARKER, REGION_FINGERPRINT_MARKER))
+
+
+def region_fingerprint_prefix(selector: str):
+    """
+    Returns the prefix of the fingerprints of a region. Fingerprints of different
+    selectors have different prefixes, fingerprints of whole sites have none.
+
+    :param selector: region selector (see brang.regions), None for the whole site
+    :return:
+    """
+    if not selector:
+        return FINGERPRINT_VERSION_MARKER
+    return f"{REGION_FINGERPRINT_MARKER}{hashlib.sha224(selector.encode('utf-8')).hexdigest()[:12]}:"
+
+
+def change_threshold(site: Site) -> int:
+    """
+    Returns the change threshold of a site, see ChangeChecker.is_notable_change.
 
     :param site:
+    :return: min. simhash distance of a notified change, config.default_change_threshold if the site has none
+    """
+    return config.default_change_threshold if site.change_threshold is None else site.change_threshold
+
+
+def create_body_simhash(body: bytes) -> str:
+    """
+    Creates the simhash of a whole body, see brang.simhash.
+
+    :param body: raw bytes
     :return:
     """
+    with get_metrics().timer('hash'):
+        simhash = create_simhash(Segments(body))
+    get_metrics().count('simhashes')
+    return simhash
+
+
+def finish_simhash(simhasher: SimHasher) -> str:
+    """
+    Returns the simhash of a body that has been fed into a SimHasher while it was streamed.
+
+    :param simhasher:
+    :return:
+    """
+    with get_metrics().timer('hash'):
+        simhash = simhasher.hexdigest()
+    get_metrics().count('simhashes')
+    return simhash
+
+
+def create_region_fingerprint(selector: str, data: bytes):
+    """
+    Creates a fingerprint for a region of a site.
+
+    :param selector: region selector (see brang.regions), None for the whole site
+    :param data: region, encoded as utf-8
+    :return: fingerprint with region marker
+    """
+    with get_metrics().timer('hash'):
+        return region_fingerprint_prefix(selector) + hashlib.sha224(data).hexdigest()
+
+
+def _incremental_decoder(response):
+    """
+    :param response: requests.Response
+    :return: incremental decoder of the encoding requests would use for response.text, or utf-8
+    """
+    try:
+        return codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def create_streaming_fingerprints(response, legacy: bool = False,
+                                  max_body_size: int = None, chunk_size: int = None,
+                                  simhasher: SimHasher = None):
+    """
+    Creates the fingerprint of a streamed response chunk by chunk, while the body arrives.
+
+    Memory usage does not depend on the size of the body. The raw fingerprint
+    is always created. The legacy fingerprint is only created on request,
+    because it needs the body to be decoded: incrementally, with the encoding
+    requests would use for response.text, or utf-8 if the response declares none.
+
+    :param response: requests.Response, requested with stream=True
+    :param legacy: also create the legacy fingerprint
+    :param max_body_size: max. number of bytes to read, defaults to config.max_body_size
+    :param chunk_size: defaults to config.stream_chunk_size
+    :param simhasher: if given, it is updated with the body as well (see brang.simhash)
+    :return: tuple (raw fingerprint, legacy fingerprint or None)
+    :raises: RequestError: if the body exceeds max_body_size
+    """
+    max_body_size = config.max_body_size if max_body_size is None else max_body_size
+    chunk_size = config.stream_chunk_size if chunk_size is None else chunk_size
+    decoder = None
+    legacy_h = None
+    if legacy:
+        decoder = _incremental_decoder(response)
+        legacy_h = hashlib.sha224()
+
+    h = hashlib.sha224()
+    body_size = 0
+    metrics = get_metrics()
+    try:
+        if int(response.headers.get('Content-Length') or 0) > max_body_size:
+            raise RequestError(f"Body of url={response.url} exceeds {max_body_size} bytes.")
+        # Hashing runs while the body arrives, it is part of the download stage
+        with metrics.timer('download'):
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                body_size += len(chunk)
+                if body_size > max_body_size:
+                    raise RequestError(f"Body of url={response.url} exceeds {max_body_size} bytes.")
+                h.update(chunk)
+                if simhasher is not None:
+                    simhasher.update(chunk)
+                if legacy:
+                    legacy_h.update(decoder.decode(chunk).encode('utf-8'))
+            if legacy:
+                legacy_h.update(decoder.decode(b'', final=True).encode('utf-8'))
+    finally:
+        response.close()
+        metrics.count('bytes_fetched', body_size)
+    return (FINGERPRINT_VERSION_MARKER + h.hexdigest(),
+            legacy_h.hexdigest() if legacy else None)
+
+
+def extract_streaming_region(response, selector: str, max_body_size: int = None, chunk_size: int = None):
+    """
+    Extracts a region of a streamed response chunk by chunk, while the body arrives.
+
+    The body is decoded incrementally (see create_streaming_fingerprints) and fed
+    to a region extractor (see brang.regions). As soon as the region is complete,
+    the response is closed: the rest of the body is neither downloaded nor parsed.
+
+    :param response: requests.Response, requested with stream=True
+    :param selector: region selector, see brang.regions.parse_selector
+    :param max_body_size: max. number of bytes to read, defaults to config.max_body_size
+    :param chunk_size: defaults to config.stream_chunk_size
+    :return: the region (str), None if it has not been found
+    :raises: RequestError: if the body exceeds max_body_size before the region is complete
+    :raises: ValueError: if the selector is not valid
+    """
+    max_body_size = config.max_body_size if max_body_size is None else max_body_size
+    chunk_size = config.stream_chunk_size if chunk_size is None else chunk_size
+    extractor = create_region_extractor(selector)
+    decoder = _incremental_decoder(response)
+    body_size = 0
+    done = False
+    metrics = get_metrics()
+    try:
+        # Parsing runs while the body arrives, it is part of the download stage
+        with metrics.timer('download'):
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                body_size += len(chunk)
+                if body_size > max_body_size:
+                    raise RequestError(f"Body of url={response.url} exceeds {max_body_size} bytes.")
+                done = extractor.feed(decoder.decode(chunk))
+                if done:
+                    metrics.count('region_early_exits')
+                    break
+            if not done:
+                extractor.feed(decoder.decode(b'', final=True))
+                extractor.close()
+    finally:
+        response.close()
+        metrics.count('bytes_fetched', body_size)
+    return extractor.region
+
+
+def fetch_site(site: Site, fetcher: Fetcher = None, conditional: bool = False, stream: bool = False,
+               reserved: bool = False):
+    """
+    Requests a site from the world wide web and returns the response.
+
+    A conditional request sends the validators stored with the site
+    (If-None-Match, If-Modified-Since). If the server answers with
+    304 Not Modified, no body is downloaded and None is returned.
+
+    :param site:
+    :param fetcher: defaults to the shared Fetcher
+    :param conditional: send a conditional request
+    :param stream: do not download the body before it is accessed
+    :param reserved: the request has been reserved with the rate limiter of the fetcher, see Fetcher.get
+    :return: requests.Response, or None if the site has not been modified
+    :raises: ThrottledError: if the host answered with 429 or 503
+    """
     url = site.url
+    if fetcher is None:
+        fetcher = get_default_fetcher()
+    headers = {}
+    if conditional:
+        if site.etag:
+            headers['If-None-Match'] = site.etag
+        if site.last_modified:
+            headers['If-Modified-Since'] = site.last_modified
+    metrics = get_metrics()
     try:
-        r = requests.get(url)
-        if r.status_code != 200:
-            raise RequestError(f"Invalid http code: {r.status_code}.")
-        return r.text
+        start = time.perf_counter()
+        r = fetcher.get(url, headers=headers, stream=stream, reserved=reserved)
     except Exception as e:
         raise RequestError(f"Request for url={url} failed. "
                            f"Original exception: {e.__class__}:{str(e)}")
+    if metrics.enabled:
+        # elapsed ends with the response headers; without streaming, the body has been downloaded too
+        elapsed = r.elapsed.total_seconds()
+        metrics.record('connect', elapsed)
+        if not stream:
+            metrics.record('download', max(0.0, time.perf_counter() - start - elapsed))
+            metrics.count('bytes_fetched', len(r.content))
+    if r.status_code != 200:
+        r.close()
+    if headers and r.status_code == 304:
+        return None
+    if r.status_code in THROTTLING_STATUS_CODES:
+        raise ThrottledError(f"Request for url={url} failed. Throttled with http code: {r.status_code}.",
+                             retry_after=parse_retry_after(r.headers.get('Retry-After')))
+    if r.status_code != 200:
+        raise RequestError(f"Request for url={url} failed. Invalid http code: {r.status_code}.")
+    return r
+
+
+def decode(response) -> str:
+    """
+    Returns the decoded body of a response (response.text).
+
+    :param response: requests.Response
+    :return:
+    """
+    with get_metrics().timer('decode'):
+        return response.text
+
+
+def request_site(site: Site, fetcher: Fetcher = None):
+    """
+    Requests the content of a site from the world wide web.
+
+    :param site:
+    :param fetcher: defaults to the shared Fetcher
+    :return:
+    """
+    return decode(fetch_site(site=site, fetcher=fetcher))
 
 
 class ChangeCheckStrategy(ABC):
@@ -51,6 +323,180 @@ class ChangeCheckStrategy(ABC):
     Interface for ChangeCheckStrategies
     """
 
+    def __init__(self, db: Database, fetcher: Fetcher = None, snapshot_store: SnapshotStore = None):
+        """
+        :param db:
+        :param fetcher: used for all requests of the strategy, defaults to the shared Fetcher
+        :param snapshot_store: keeps the bodies of new SiteChange entries,
+                               defaults to a SnapshotStore if config.snapshots_enabled
+        """
+        self.db = db
+        self.fetcher = get_default_fetcher() if fetcher is None else fetcher
+        self.snapshot_store = get_default_snapshot_store(db=db) if snapshot_store is None else snapshot_store
+        self.latest_site_changes = None
+        self.change_details = {}  # site id -> list of excerpts of a detected change
+        self.change_magnitudes = {}  # site id -> ChangeMagnitude of a detected change
+
+    def prime_latest_sitechanges(self, latest_site_changes: dict):
+        """
+        Provides the latest SiteChange entries of all sites of a run, loaded in bulk.
+        While primed, the strategy does not query them one by one.
+
+        :param latest_site_changes: dict site id -> SiteChange (see Database.get_latest_sitechanges),
+                                    or None to query the database again
+        :return:
+        """
+        self.latest_site_changes = latest_site_changes
+
+    def get_latest_sitechange(self, site: Site):
+        """
+        Returns the latest SiteChange entry of a site.
+
+        :param site:
+        :return: SiteChange entry
+        :raises: SiteChangeNotFoundException: if entry does not exist
+        """
+        if self.latest_site_changes is None:
+            return self.db.get_latest_sitechange(site=site)
+        try:
+            return self.latest_site_changes[site.id]
+        except KeyError:
+            raise SiteChangeNotFoundException(f"No SiteChange entry with id={site.id} could be found.")
+
+    def get_latest_page_sitechange(self, site: Site):
+        """
+        Returns the latest SiteChange entry of a site, for strategies that check the whole site.
+
+        An entry that has been taken of a region (see RegionCheckStrategy) cannot be
+        compared with the whole site; the region selector of the site has been removed
+        since. It is treated as missing, so that a new entry is created without a change
+        being reported.
+
+        :param site:
+        :return: SiteChange entry
+        :raises: SiteChangeNotFoundException: if entry does not exist or has been taken of a region
+        """
+        latest_site_change = self.get_latest_sitechange(site=site)
+        if latest_site_change.fingerprint.startswith(REGION_FINGERPRINT_MARKER):
+            log.info(f"Region of url={site.url} has been removed. Starting over.")
+            raise SiteChangeNotFoundException(f"Latest SiteChange entry of url={site.url} is of a region.")
+        return latest_site_change
+
+    def request(self, site: Site, conditional: bool = False, stream: bool = False):
+        """
+        Requests a site using the fetcher of the strategy, see request_steps.
+
+        :param site:
+        :param conditional: see fetch_site
+        :param stream: see fetch_site
+        :return: requests.Response, or None if the site has not been modified
+        """
+        return run_check_steps(self.request_steps(site=site, conditional=conditional, stream=stream))
+
+    def request_steps(self, site: Site, conditional: bool = False, stream: bool = False):
+        """
+        Generator version of request, to be used by check_steps: response = yield from self.request_steps(site)
+
+        Every request is reserved with the per-host rate limiter of the fetcher;
+        the wait for it is yielded. A request that is throttled by the host
+        (429/503 with Retry-After) is retried up to config.http_max_retries times,
+        after the host's Retry-After.
+
+        :param site:
+        :param conditional: see fetch_site
+        :param stream: see fetch_site
+        :return: requests.Response, or None if the site has not been modified
+        """
+        host = host_of(site.url)
+        retries = config.http_max_retries
+        while True:
+            delay = self.fetcher.rate_limiter.reserve(host, max_wait=config.rate_limit_max_wait)
+            if delay is None:
+                raise ThrottledError(f"Request for url={site.url} failed. Host {host} is throttled.")
+            if delay > 0:
+                yield delay
+            try:
+                return fetch_site(site=site, fetcher=self.fetcher, conditional=conditional, stream=stream,
+                                  reserved=True)
+            except ThrottledError as e:
+                if retries <= 0 or e.retry_after is None or e.retry_after > config.rate_limit_max_wait:
+                    raise
+                retries -= 1
+                log.info(f"Retrying url={site.url} after {e.retry_after:.0f}s.")
+
+    def store_validators(self, site: Site, response):
+        """
+        Stores the validators of a response for later conditional requests.
+
+        This has to be called only once the check of the response is complete.
+        Otherwise a failing check could leave validators behind that make the
+        next check skip a change.
+
+        :param site:
+        :param response: requests.Response
+        :return:
+        """
+        self.db.update_site_validators(site=site,
+                                       etag=response.headers.get('ETag'),
+                                       last_modified=response.headers.get('Last-Modified'))
+
+    def store_snapshot(self, body: bytes):
+        """
+        Stores the body of a new SiteChange entry, if the strategy has a snapshot store.
+        A snapshot that cannot be stored does not fail the check.
+
+        :param body: raw bytes
+        :return: snapshot id or None
+        """
+        if self.snapshot_store is None:
+            return None
+        try:
+            return self.snapshot_store.store(body=body)
+        except Exception as e:
+            log.error(f"Could not store snapshot. {e}")
+            return None
+
+    def pop_change_details(self, site: Site):
+        """
+        Returns (and forgets) the description of the change that the last check of a site has detected.
+
+        :param site:
+        :return: list of excerpts (str), None if the strategy could not describe the change
+        """
+        return self.change_details.pop(site.id, None)
+
+    def measure_change(self, site: Site, latest_site_change, current_simhash: str):
+        """
+        Keeps the magnitude of a detected change for pop_change_magnitude: the distance
+        between the simhash of the current body and the baseline of the site
+        (Site.notified_simhash), or the simhash of the latest SiteChange entry if
+        the site has no baseline yet.
+
+        Measuring against the version that has been notified last, not against the
+        latest entry, lets changes below the threshold of the site add up.
+
+        :param site:
+        :param latest_site_change:
+        :param current_simhash: see brang.simhash
+        :return:
+        """
+        baseline = site.notified_simhash or latest_site_change.simhash
+        if baseline is None or current_simhash is None:
+            return
+        distance = simhash_distance(baseline, current_simhash)
+        log.debug(f"Change of url={site.url} has a simhash distance of {distance}.")
+        self.change_magnitudes[site.id] = ChangeMagnitude(distance=distance, baseline=baseline,
+                                                          simhash=current_simhash)
+
+    def pop_change_magnitude(self, site: Site):
+        """
+        Returns (and forgets) the magnitude of the change that the last check of a site has detected.
+
+        :param site:
+        :return: ChangeMagnitude, None if it could not be measured
+        """
+        return self.change_magnitudes.pop(site.id, None)
+
     @abstractmethod
     def change_check(self, site: Site):
         """
@@ -62,10 +508,37 @@ class ChangeCheckStrategy(ABC):
         """
         pass
 
+    def check_steps(self, site: Site):
+        """
+        Generator version of change_check, used by the CheckEngine.
+
+        Instead of sleeping, the check yields the number of seconds it has to
+        wait before it can continue. The result of the check is the return
+        value of the generator. Strategies that never wait can rely on this
+        default implementation, which calls change_check.
+
+        :param site:
+        :return: True if a Site change could be detected, False otherwise
+        """
+        yield from ()
+        return self.change_check(site=site)
+
 
 class NaiveCheckStrategy(ChangeCheckStrategy):
-    def __init__(self, db: Database):
-        self.db = db
+    def __init__(self, db: Database, fetcher: Fetcher = None, streaming: bool = None,
+                 snapshot_store: SnapshotStore = None):
+        """
+        :param db:
+        :param fetcher: see ChangeCheckStrategy
+        :param streaming: hash the body while it arrives instead of loading it,
+                          defaults to config.streaming_fingerprints. Bodies are
+                          loaded anyway if the strategy keeps snapshots.
+        :param snapshot_store: see ChangeCheckStrategy
+        """
+        super().__init__(db=db, fetcher=fetcher, snapshot_store=snapshot_store)
+        self.streaming = config.streaming_fingerprints if streaming is None else streaming
+        if self.snapshot_store is not None:
+            self.streaming = False
 
     def change_check(self, site: Site):
         """
@@ -75,75 +548,302 @@ class NaiveCheckStrategy(ChangeCheckStrategy):
         :param site:
         :return: True if a Site change could be detected, False otherwise
         """
-        text = request_site(site=site)
-        current_fingerprint = create_fingerprint(text=text)
+        return run_check_steps(self.check_steps(site=site))
+
+    def check_steps(self, site: Site):
+        """
+        Generator version of change_check, see ChangeCheckStrategy.check_steps.
+
+        It yields the waits of the per-host rate limiter.
+
+        :param site:
+        :return: True if a Site change could be detected, False otherwise
+        """
+        try:
+            latest_site_change = self.get_latest_page_sitechange(site=site)
+        except SiteChangeNotFoundException:
+            latest_site_change = None
+
+        response = yield from self.request_steps(site=site, conditional=latest_site_change is not None,
+                                                 stream=self.streaming)
+        if response is None:
+            return False
+        legacy = latest_site_change is not None and is_legacy_fingerprint(latest_site_change.fingerprint)
+        simhasher = None
+        if self.streaming:
+            # The streamed body is gone once it has been hashed, so its simhash has to be
+            # built along. That is only done for sites whose changes are measured.
+            if change_threshold(site) > 0:
+                simhasher = SimHasher()
+            current_fingerprint, legacy_fingerprint = create_streaming_fingerprints(response=response,
+                                                                                    legacy=legacy,
+                                                                                    simhasher=simhasher)
+        else:
+            current_fingerprint = create_raw_fingerprint(data=response.content)
+            legacy_fingerprint = create_fingerprint(text=decode(response)) if legacy else None
         current_ts = datetime.datetime.now()
         update_detected = False
+        if latest_site_change is not None:
+            if current_fingerprint == latest_site_change.fingerprint:
+                self.store_validators(site=site, response=response)
+                return False
+            elif legacy and legacy_fingerprint == latest_site_change.fingerprint:
+                log.debug(f'Nothing has changed. Upgrading legacy fingerprint.')
+                self.db.update_site_change_fingerprint(site_change=latest_site_change,
+                                                       fingerprint=current_fingerprint)
+                self.store_validators(site=site, response=response)
+                return False
+            update_detected = True
+
+        # The simhash is only needed for a new entry
+        if self.streaming:
+            current_simhash = None if simhasher is None else finish_simhash(simhasher)
+        else:
+            current_simhash = create_body_simhash(response.content)
+        if update_detected:
+            self.measure_change(site=site, latest_site_change=latest_site_change, current_simhash=current_simhash)
+
+        # Create new SiteChange entry
+        # Streamed bodies are gone, but streaming is off if the strategy keeps snapshots
+        snapshot_id = None if self.streaming else self.store_snapshot(body=response.content)
+        self.db.insert_site_change_entry(site=site,
+                                         fingerprint=current_fingerprint,
+                                         timestamp=current_ts,
+                                         snapshot_id=snapshot_id,
+                                         simhash=current_simhash)
+        self.store_validators(site=site, response=response)
+        return update_detected
+
+
+class RegionCheckStrategy(ChangeCheckStrategy):
+    """
+    Checks only a region of a site, given by the region selector of the site
+    (see brang.regions): the first element matching a CSS-like path, or the text
+    between a start and an end marker. Changes outside of the region are ignored.
+
+    The body is streamed and parsed incrementally; the download stops as soon
+    as the region is complete. Snapshots hold the region only. Sites without a
+    region selector are checked as a whole, by their raw fingerprint.
+
+    A site whose latest SiteChange entry has been taken of another region (or
+    of the whole site) gets a new entry without a change being reported.
+    """
+
+    def change_check(self, site: Site):
+        """
+        This method checks if the region of a site has been changed in comparison to an earlier entry.
+        If there are no entries, a new SiteChange entry will be created.
+
+        :param site:
+        :return: True if a Site change could be detected, False otherwise
+        """
+        return run_check_steps(self.check_steps(site=site))
+
+    def check_steps(self, site: Site):
+        """
+        Generator version of change_check, see ChangeCheckStrategy.check_steps.
+
+        It yields the waits of the per-host rate limiter.
+
+        :param site:
+        :return: True if a Site change could be detected, False otherwise
+        """
         try:
-            latest_site_change = self.db.get_latest_sitechange(site=site)
+            latest_site_change = self.get_latest_sitechange(site=site)
+        except SiteChangeNotFoundException:
+            latest_site_change = None
+
+        selector = site.region_selector
+        response = yield from self.request_steps(site=site, conditional=latest_site_change is not None,
+                                                 stream=bool(selector))
+        if response is None:
+            return False
+        if selector:
+            region = extract_streaming_region(response=response, selector=selector)
+            if region is None:
+                log.warning(f"Region '{selector}' not found in url={site.url}.")
+                region = ''
+            body = region.encode('utf-8')
+            current_fingerprint = create_region_fingerprint(selector=selector, data=body)
+        else:
+            body = response.content
+            current_fingerprint = create_raw_fingerprint(data=body)
+        current_ts = datetime.datetime.now()
+        update_detected = False
+        if latest_site_change is not None:
             if current_fingerprint == latest_site_change.fingerprint:
+                self.store_validators(site=site, response=response)
                 return False
-            else:
+            elif latest_site_change.fingerprint.startswith(region_fingerprint_prefix(selector)):
                 update_detected = True
-        except SiteChangeNotFoundException:
-            pass
+            else:
+                log.info(f"Region of url={site.url} has been changed to '{selector}'. Starting over.")
+
+        # The simhash is only needed for a new entry
+        current_simhash = create_body_simhash(body)
+        if update_detected:
+            self.measure_change(site=site, latest_site_change=latest_site_change, current_simhash=current_simhash)
+            self.describe_change(site=site, latest_site_change=latest_site_change, current_region=body)
 
-        # Create new SiteChange entry
         self.db.insert_site_change_entry(site=site,
                                          fingerprint=current_fingerprint,
-                                         timestamp=current_ts)
+                                         timestamp=current_ts,
+                                         snapshot_id=self.store_snapshot(body=body),
+                                         simhash=current_simhash)
+        self.store_validators(site=site, response=response)
         return update_detected
 
+    def describe_change(self, site: Site, latest_site_change, current_region: bytes):
+        """
+        Creates the excerpts of a detected change (see create_excerpts) and keeps them
+        for pop_change_details. This needs the snapshot of the latest SiteChange entry.
 
-class HfcInvarianceCheckStrategy(ChangeCheckStrategy):
-    def __init__(self, db: Database):
-        self.db = db
+        :param site:
+        :param latest_site_change:
+        :param current_region:
+        :return:
+        """
+        if self.snapshot_store is None or latest_site_change.snapshot_id is None:
+            return
+        try:
+            latest_region = self.snapshot_store.load(snapshot_id=latest_site_change.snapshot_id)
+            self.change_details[site.id] = create_excerpts(latest_region, '', current_region, '')
+        except Exception as e:
+            log.warning(f"Could not describe the change of url={site.url}. {e}")
 
+
+class HfcInvarianceCheckStrategy(ChangeCheckStrategy):
     @staticmethod
-    def transform(text: str):
+    def transform(text):
         """
         Basic transform used by HFC Invariance Check
-        :param text:
+
+        The check itself works on Segments, which describes the same split without copying.
+        :param text: str or raw bytes
         :return: list
         """
+        if isinstance(text, bytes):
+            return text.replace(b'<', b'\n<').split(b'\n')
         return text.replace('<', '\n<').split('\n')
 
     @staticmethod
-    def apply_pattern(pattern: str, text: str):
+    def apply_pattern(pattern: str, text):
         """
         Applies the hfc-pattern on the text and returns the fingerprint.
 
+        The segments that are not masked by the pattern are hashed in place (see Segments).
+        Aligned patterns are mapped onto the text first (see aligned_mask), plain
+        patterns of earlier versions mask segments by index.
+        For raw bytes, the fingerprint is created by create_raw_fingerprint,
+        for str by the legacy create_fingerprint.
+
         :param pattern:
-        :param text:
+        :param text: str or raw bytes
         :return:
         """
-        p = pattern.split(',')
-        p.reverse()
-        t_list = HfcInvarianceCheckStrategy.transform(text=text)
-        for entry in p:
-            if entry != '':
-                del t_list[int(entry)]
+        metrics = get_metrics()
+        with metrics.timer('transform'):
+            segments = Segments(text)
+            mask = pattern_mask(segments, pattern)
+        with metrics.timer('hash'):
+            h = segments.masked_hash(mask)
+        if isinstance(text, bytes):
+            return FINGERPRINT_VERSION_MARKER + h.hexdigest()
+        return h.hexdigest()
+
+    @staticmethod
+    def create_simhash(pattern: str, text):
+        """
+        Creates the simhash of the segments of the text that are not masked by the hfc-pattern,
+        see brang.simhash.
 
-        site_str = ''.join(t_list)
-        return create_fingerprint(text=site_str)
+        :param pattern:
+        :param text: str or raw bytes
+        :return:
+        """
+        metrics = get_metrics()
+        with metrics.timer('transform'):
+            segments = Segments(text)
+            mask = pattern_mask(segments, pattern)
+        with metrics.timer('hash'):
+            simhash = create_simhash(segments, mask)
+        metrics.count('simhashes')
+        return simhash
 
     @staticmethod
-    def create_pattern(site_t1_text, site_t2_text):
+    def create_pattern(site_t1_text, site_t2_text, *site_texts):
         """
-        Creates the hfc-pattern on two html documents.
+        Creates the hfc-pattern on two (or more) html documents.
+
+        The segments of the first document are aligned with those of every
+        other document (see align), so that inserted or removed segments do
+        not shift the comparison. Segments of the first document that differ
+        in any other document count as changed, as do the places where other
+        documents have additional segments. The runs of changed segments may
+        only be as long as they are in one of the documents (see learn_run_lengths).
 
         :param site_t1_text: html content (text) of a site at timestamp 1
         :param site_t2_text: html content (text) of a site at timestamp 2
-        :return: pattern as comma separated string of line numbers
+        :param site_texts: html contents of further samples
+        :return: aligned pattern (see format_aligned_pattern)
         """
-        t_list_1 = HfcInvarianceCheckStrategy.transform(text=site_t1_text)
-        t_list_2 = HfcInvarianceCheckStrategy.transform(text=site_t2_text)
-        pattern = []
-        for i in range(len(t_list_1)):
-            if t_list_1[i] != t_list_2[i]:
-                pattern.append(i)
-        pattern_str = ','.join([str(x) for x in pattern])
-        return pattern_str
+        texts = (site_t2_text,) + site_texts
+        with get_metrics().timer('transform'):
+            segments_1 = Segments(site_t1_text)
+            samples = [Segments(text) for text in texts]
+            changed = set()
+            insertions = set()
+            for segments in samples:
+                sample_changed, sample_insertions = align(segments_1, segments)
+                changed.update(sample_changed)
+                insertions.update(sample_insertions)
+            pattern = learn_run_lengths(format_aligned_pattern(segments_1, changed, insertions), samples)
+
+        # Anchors can be ambiguous in very repetitive documents. If a sample is not
+        # mapped onto the first one, mask everything after the common prefix instead.
+        fingerprint = HfcInvarianceCheckStrategy.apply_pattern(pattern, site_t1_text)
+        if any(HfcInvarianceCheckStrategy.apply_pattern(pattern, text) != fingerprint for text in texts):
+            pattern = f"{ALIGNED_PATTERN_PREFIX}{min(changed | insertions)}+"
+        return pattern
+
+    def __init__(self, db: Database, fetcher: Fetcher = None,
+                 sample_count: int = None, sample_delay: float = None, recheck_delay: float = None,
+                 snapshot_store: SnapshotStore = None):
+        """
+        :param db:
+        :param fetcher: see ChangeCheckStrategy
+        :param sample_count: number of samples a pattern is learned from, defaults to config.hfc_sample_count
+        :param sample_delay: seconds between the samples of a new site, defaults to config.hfc_sample_delay
+        :param recheck_delay: seconds between the samples taken to validate the pattern after a change,
+                              defaults to config.hfc_recheck_delay
+        :param snapshot_store: see ChangeCheckStrategy
+        """
+        super().__init__(db=db, fetcher=fetcher, snapshot_store=snapshot_store)
+        self.sample_count = max(2, config.hfc_sample_count if sample_count is None else sample_count)
+        self.sample_delay = config.hfc_sample_delay if sample_delay is None else sample_delay
+        self.recheck_delay = config.hfc_recheck_delay if recheck_delay is None else recheck_delay
+
+    def describe_change(self, site: Site, latest_site_change, latest_pattern: str,
+                        current_text: bytes, current_pattern: str):
+        """
+        Creates the excerpts of a detected change (see create_excerpts) and keeps them
+        for pop_change_details. This needs the snapshot of the latest SiteChange entry.
+
+        :param site:
+        :param latest_site_change:
+        :param latest_pattern: pattern of latest_site_change
+        :param current_text: current body
+        :param current_pattern: pattern of the current body
+        :return:
+        """
+        if self.snapshot_store is None or latest_site_change.snapshot_id is None:
+            return
+        try:
+            latest_text = self.snapshot_store.load(snapshot_id=latest_site_change.snapshot_id)
+            self.change_details[site.id] = create_excerpts(latest_text, latest_pattern,
+                                                           current_text, current_pattern)
+        except Exception as e:
+            log.warning(f"Could not describe the change of url={site.url}. {e}")
 
     def change_check(self, site: Site):
         """
@@ -151,58 +851,102 @@ class HfcInvarianceCheckStrategy(ChangeCheckStrategy):
 
         If there are no previous SiteChange entries, a new SiteChange entry will be created.
 
+        :param site:
+        :return: True if a Site change could be detected, False otherwise
+        """
+        return run_check_steps(self.check_steps(site=site))
+
+    def check_steps(self, site: Site):
+        """
+        Generator version of change_check, see ChangeCheckStrategy.check_steps.
+
+        It yields the delays between the samples of a site.
+
         :param site:
         :return: True if a Site change could be detected, False otherwise
         """
         update_detected = False
         try:
-            latest_site_change = self.db.get_latest_sitechange(site=site)
+            latest_site_change = self.get_latest_page_sitechange(site=site)
             latest_fingerprint = latest_site_change.fingerprint
             log.debug(f"Latest fingerprint: {latest_fingerprint}")
-            latest_pattern = ""
-            if latest_site_change.pattern:
-                latest_pattern = latest_site_change.pattern
+            latest_pattern = self.db.get_pattern(site_change=latest_site_change)
             log.debug(f"Pattern of latest_sitechange: {latest_pattern}")
 
-            current_text = request_site(site=site)
+            current_response = yield from self.request_steps(site=site, conditional=True)
+            if current_response is None:
+                log.debug(f'Nothing has changed (not modified).')
+                return False
+            current_text = current_response.content
             current_fingerprint = HfcInvarianceCheckStrategy.apply_pattern(latest_pattern, current_text)
             log.debug(f"Current fingerprint: {current_fingerprint}")
 
             if current_fingerprint == latest_fingerprint:
                 log.debug(f'Nothing has changed.')
+                self.store_validators(site=site, response=current_response)
                 return False  # Nothing changed (update_detected = False)
+            elif is_legacy_fingerprint(latest_fingerprint) and \
+                    HfcInvarianceCheckStrategy.apply_pattern(latest_pattern,
+                                                             decode(current_response)) == latest_fingerprint:
+                log.debug(f'Nothing has changed. Upgrading legacy fingerprint.')
+                self.db.update_site_change_fingerprint(site_change=latest_site_change,
+                                                       fingerprint=current_fingerprint)
+                self.store_validators(site=site, response=current_response)
+                return False
             else:
                 log.debug(f'Update detected.')
                 update_detected = True
 
-                # Check validity of pattern by comparing ct_text vs (counter)check_text
+                # Check validity of pattern by comparing ct_text vs (counter)check_texts
+                # A pattern whose runs do not fit the current text is learned anew
                 log.debug(f'Check validity of pattern.')
-                time.sleep(0.5)
-                check_text = request_site(site=site)
-                check_fingerprint = HfcInvarianceCheckStrategy.apply_pattern(latest_pattern, check_text)
-                if check_fingerprint != current_fingerprint:
+                check_texts = []
+                pattern_valid = pattern_fits(Segments(current_text), latest_pattern)
+                for _ in range(self.sample_count - 1):
+                    yield self.recheck_delay
+                    latest_response = yield from self.request_steps(site=site)
+                    get_metrics().count('hfc_refetches')
+                    check_texts.append(latest_response.content)
+                    check_fingerprint = HfcInvarianceCheckStrategy.apply_pattern(latest_pattern, check_texts[-1])
+                    if check_fingerprint != current_fingerprint:
+                        pattern_valid = False
+                if not pattern_valid:
                     log.debug(f'Pattern not valid. Recreating it.')
-                    current_pattern = HfcInvarianceCheckStrategy.create_pattern(current_text, check_text)
+                    current_pattern = HfcInvarianceCheckStrategy.create_pattern(current_text, *check_texts)
 
                     # Recreate current_fingerprint
                     current_fingerprint = HfcInvarianceCheckStrategy.apply_pattern(current_pattern, current_text)
                 else:
                     log.debug(f'Pattern is still valid.')
                     current_pattern = latest_pattern
+                self.describe_change(site=site, latest_site_change=latest_site_change, latest_pattern=latest_pattern,
+                                     current_text=current_text, current_pattern=current_pattern)
 
         except SiteChangeNotFoundException:
             log.debug(f'SiteChange entry for url={site.url} not found. Create new HFC fingerprint.')
-            text_t1 = request_site(site=site)
-            time.sleep(1)
-            text_t2 = request_site(site=site)
-            current_pattern = HfcInvarianceCheckStrategy.create_pattern(text_t1, text_t2)
-            current_fingerprint = HfcInvarianceCheckStrategy.apply_pattern(current_pattern, text_t1)
+            latest_response = yield from self.request_steps(site=site)
+            texts = [latest_response.content]
+            for _ in range(self.sample_count - 1):
+                yield self.sample_delay
+                latest_response = yield from self.request_steps(site=site)
+                get_metrics().count('hfc_refetches')
+                texts.append(latest_response.content)
+            current_text = texts[0]
+            current_pattern = HfcInvarianceCheckStrategy.create_pattern(*texts)
+            current_fingerprint = HfcInvarianceCheckStrategy.apply_pattern(current_pattern, current_text)
+
+        current_simhash = HfcInvarianceCheckStrategy.create_simhash(current_pattern, current_text)
+        if update_detected:
+            self.measure_change(site=site, latest_site_change=latest_site_change, current_simhash=current_simhash)
 
         # Create new SiteChange entry
         log.debug(f"Creating new SiteChange entry with fingerprint: {current_fingerprint} and pattern: {current_pattern}")
         self.db.insert_site_change_entry(site=site,
                                          fingerprint=current_fingerprint,
-                                         pattern=current_pattern)
+                                         pattern=current_pattern,
+                                         snapshot_id=self.store_snapshot(body=current_text),
+                                         simhash=current_simhash)
+        self.store_validators(site=site, response=latest_response)
 
         return update_detected
 
@@ -216,12 +960,43 @@ class ChangeChecker(object):
     it will be added.
     """
 
-    def __init__(self, db: Database, change_check_strategy: ChangeCheckStrategy = None):
+    def __init__(self, db: Database, change_check_strategy: ChangeCheckStrategy = None,
+                 workers: int = None, workers_per_host: int = None, notifier: Notifier = None,
+                 region_check_strategy: ChangeCheckStrategy = None):
+        """
+        :param db:
+        :param change_check_strategy: defaults to HfcInvarianceCheckStrategy
+        :param workers: number of concurrent checks, defaults to config.check_workers
+        :param workers_per_host: max. concurrent checks per host, defaults to config.check_workers_per_host
+        :param notifier: defaults to a Notifier of db
+        :param region_check_strategy: checks the sites with a region selector, defaults to a
+                                      RegionCheckStrategy sharing the fetcher and snapshot store
+                                      of change_check_strategy
+        """
         self.db = db
         if change_check_strategy is None:
             self.change_check_strategy = HfcInvarianceCheckStrategy(db=self.db)
         else:
             self.change_check_strategy = change_check_strategy
+        if region_check_strategy is None:
+            self.region_check_strategy = RegionCheckStrategy(
+                db=self.db,
+                fetcher=self.change_check_strategy.fetcher,
+                snapshot_store=self.change_check_strategy.snapshot_store)
+        else:
+            self.region_check_strategy = region_check_strategy
+        self.workers = config.check_workers if workers is None else workers
+        self.workers_per_host = config.check_workers_per_host if workers_per_host is None else workers_per_host
+        self.notifier = Notifier(db=self.db) if notifier is None else notifier
+        self.notification_worker = None  # NotificationWorker delivering the notifier's outbox, if any
+        self.schedule_all_sites = False  # set by the daemon, which schedules every site by its next_check
+
+    def strategy_for(self, site: Site) -> ChangeCheckStrategy:
+        """
+        :param site:
+        :return: region_check_strategy if the site has a region selector, else change_check_strategy
+        """
+        return self.region_check_strategy if site.region_selector else self.change_check_strategy
 
     def check_site(self, site: Site):
         """
@@ -230,57 +1005,224 @@ class ChangeChecker(object):
         :param site:
         :return:
         """
-        site_has_changed = self.change_check_strategy.change_check(site=site)
+        site_has_changed = self.strategy_for(site).change_check(site=site)
         return site_has_changed
 
-    def check_all_sites(self):
+    def check_all_sites(self, force: bool = False):
         """
         Check all site for content changes.
 
-        The method also triggers the notification if changes have been found.
+        The sites are checked concurrently by a CheckEngine (see workers and
+        workers_per_host). A site that cannot be checked is logged and skipped.
+        The method also triggers one notification for all changes that have been found.
+        Finally, a bounded part of the site_change history is compacted (see brang.retention).
+
+        Sites with an adaptive interval policy (see brang.intervals) are skipped
+        until they are due; all other sites are checked in every run.
 
+        :param force: if True, sites that are not due are checked as well
         :return:
         """
         sites = self.db.get_all_sites()
+        if not force:
+            now = datetime.datetime.now()
+            sites = [site for site in sites
+                     if site.next_check is None or site.next_check <= now
+                     or get_interval_policy(site).name != ADAPTIVE]
+        self.check_sites(sites=sites, latest_site_changes=self.db.get_latest_sitechanges())
 
-        msg_lines = []
-        for site in sites:
+        try:
+            compact(db=self.db, max_batches=config.retention_batches_per_run)
+        except Exception as e:
+            log.error(f"Could not compact the site_change history. {e}")
+
+        if self.notification_worker is None or not self.notification_worker.is_running:
+            # Retry notifications of earlier runs
+            try:
+                self.notifier.deliver()
+            except Exception as e:
+                log.error(f"Could not deliver notifications. {e}")
+
+    def check_sites(self, sites: list, latest_site_changes: dict = None, stop_event=None) -> list:
+        """
+        Check some sites for content changes, see check_all_sites.
+
+        :param sites: list of Site objects
+        :param latest_site_changes: the latest SiteChange entries of the sites,
+                                    loaded by Database.get_latest_sitechanges if None
+        :param stop_event: threading.Event; once it is set, no further check is started
+        :return: list of tuples (site, update_detected, exception) in the order of sites;
+                 both are None for sites whose check has not been started
+        """
+        metrics = Metrics() if config.metrics_enabled else None
+        set_metrics(metrics)
+        try:
+            results = self._check_sites(sites=sites, latest_site_changes=latest_site_changes,
+                                        stop_event=stop_event)
+        finally:
+            set_metrics(None)
+        if metrics is not None:
+            self.report_metrics(metrics=metrics, results=results)
+        return results
+
+    def _check_sites(self, sites: list, latest_site_changes: dict, stop_event) -> list:
+        if latest_site_changes is None:
+            latest_site_changes = self.db.get_latest_sitechanges(sites=sites)
+        metrics = get_metrics()
+
+        def process_site(site):
             log.info(f"Processing site: Id={site.id}, URL={site.url}")
-            update_detected = self.check_site(site=site)
-            if update_detected:
+            steps = self.strategy_for(site).check_steps(site=site)
+            if not metrics.enabled:
+                return (yield from steps)
+            # Steps may be resumed by different workers, each step is attributed to the site
+            try:
+                while True:
+                    with metrics.site_scope(site):
+                        wait = next(steps)
+                    yield wait
+            except StopIteration as e:
+                return e.value
+
+        engine = CheckEngine(check_steps=process_site,
+                             workers=self.workers,
+                             workers_per_host=self.workers_per_host)
+        strategies = [self.change_check_strategy, self.region_check_strategy]
+        for strategy in strategies:
+            strategy.prime_latest_sitechanges(latest_site_changes)
+        try:
+            with self.change_check_strategy.fetcher, self.region_check_strategy.fetcher, self.db.batch():
+                results = engine.run(sites, stop_event=stop_event)
+        finally:
+            for strategy in strategies:
+                strategy.prime_latest_sitechanges(None)
+
+        msg_lines = []
+        excerpt_length = 0
+        for site, update_detected, error in results:
+            strategy = self.strategy_for(site)
+            excerpts = strategy.pop_change_details(site=site)
+            magnitude = strategy.pop_change_magnitude(site=site)
+            if error is not None:
+                log.error(f"Could not check site: Id={site.id}, URL={site.url}. {error}")
+            elif update_detected and not self.is_notable_change(site=site, magnitude=magnitude):
+                log.info(f"Change of URL={site.url} is below its threshold "
+                         f"(simhash distance {magnitude.distance}).")
+                if site.notified_simhash is None:
+                    # Keep the version before the change as baseline, so that further changes add up
+                    self.db.set_site_notified_simhash(site=site, notified_simhash=magnitude.baseline)
+            elif update_detected:
+                if magnitude is not None:
+                    self.db.set_site_notified_simhash(site=site, notified_simhash=magnitude.simhash)
                 msg_lines.append(f"* {site.url}")
+                # Excerpts are left out once the message is large enough
+                for excerpt in excerpts or []:
+                    excerpt_length += len(excerpt)
+                    if excerpt_length > config.notification_max_excerpt_length:
+                        break
+                    msg_lines.append(f"    {excerpt}")
+
+        self.schedule_sites(results=results)
 
         if len(msg_lines) > 0:
             self.send_email(msg_body="\n".join(msg_lines))
+        return results
+
+    @staticmethod
+    def is_notable_change(site: Site, magnitude: ChangeMagnitude) -> bool:
+        """
+        Tells if a detected change is to be notified: if its magnitude reaches the change threshold
+        of the site (config.default_change_threshold if None). Changes that could not be measured
+        are always notified.
+
+        :param site:
+        :param magnitude: see ChangeCheckStrategy.pop_change_magnitude
+        :return:
+        """
+        return magnitude is None or magnitude.distance >= change_threshold(site)
+
+    @staticmethod
+    def report_metrics(metrics: Metrics, results: list):
+        """
+        Logs the metrics of a check run and exports them (see config.metrics_textfile and config.metrics_json).
+
+        :param metrics:
+        :param results: see check_sites
+        :return:
+        """
+        for site, update_detected, error in results:
+            if update_detected is None and error is None:
+                continue
+            metrics.count('sites_checked')
+            if error is not None:
+                metrics.count('check_errors')
+            elif update_detected:
+                metrics.count('changes_detected')
+        metrics.finish()
+        metrics.log_summary()
+        try:
+            metrics.export(textfile=config.metrics_textfile, json_file=config.metrics_json)
+        except OSError as e:
+            log.error(f"Could not export metrics. {e}")
+
+    def schedule_sites(self, results: list):
+        """
+        Applies the interval policies of checked sites (see brang.intervals):
+        stores their next check and their (learned) check interval.
+
+        Runs of check_all_sites check all sites but the adaptive ones in every run,
+        so only the schedules of adaptive sites are stored, unless schedule_all_sites
+        is set (by the daemon).
+
+        :param results: see check_sites
+        :return:
+        """
+        now = datetime.datetime.now()
+        checked = [(site, update_detected, error, get_interval_policy(site))
+                   for site, update_detected, error in results
+                   if update_detected is not None or error is not None]
+        if not self.schedule_all_sites:
+            checked = [entry for entry in checked if entry[3].name == ADAPTIVE]
+        if not checked:
+            return
+        history = self.db.get_site_change_history(
+            site_ids=[site.id for site, _, _, policy in checked if policy.needs_history])
+        with self.db.batch():
+            for site, update_detected, error, policy in checked:
+                timestamps = [check_timestamp for _, check_timestamp in history.get(site.id, [])]
+                interval = policy.next_interval(site=site,
+                                                update_detected=None if error is not None else update_detected,
+                                                history=timestamps,
+                                                now=now)
+                check_interval = interval if policy.needs_history else site.check_interval
+                self.db.update_site_schedule(site=site,
+                                             next_check=now + datetime.timedelta(seconds=interval),
+                                             check_interval=check_interval)
 
     def send_email(self, msg_body):
         """
         Helper function for sending e-mail.
 
         The method requires an existing Setting entry with the key
-         - email_to, and
+         - email_to (one or more addresses, separated by commas), and
          config.py entries
          - smtp_port
          - smtp_server
 
+        The e-mail is stored in the outbox of the notifier first (see brang.notifier).
+        If a NotificationWorker delivers the outbox, it is woken up. Otherwise the outbox
+        is delivered right away; an e-mail that cannot be sent stays in the outbox.
+
         :param msg_body:
         :return:
         """
         try:
-            email_to = self.db.get_setting("email_to").value
-            if email_to == '':
-                raise SettingNotFoundException
-            smtp_server = config.smtp_server
-            smtp_port = config.smtp_port
-            msg = EmailMessage()
-            msg.set_content(msg_body)
-            msg['Subject'] = f"Brang.io: Site changes detected"
-            msg['From'] = "notify@brang.io"
-            msg['To'] = email_to
-
-            s = smtplib.SMTP(host=smtp_server, port=smtp_port)
-            s.send_message(msg)
-            s.close()
+            if not self.notifier.notify(body=msg_body):
+                return
+            if self.notification_worker is not None and self.notification_worker.is_running:
+                self.notification_worker.wake()
+            else:
+                self.notifier.deliver()
         except Exception as e:
             log.error(f"Could not send e-email. {e}")
 
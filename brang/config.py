@@ -1,3 +1,90 @@
 sqlite_file = '~/.brang/brang.db'
 smtp_server = 'localhost'
-smtp_port = 25
\ No newline at end of file
+smtp_port = 25
+smtp_timeout = 10  # seconds
+smtp_idle_timeout = 60  # seconds an unused SMTP connection is kept open
+
+# Concurrent change checks
+check_workers = 8
+check_workers_per_host = 2
+
+# Bulk import of sites (brang import)
+import_workers = 16  # concurrent URL validations
+import_timeout = 10  # seconds per URL validation
+import_max_wait = 3600  # seconds a URL validation waits for the rate limit of its host
+
+# HTTP connection pooling
+http_pool_connections = 100
+http_pool_maxsize = 4
+http_timeout = 30
+
+# Per-host rate limiting (token buckets, see brang.fetcher.RateLimiter)
+rate_limit_rate = 2.0  # requests per second and host, None disables the limit
+rate_limit_burst = 10
+rate_limit_hosts = {}  # domain -> (rate, burst), e.g. {'example.com': (0.2, 2)}, covers subdomains
+rate_limit_max_wait = 120  # seconds; requests that would have to wait longer fail
+http_max_retries = 1  # retries of a request that has been answered with 429/503 and Retry-After
+
+# Streaming fingerprints (NaiveCheckStrategy)
+streaming_fingerprints = True
+stream_chunk_size = 64 * 1024
+max_body_size = 16 * 1024 * 1024
+
+# HFC sampling
+hfc_sample_count = 2
+hfc_sample_delay = 1.0
+hfc_recheck_delay = 0.5
+
+# SQLite tuning
+sqlite_journal_mode = 'WAL'
+sqlite_synchronous = 'NORMAL'
+sqlite_cache_size = -8000  # negative: KiB
+db_flush_size = 200
+
+# Retention of the site_change history (None disables a policy)
+# All policies are disabled by default, so that no history is deleted unless configured,
+# e.g. retention_keep_last = 100 and snapshot_keep_per_site = 3. Enabled policies are applied
+# after every check run and by '$ brang compact'.
+retention_keep_last = None
+retention_max_age_days = None
+retention_downsample_after_days = None
+retention_downsample_interval_days = 1
+retention_batch_size = 100  # sites per batch
+retention_batches_per_run = 1  # batches compacted after each check run
+
+# Daemon (brang daemon)
+default_check_interval = 60 * 60  # seconds, for sites without their own interval
+daemon_max_sleep = 60  # seconds
+daemon_reload_interval = 5 * 60  # seconds between reloads of the site list
+
+# Check intervals (see brang.intervals)
+default_interval_policy = 'fixed'  # 'fixed' or 'adaptive'
+adaptive_min_interval = 5 * 60  # seconds
+adaptive_max_interval = 7 * 24 * 60 * 60  # seconds
+adaptive_backoff = 2.0
+adaptive_checks_per_change = 4
+
+# Snapshots of fetched bodies (see brang.snapshots)
+snapshots_enabled = False
+snapshot_compression = 'zlib'  # 'zlib', 'lzma' or 'none'
+snapshot_compression_level = None  # None for the default level of the compression
+snapshot_max_size = 2 * 1024 * 1024  # bytes; larger bodies are not kept
+snapshot_keep_per_site = None  # snapshots of the newest SiteChange entries per site kept by the compaction
+
+# Change excerpts in notifications (HfcInvarianceCheckStrategy with snapshots)
+excerpt_max_count = 5  # per site
+excerpt_max_length = 200  # characters per excerpt
+notification_max_excerpt_length = 20000  # characters of all excerpts of a notification
+
+# Change magnitude (see brang.simhash)
+default_change_threshold = 0  # min. simhash distance (bits of 64) of a notified change, 0 notifies every change
+
+# Notification outbox (see brang.notifier)
+notification_digest_interval = 0  # min. seconds between two e-mails; notifications in between are combined
+notification_retry_delay = 60  # seconds before the first retry, doubled per failed attempt
+notification_max_retry_delay = 60 * 60  # seconds
+
+# Per-stage timings of check runs (see brang.metrics)
+metrics_enabled = False
+metrics_textfile = '~/.brang/brang.prom'  # Prometheus textfile, None to disable
+metrics_json = '~/.brang/last_run.json'  # JSON summary of the last run, None to disable
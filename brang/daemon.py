@@ -0,0 +1,209 @@
+import datetime
+import heapq
+import itertools
+import logging
+import signal
+import threading
+
+import brang.config as config
+from brang.change_checker import ChangeChecker
+from brang.database import Database
+from brang.notifier import NotificationWorker
+from brang.retention import compact
+
+log = logging.getLogger(__name__)
+
+
+class Scheduler(object):
+    """
+    Scheduler is a priority queue of sites, ordered by the time they are due.
+
+    Every site is scheduled at most once. Rescheduling a site does not remove
+    its old heap entry, which is skipped when it surfaces instead.
+    """
+
+    def __init__(self):
+        self._heap = []  # (due, sequence number, site id)
+        self._due = {}  # site id -> due
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, site_id):
+        return site_id in self._due
+
+    def schedule(self, site_id: int, due: datetime.datetime):
+        """
+        Schedules a site, replacing an earlier schedule of it.
+
+        :param site_id:
+        :param due:
+        :return:
+        """
+        if self._due.get(site_id) == due:
+            return
+        self._due[site_id] = due
+        heapq.heappush(self._heap, (due, next(self._sequence), site_id))
+
+    def remove(self, site_id: int):
+        self._due.pop(site_id, None)
+
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> datetime.datetime:
+        """
+        :return: time at which the next site is due, None if no site is scheduled
+        """
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime.datetime) -> list:
+        """
+        Removes all sites that are due.
+
+        :param now:
+        :return: site ids, the earliest due first
+        """
+        site_ids = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return site_ids
+            site_id = heapq.heappop(self._heap)[2]
+            del self._due[site_id]
+            site_ids.append(site_id)
+
+
+class Daemon(object):
+    """
+    Daemon checks the sites in a long-running process, each site in its own interval.
+
+    Unlike a cron job that runs ChangeChecker.check_all_sites, the process,
+    its database engine and its HTTP connection pools stay alive between
+    checks. The sites that are due are checked together by the ChangeChecker,
+    which also stores the next check of each site according to its interval
+    policy (see brang.intervals). Thus a restarted daemon keeps the schedule.
+
+    The list of sites is reloaded every reload_interval, which picks up sites
+    that have been added, removed or changed by the command line tool.
+    SIGTERM and SIGINT stop the daemon: running checks are completed, checks
+    that have not been started yet are left for the next start.
+
+    Notifications are delivered by a NotificationWorker in the background,
+    so that a slow SMTP server does not delay the checks.
+    """
+
+    def __init__(self, db: Database, checker: ChangeChecker = None,
+                 reload_interval: float = None, max_sleep: float = None):
+        """
+        :param db:
+        :param checker: defaults to a ChangeChecker of db
+        :param reload_interval: seconds between reloads of the sites, defaults to config.daemon_reload_interval
+        :param max_sleep: max. seconds to sleep at once, defaults to config.daemon_max_sleep
+        """
+        self.db = db
+        self.checker = ChangeChecker(db=db) if checker is None else checker
+        self.checker.schedule_all_sites = True
+        self.reload_interval = config.daemon_reload_interval if reload_interval is None else reload_interval
+        self.max_sleep = config.daemon_max_sleep if max_sleep is None else max_sleep
+        self.stop_event = threading.Event()
+        self.scheduler = Scheduler()
+        self.sites = {}  # site id -> Site
+        self._next_reload = None
+
+    def stop(self, *args):
+        """
+        Requests the daemon to stop. Can be used as signal handler.
+
+        :return:
+        """
+        log.info("Stopping daemon.")
+        self.stop_event.set()
+
+    def reload_sites(self, now: datetime.datetime):
+        """
+        Reloads the sites and (re)schedules them at their next_check.
+
+        :param now:
+        :return:
+        """
+        sites = {site.id: site for site in self.db.get_all_sites(refresh=True)}
+        for site_id in set(self.sites) - set(sites):
+            self.scheduler.remove(site_id)
+        for site_id, site in sites.items():
+            self.scheduler.schedule(site_id, now if site.next_check is None else site.next_check)
+        self.sites = sites
+        self._next_reload = now + datetime.timedelta(seconds=self.reload_interval)
+        log.info(f"Loaded {len(sites)} sites.")
+
+    def run_due_checks(self, now: datetime.datetime) -> int:
+        """
+        Checks the sites that are due and reschedules them.
+
+        :param now:
+        :return: number of sites that have been checked
+        """
+        sites = [self.sites[site_id] for site_id in self.scheduler.pop_due(now)]
+        if not sites:
+            return 0
+        results = self.checker.check_sites(sites=sites, stop_event=self.stop_event)
+        checked = 0
+        for site, update_detected, error in results:
+            if update_detected is None and error is None:
+                # Not started before the daemon was stopped
+                self.scheduler.schedule(site.id, now)
+                continue
+            checked += 1
+            # The ChangeChecker has stored the next check according to the interval policy of the site
+            self.scheduler.schedule(site.id, site.next_check)
+        return checked
+
+    def run_once(self) -> float:
+        """
+        Runs one iteration of the daemon: reloads the sites if due and checks the sites that are due.
+
+        :return: seconds until the next iteration is due
+        """
+        now = datetime.datetime.now()
+        if self._next_reload is None or now >= self._next_reload:
+            self.reload_sites(now=now)
+            try:
+                compact(db=self.db, max_batches=config.retention_batches_per_run)
+            except Exception as e:
+                log.error(f"Could not compact the site_change history. {e}")
+        self.run_due_checks(now=now)
+
+        wake_up = self._next_reload
+        next_due = self.scheduler.next_due()
+        if next_due is not None:
+            wake_up = min(wake_up, next_due)
+        seconds = (wake_up - datetime.datetime.now()).total_seconds()
+        return min(max(0.0, seconds), self.max_sleep)
+
+    def run(self, handle_signals: bool = True):
+        """
+        Runs the daemon until stop is called.
+
+        :param handle_signals: if True, SIGTERM and SIGINT stop the daemon (main thread only)
+        :return:
+        """
+        previous_handlers = {}
+        if handle_signals:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                previous_handlers[signum] = signal.signal(signum, self.stop)
+        notification_worker = NotificationWorker(notifier=self.checker.notifier, max_sleep=self.max_sleep)
+        self.checker.notification_worker = notification_worker
+        notification_worker.start()
+        log.info("Daemon started.")
+        try:
+            while not self.stop_event.is_set():
+                self.stop_event.wait(self.run_once())
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            notification_worker.stop(timeout=config.smtp_timeout)
+            self.checker.notification_worker = None
+        log.info("Daemon stopped.")
@@ -1,18 +1,30 @@
+import contextlib
 import datetime
+import functools
+import hashlib
+import logging
 import os
+import threading
 from abc import ABC, abstractmethod
 
 import sqlalchemy
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Boolean, Column, Date, DateTime, Float, ForeignKey, Integer, String, func
+from sqlalchemy.pool import StaticPool
+from sqlalchemy import Boolean, Column, Date, DateTime, Float, ForeignKey, Integer, LargeBinary, String, func
 from sqlalchemy.orm import backref, relationship
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index, UniqueConstraint
 
+import brang.config as config
+from brang.metrics import get_metrics
+from brang.schema import SCHEMA_VERSION, get_schema_version, set_schema_version
 from brang.exceptions import (SiteNotFoundException,
                               SiteChangeNotFoundException,
-                              SettingNotFoundException)
+                              SettingNotFoundException,
+                              SnapshotNotFoundException)
+
+log = logging.getLogger(__name__)
 
 
 class BaseExt(object):
@@ -31,6 +43,44 @@ class BaseExt(object):
 Base = declarative_base(cls=BaseExt)
 
 
+def timed(stage: str):
+    """
+    Decorator that records the time spent in a Database method as a stage of the check metrics (see brang.metrics).
+
+    :param stage: 'db_read' or 'db_write'
+    :return:
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with get_metrics().timer(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def synchronized(method):
+    """
+    Decorator that serializes calls of a Database method on the instance lock.
+
+    A method that fails while the session flushes leaves the session in a failed
+    transaction; it is rolled back, so that later calls are not affected.
+
+    :param method:
+    :return:
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            try:
+                return method(self, *args, **kwargs)
+            except Exception as e:
+                if not self.session.is_active:
+                    self._rollback(e)
+                raise
+    return wrapper
+
+
 class Setting(Base):
     __tablename__ = 'setting'
     id = Column(Integer, primary_key=True)
@@ -42,31 +92,84 @@ class Site(Base):
     __tablename__ = 'site'
     id = Column(Integer, primary_key=True)
     url = Column(String, unique=True)
+    etag = Column(String)
+    last_modified = Column(String)
+    check_interval = Column(Integer)  # seconds, None for config.default_check_interval
+    next_check = Column(DateTime)  # None if the site is due
+    interval_policy = Column(String)  # see brang.intervals, None for config.default_interval_policy
+    region_selector = Column(String)  # see brang.regions, None to check the whole page
+    change_threshold = Column(Integer)  # min. simhash distance of notified changes, None for the default
+    notified_simhash = Column(String)  # simhash of the version notified last, the baseline of change_threshold
     site_changes = relationship("SiteChange",
                                 backref="site",
                                 cascade="all, delete, delete-orphan")
 
 
+class HfcPattern(Base):
+    __tablename__ = 'hfc_pattern'
+    __table_args__ = {'sqlite_autoincrement': True}  # ids must not be reused, they are cached
+    id = Column(Integer, primary_key=True)
+    digest = Column(String, unique=True)
+    pattern = Column(String)
+
+
+class Snapshot(Base):
+    __tablename__ = 'snapshot'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = Column(Integer, primary_key=True)
+    digest = Column(String, unique=True)  # of the uncompressed body, see brang.snapshots
+    compression = Column(String)
+    size = Column(Integer)  # uncompressed
+    data = Column(LargeBinary)
+
+
 class SiteChange(Base):
     __tablename__ = 'site_change'
     __table_args__ = (UniqueConstraint('site_id', 'fingerprint', 'check_timestamp',
-                                       name='unique_site_fingerprint_timestamp'), )
+                                       name='unique_site_fingerprint_timestamp'),
+                      Index('ix_site_change_site_id_check_timestamp', 'site_id', 'check_timestamp'))
     id = Column(Integer, primary_key=True)
     site_id = Column(Integer, ForeignKey('site.id'))
     fingerprint = Column(String)
-    pattern = Column(String)
+    pattern = Column(String)  # only set by earlier versions, see pattern_id
+    pattern_id = Column(Integer, ForeignKey('hfc_pattern.id'))
+    snapshot_id = Column(Integer, ForeignKey('snapshot.id'))  # None if no snapshot is (or is no longer) kept
+    simhash = Column(String)  # see brang.simhash, None for entries of earlier versions
     check_timestamp = Column(DateTime)
 
 
+class Notification(Base):
+    __tablename__ = 'notification'
+    id = Column(Integer, primary_key=True)
+    recipients = Column(String)  # comma separated
+    subject = Column(String)
+    body = Column(String)
+    created = Column(DateTime)
+    next_attempt = Column(DateTime)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String)
+
+
 class Database(ABC):
     """
     Abstract Base Class for the Database.
     """
 
     @abstractmethod
-    def get_all_sites(self) -> list:
+    def batch(self, flush_size: int = None):
+        """
+        Context manager that groups the writes of its block into few transactions
+
+        :param flush_size: number of writes per transaction
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def get_all_sites(self, refresh: bool = False) -> list:
         """
         Returns a list of site objects
+        :param refresh: if True, already loaded sites are updated with changes of other processes
         :return:
         """
         pass
@@ -91,6 +194,16 @@ class Database(ABC):
         """
         pass
 
+    @abstractmethod
+    def insert_sites(self, urls: list):
+        """
+        Inserts many site entries in one transaction
+
+        :param urls:
+        :return:
+        """
+        pass
+
     @abstractmethod
     def remove_site(self, url: String):
         """
@@ -101,22 +214,127 @@ class Database(ABC):
         """
         pass
 
+    @abstractmethod
+    def update_site_validators(self, site: Site, etag: str, last_modified: str):
+        """
+        Stores the HTTP response validators (ETag, Last-Modified) of a site
+
+        :param site:
+        :param etag: value of the ETag header or None
+        :param last_modified: value of the Last-Modified header or None
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def set_site_check_interval(self, site: Site, check_interval: int):
+        """
+        Sets the interval in which a site is checked by the daemon
+
+        :param site:
+        :param check_interval: seconds, None for the default interval
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def set_site_interval_policy(self, site: Site, interval_policy: str):
+        """
+        Sets the policy that determines the check interval of a site
+
+        :param site:
+        :param interval_policy: name of the policy (see brang.intervals), None for the default policy
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def set_site_region_selector(self, site: Site, region_selector: str):
+        """
+        Sets the region of a site that is checked for changes.
+        A new region drops the validators of the site, see update_site_validators.
+
+        :param site:
+        :param region_selector: see brang.regions, None to check the whole page
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def set_site_change_threshold(self, site: Site, change_threshold: int):
+        """
+        Sets how much a site has to change to be notified
+
+        :param site:
+        :param change_threshold: min. simhash distance in bits (see brang.simhash), None for the default
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def set_site_notified_simhash(self, site: Site, notified_simhash: str):
+        """
+        Stores the simhash of the version of a site that has been notified last
+
+        :param site:
+        :param notified_simhash: see brang.simhash, None to measure the next change against the latest entry
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def update_site_schedule(self, site: Site, next_check: datetime.datetime, check_interval: int):
+        """
+        Stores when a site is due for its next check, and its current check interval
+
+        :param site:
+        :param next_check: datetime, None if the site is due
+        :param check_interval: seconds, None for the default interval
+        :return:
+        """
+        pass
+
     @abstractmethod
     def insert_site_change_entry(self, site: Site,
                                  fingerprint: str,
                                  pattern: str,
-                                 timestamp: datetime.datetime):
+                                 timestamp: datetime.datetime = None,
+                                 snapshot_id: int = None,
+                                 simhash: str = None):
         """
         Inserts a site_change entry
 
         :param site: site instance
         :param fingerprint: string
         :param pattern: string
-        :param timestamp: datetime
+        :param timestamp: datetime, defaults to now
+        :param snapshot_id: id of the snapshot of the fetched body, see insert_snapshot
+        :param simhash: similarity fingerprint of the fetched body, see brang.simhash
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def update_site_change_fingerprint(self, site_change: SiteChange, fingerprint: str):
+        """
+        Replaces the fingerprint of a site_change entry, e.g. by a newer version of the same fingerprint
+
+        :param site_change:
+        :param fingerprint:
         :return:
         """
         pass
 
+    @abstractmethod
+    def get_pattern(self, site_change: SiteChange) -> str:
+        """
+        Returns the hfc-pattern of a SiteChange entry
+
+        :param site_change:
+        :return: pattern, empty if the entry has none
+        """
+        pass
+
     @abstractmethod
     def get_latest_sitechange(self, site: Site) -> SiteChange:
         """
@@ -128,6 +346,170 @@ class Database(ABC):
         """
         pass
 
+    @abstractmethod
+    def get_latest_sitechanges(self, sites: list = None) -> dict:
+        """
+        Returns the latest SiteChange entries of many sites
+
+        :param sites: list of Site objects, all sites if None
+        :return: dict site id -> SiteChange entry; sites without entries are missing
+        """
+        pass
+
+    @abstractmethod
+    def get_site_change_history(self, site_ids: list) -> dict:
+        """
+        Returns the ids and timestamps of all SiteChange entries of some sites
+
+        :param site_ids:
+        :return: dict site id -> list of tuples (id, check_timestamp), newest first
+        """
+        pass
+
+    @abstractmethod
+    def delete_site_changes(self, site_change_ids: list):
+        """
+        Deletes SiteChange entries
+
+        :param site_change_ids:
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def delete_unreferenced_patterns(self) -> int:
+        """
+        Deletes hfc_pattern entries that are not referenced by any SiteChange entry
+
+        :return: number of deleted entries
+        """
+        pass
+
+    @abstractmethod
+    def get_snapshot_id(self, digest: str) -> int:
+        """
+        Returns the id of the snapshot with a digest
+
+        :param digest:
+        :return: id, None if there is no such snapshot
+        """
+        pass
+
+    @abstractmethod
+    def insert_snapshot(self, digest: str, compression: str, size: int, data: bytes) -> int:
+        """
+        Inserts a snapshot, unless a snapshot with the same digest exists
+
+        :param digest: digest of the uncompressed body
+        :param compression: name of the compression of data
+        :param size: size of the uncompressed body
+        :param data: compressed body
+        :return: id of the (existing) snapshot
+        """
+        pass
+
+    @abstractmethod
+    def get_snapshot(self, snapshot_id: int) -> Snapshot:
+        """
+        Returns a snapshot
+
+        :param snapshot_id:
+        :return: Snapshot
+        :raises: SnapshotNotFoundException: if the snapshot does not exist
+        """
+        pass
+
+    @abstractmethod
+    def release_snapshots(self, site_change_ids: list) -> int:
+        """
+        Removes the snapshot references of SiteChange entries
+
+        :param site_change_ids:
+        :return: number of entries that referenced a snapshot
+        """
+        pass
+
+    @abstractmethod
+    def delete_unreferenced_snapshots(self) -> int:
+        """
+        Deletes snapshots that are not referenced by any SiteChange entry
+
+        :return: number of deleted entries
+        """
+        pass
+
+    @abstractmethod
+    def insert_notification(self, recipients: str, subject: str, body: str, next_attempt: datetime.datetime):
+        """
+        Inserts a notification into the outbox
+
+        :param recipients: comma separated e-mail addresses
+        :param subject:
+        :param body:
+        :param next_attempt: datetime at which the notification may be sent
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def get_due_notifications(self, now: datetime.datetime) -> list:
+        """
+        Returns the notifications of the outbox that may be sent
+
+        :param now:
+        :return: list of Notification entries, oldest first
+        """
+        pass
+
+    @abstractmethod
+    def get_next_notification_attempt(self) -> datetime.datetime:
+        """
+        Returns when the next notification of the outbox may be sent
+
+        :return: datetime, None if the outbox is empty
+        """
+        pass
+
+    @abstractmethod
+    def delete_notifications(self, notification_ids: list):
+        """
+        Deletes notifications from the outbox, e.g. because they have been sent
+
+        :param notification_ids:
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def defer_notifications(self, notification_ids: list, next_attempt: datetime.datetime, error: str):
+        """
+        Records a failed delivery of notifications
+
+        :param notification_ids:
+        :param next_attempt: datetime of the next attempt
+        :param error: reason of the failure
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def get_size(self) -> int:
+        """
+        Returns the storage size of the database in bytes
+
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def vacuum(self):
+        """
+        Returns the space of deleted entries to the file system
+
+        :return:
+        """
+        pass
+
     @abstractmethod
     def add_setting(self, key, value):
         """
@@ -139,6 +521,17 @@ class Database(ABC):
         """
         pass
 
+    @abstractmethod
+    def set_setting(self, key, value):
+        """
+        Adds or replaces a Setting entry
+
+        :param key: string
+        :param value: string
+        :return:
+        """
+        pass
+
     @abstractmethod
     def get_setting(self, key) -> str:
         """
@@ -162,15 +555,148 @@ class Database(ABC):
 
 
 class SQLiteDatabase(Database):
+    """
+    SQLite implementation of the Database.
+
+    The instance can be shared by the worker threads of a concurrent check run:
+    all public methods are serialized on a lock, and loaded objects are not
+    expired on commit, so that other threads can read their attributes (and
+    are not re-selected after every commit).
+
+    Database files are opened in WAL journal mode with relaxed syncing (see
+    config.sqlite_journal_mode, config.sqlite_synchronous): a commit does not
+    fsync the database file, the WAL is synced on checkpoints.
+
+    The tables are only created and migrated if the schema version of the
+    database file is older than brang.schema.SCHEMA_VERSION.
+    """
 
     def __init__(self, db_filename):
         self.db_filename = db_filename
-        self.engine = create_engine('sqlite:///' + self.db_filename, echo=False)
-        cls_session = sessionmaker(bind=self.engine)
+        self.lock = threading.RLock()
+        if self.db_filename == ':memory:':
+            # All threads have to share the one connection that holds the in-memory database
+            self.engine = create_engine('sqlite://', echo=False,
+                                        connect_args={'check_same_thread': False},
+                                        poolclass=StaticPool)
+        else:
+            self.engine = create_engine('sqlite:///' + self.db_filename, echo=False,
+                                        connect_args={'check_same_thread': False})
+        event.listen(self.engine, 'connect', self._set_pragmas)
+        cls_session = sessionmaker(bind=self.engine, expire_on_commit=False)
         self.session = cls_session()
+        self._batch_depth = 0
+        self._batch_flush_size = None
+        self._pending_writes = 0
+        self._patterns = {}  # hfc_pattern.id -> pattern
+        self._pattern_ids = {}  # hfc_pattern.digest -> hfc_pattern.id
 
-        Base.metadata.create_all(bind=self.engine)
-        self.setup_tables()
+        if self.get_schema_version() < SCHEMA_VERSION:
+            Base.metadata.create_all(bind=self.engine)
+            self.setup_tables()
+            self.migrate_tables()
+            self.set_schema_version(SCHEMA_VERSION)
+
+    def get_schema_version(self) -> int:
+        """
+        Returns the schema version of the database file (see brang.schema)
+
+        :return:
+        """
+        connection = self.engine.raw_connection()
+        try:
+            return get_schema_version(connection)
+        finally:
+            connection.close()
+
+    def set_schema_version(self, version: int):
+        connection = self.engine.raw_connection()
+        try:
+            set_schema_version(connection, version)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _set_pragmas(self, dbapi_connection, connection_record):
+        """
+        Tunes every new SQLite connection.
+        """
+        cursor = dbapi_connection.cursor()
+        if self.db_filename != ':memory:':
+            cursor.execute(f"PRAGMA journal_mode={config.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={config.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA cache_size={int(config.sqlite_cache_size)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @contextlib.contextmanager
+    def batch(self, flush_size: int = None):
+        """
+        Context manager that groups the writes of its block into few transactions.
+
+        Inside the block, writes are committed once flush_size of them are
+        pending, and when the (outermost) block is left. Reads of the same
+        instance see pending writes. Use it like:
+
+            with db.batch():
+                db.insert_site_change_entry(...)
+
+        :param flush_size: number of writes per transaction, defaults to config.db_flush_size
+        :return:
+        """
+        with self.lock:
+            if self._batch_depth == 0:
+                self._batch_flush_size = config.db_flush_size if flush_size is None else max(1, flush_size)
+                self._pending_writes = 0
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._pending_writes > 0:
+                    self._pending_writes = 0
+                    try:
+                        self.session.commit()
+                    except Exception:
+                        self.session.rollback()
+                        raise
+
+    def _commit(self):
+        """
+        Commits the session, unless the write is part of a batch that is not due yet.
+        Writes of a batch are flushed right away, so that a write that fails raises
+        its own error. A write that fails is rolled back, see _rollback.
+
+        :return:
+        """
+        try:
+            if self._batch_depth > 0:
+                self._pending_writes += 1
+                if self._pending_writes < self._batch_flush_size:
+                    self.session.flush()
+                    return
+                self._pending_writes = 0
+            self.session.commit()
+        except Exception as e:
+            self._rollback(e)
+            raise
+
+    def _rollback(self, error: Exception):
+        """
+        Rolls back the session after a failed write, together with the writes of
+        the current batch that have not been committed yet. The batch goes on
+        with the next write.
+
+        :param error:
+        :return:
+        """
+        log.error(f"Write failed, rolling back {max(1, self._pending_writes)} uncommitted writes. {error}")
+        self._pending_writes = 0
+        self.session.rollback()
+        # Patterns may have been inserted by the rolled back writes
+        self._patterns.clear()
+        self._pattern_ids.clear()
 
     def setup_tables(self):
         """
@@ -180,8 +706,30 @@ class SQLiteDatabase(Database):
         """
         Setting.__table__.create(bind=self.engine, checkfirst=True)
         Site.__table__.create(bind=self.engine, checkfirst=True)
+        HfcPattern.__table__.create(bind=self.engine, checkfirst=True)
+        Snapshot.__table__.create(bind=self.engine, checkfirst=True)
+        Notification.__table__.create(bind=self.engine, checkfirst=True)
         SiteChange.__table__.create(bind=self.engine, checkfirst=True)
 
+    def migrate_tables(self):
+        """
+        Adds columns and indexes to existing tables that have been introduced after the tables were created.
+
+        :return:
+        """
+        inspector = sqlalchemy.inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing_columns:
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        connection.execute(sqlalchemy.text(
+                            f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                for index in table.indexes:
+                    index.create(bind=connection, checkfirst=True)
+
+    @synchronized
     def insert_site(self, url: String):
         """
         Inserts a site entry
@@ -190,8 +738,20 @@ class SQLiteDatabase(Database):
         :return:
         """
         self.session.add(Site(url=url))
+        self._commit()
+
+    @synchronized
+    def insert_sites(self, urls: list):
+        """
+        Inserts many site entries in one transaction
+
+        :param urls:
+        :return:
+        """
+        self.session.add_all([Site(url=url) for url in urls])
         self.session.commit()
 
+    @synchronized
     def remove_site(self, url: String):
         """
         Removes a Site entry from the database
@@ -202,22 +762,28 @@ class SQLiteDatabase(Database):
         try:
             site = self.get_site(url=url)
             self.session.delete(site)
-            self.session.commit()
+            self._commit()
         except SiteNotFoundException:
             pass
 
-    def get_all_sites(self) -> list:
+    @synchronized
+    def get_all_sites(self, refresh: bool = False) -> list:
         """
         Returns a list of site objects
 
+        :param refresh: if True, already loaded sites are updated with changes of other processes
         :return:
         """
-        qr = self.session.query(Site).all()
+        qr = self.session.query(Site)
+        if refresh:
+            qr = qr.populate_existing()
+        qr = qr.all()
         all_sites = []
         for res in qr:
             all_sites.append(res)
         return all_sites
 
+    @synchronized
     def get_site(self, url) -> Site:
         """
         Returns a Site object given a url
@@ -231,25 +797,192 @@ class SQLiteDatabase(Database):
             raise SiteNotFoundException(f"Site with url={url} could not be found.")
         return qr
 
+    @timed('db_write')
+    @synchronized
+    def update_site_validators(self, site: Site, etag: str, last_modified: str):
+        """
+        Stores the HTTP response validators (ETag, Last-Modified) of a site.
+        Nothing is written if they did not change.
+
+        :param site:
+        :param etag: value of the ETag header or None
+        :param last_modified: value of the Last-Modified header or None
+        :return:
+        """
+        if site.etag == etag and site.last_modified == last_modified:
+            return
+        site.etag = etag
+        site.last_modified = last_modified
+        self._commit()
+
+    @synchronized
+    def set_site_check_interval(self, site: Site, check_interval: int):
+        """
+        Sets the interval in which a site is checked by the daemon.
+        The next check is rescheduled by the daemon.
+
+        :param site:
+        :param check_interval: seconds, None for the default interval
+        :return:
+        """
+        site.check_interval = check_interval
+        site.next_check = None
+        self._commit()
+
+    @synchronized
+    def set_site_interval_policy(self, site: Site, interval_policy: str):
+        """
+        Sets the policy that determines the check interval of a site
+
+        :param site:
+        :param interval_policy: name of the policy (see brang.intervals), None for the default policy
+        :return:
+        """
+        site.interval_policy = interval_policy
+        self._commit()
+
+    @synchronized
+    def set_site_region_selector(self, site: Site, region_selector: str):
+        """
+        Sets the region of a site that is checked for changes.
+        A new region drops the validators of the site, see update_site_validators.
+
+        :param site:
+        :param region_selector: see brang.regions, None to check the whole page
+        :return:
+        """
+        if region_selector != site.region_selector:
+            # A 304 to the stored validators would skip the first check of the new region
+            site.etag = None
+            site.last_modified = None
+            site.notified_simhash = None
+        site.region_selector = region_selector
+        self._commit()
+
+    @synchronized
+    def set_site_change_threshold(self, site: Site, change_threshold: int):
+        """
+        Sets how much a site has to change to be notified
+
+        :param site:
+        :param change_threshold: min. simhash distance in bits (see brang.simhash), None for the default
+        :return:
+        """
+        site.change_threshold = change_threshold
+        self._commit()
+
+    @timed('db_write')
+    @synchronized
+    def set_site_notified_simhash(self, site: Site, notified_simhash: str):
+        """
+        Stores the simhash of the version of a site that has been notified last
+
+        :param site:
+        :param notified_simhash: see brang.simhash, None to measure the next change against the latest entry
+        :return:
+        """
+        site.notified_simhash = notified_simhash
+        self._commit()
+
+    @timed('db_write')
+    @synchronized
+    def update_site_schedule(self, site: Site, next_check: datetime.datetime, check_interval: int):
+        """
+        Stores when a site is due for its next check, and its current check interval
+
+        :param site:
+        :param next_check: datetime, None if the site is due
+        :param check_interval: seconds, None for the default interval
+        :return:
+        """
+        site.next_check = next_check
+        site.check_interval = check_interval
+        self._commit()
+
+    @timed('db_write')
+    @synchronized
     def insert_site_change_entry(self, site: Site,
                                  fingerprint: str,
                                  pattern: str = "",
-                                 timestamp: datetime.datetime = datetime.datetime.now()):
+                                 timestamp: datetime.datetime = None,
+                                 snapshot_id: int = None,
+                                 simhash: str = None):
         """
         Inserts a site_change entry
 
         :param site:
         :param fingerprint:
         :param pattern:
-        :param timestamp:
+        :param timestamp: defaults to now
+        :param snapshot_id: id of the snapshot of the fetched body, see insert_snapshot
+        :param simhash: similarity fingerprint of the fetched body, see brang.simhash
         :return:
         """
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
         self.session.add(SiteChange(site_id=site.id,
                                     fingerprint=fingerprint,
-                                    pattern=pattern,
+                                    pattern_id=self._get_pattern_id(pattern),
+                                    snapshot_id=snapshot_id,
+                                    simhash=simhash,
                                     check_timestamp=timestamp))
-        self.session.commit()
+        self._commit()
+
+    def _get_pattern_id(self, pattern: str):
+        """
+        Returns the id of the hfc_pattern entry of a pattern. The entry is created if it does not exist yet.
+        Every distinct pattern is stored only once.
+
+        :param pattern:
+        :return: id, or None for an empty pattern
+        """
+        if not pattern:
+            return None
+        digest = hashlib.sha1(pattern.encode('ascii')).hexdigest()
+        pattern_id = self._pattern_ids.get(digest)
+        if pattern_id is None:
+            hfc_pattern = self.session.query(HfcPattern).filter(HfcPattern.digest == digest).first()
+            if hfc_pattern is None:
+                hfc_pattern = HfcPattern(digest=digest, pattern=pattern)
+                self.session.add(hfc_pattern)
+                self.session.flush()
+            pattern_id = hfc_pattern.id
+            self._pattern_ids[digest] = pattern_id
+            self._patterns[pattern_id] = pattern
+        return pattern_id
+
+    @timed('db_read')
+    @synchronized
+    def get_pattern(self, site_change: SiteChange) -> str:
+        """
+        Returns the hfc-pattern of a SiteChange entry. Patterns are cached.
+
+        :param site_change:
+        :return: pattern, empty if the entry has none
+        """
+        if site_change.pattern_id is None:
+            return site_change.pattern or ""
+        pattern = self._patterns.get(site_change.pattern_id)
+        if pattern is None:
+            pattern = self.session.query(HfcPattern.pattern).filter(HfcPattern.id == site_change.pattern_id).scalar()
+            self._patterns[site_change.pattern_id] = pattern
+        return pattern
+
+    @timed('db_write')
+    @synchronized
+    def update_site_change_fingerprint(self, site_change: SiteChange, fingerprint: str):
+        """
+        Replaces the fingerprint of a site_change entry, e.g. by a newer version of the same fingerprint
 
+        :param site_change:
+        :param fingerprint:
+        :return:
+        """
+        site_change.fingerprint = fingerprint
+        self._commit()
+
+    @timed('db_read')
+    @synchronized
     def get_latest_sitechange(self, site: Site) -> SiteChange:
         """
         Returns the latest SiteChange entry for a Site
@@ -262,13 +995,301 @@ class SQLiteDatabase(Database):
         try:
             qr = self.session.query(SiteChange).\
                 filter(site.id == SiteChange.site_id).\
-                order_by(SiteChange.check_timestamp.desc()).first()
+                order_by(SiteChange.check_timestamp.desc(), SiteChange.id.desc()).first()
         except (sqlalchemy.orm.exc.NoResultFound, sqlalchemy.orm.exc.MultipleResultsFound):
             raise SiteChangeNotFoundException(ex_msg)
         if not qr:
             raise SiteChangeNotFoundException(ex_msg)
         return qr
 
+    @timed('db_read')
+    @synchronized
+    def get_latest_sitechanges(self, sites: list = None) -> dict:
+        """
+        Returns the latest SiteChange entries of many sites.
+
+        For all sites, this is a single query, which uses the (site_id, check_timestamp) index.
+
+        :param sites: list of Site objects, all sites if None
+        :return: dict site id -> SiteChange entry; sites without entries are missing
+        """
+        if sites is None:
+            return self._query_latest_sitechanges(site_ids=None)
+        site_ids = [site.id for site in sites]
+        latest_site_changes = {}
+        for i in range(0, len(site_ids), 500):  # stay below SQLite's limit of query parameters
+            latest_site_changes.update(self._query_latest_sitechanges(site_ids=site_ids[i:i + 500]))
+        return latest_site_changes
+
+    def _query_latest_sitechanges(self, site_ids):
+        latest = self.session.query(SiteChange.site_id.label('site_id'),
+                                    func.max(SiteChange.check_timestamp).label('check_timestamp'))
+        if site_ids is not None:
+            latest = latest.filter(SiteChange.site_id.in_(site_ids))
+        latest = latest.group_by(SiteChange.site_id).subquery()
+        qr = self.session.query(SiteChange).\
+            join(latest, (SiteChange.site_id == latest.c.site_id) &
+                 (SiteChange.check_timestamp == latest.c.check_timestamp)).\
+            order_by(SiteChange.id)
+        # Of entries with the same timestamp, the one inserted last wins (see get_latest_sitechange)
+        return {site_change.site_id: site_change for site_change in qr}
+
+    @timed('db_read')
+    @synchronized
+    def get_site_change_history(self, site_ids: list) -> dict:
+        """
+        Returns the ids and timestamps of all SiteChange entries of some sites
+
+        :param site_ids:
+        :return: dict site id -> list of tuples (id, check_timestamp), newest first
+        """
+        history = {}
+        for i in range(0, len(site_ids), 500):  # stay below SQLite's limit of query parameters
+            qr = self.session.query(SiteChange.site_id, SiteChange.id, SiteChange.check_timestamp).\
+                filter(SiteChange.site_id.in_(site_ids[i:i + 500])).\
+                order_by(SiteChange.site_id, SiteChange.check_timestamp.desc(), SiteChange.id.desc())
+            for site_id, site_change_id, check_timestamp in qr:
+                history.setdefault(site_id, []).append((site_change_id, check_timestamp))
+        return history
+
+    @synchronized
+    def delete_site_changes(self, site_change_ids: list):
+        """
+        Deletes SiteChange entries in one transaction
+
+        :param site_change_ids:
+        :return:
+        """
+        for i in range(0, len(site_change_ids), 500):
+            self.session.query(SiteChange).\
+                filter(SiteChange.id.in_(site_change_ids[i:i + 500])).\
+                delete(synchronize_session=False)
+        self._commit()
+
+    @synchronized
+    def delete_unreferenced_patterns(self) -> int:
+        """
+        Deletes hfc_pattern entries that are not referenced by any SiteChange entry
+
+        :return: number of deleted entries
+        """
+        referenced = self.session.query(SiteChange.pattern_id).filter(SiteChange.pattern_id.isnot(None))
+        deleted = self.session.query(HfcPattern).\
+            filter(HfcPattern.id.notin_(referenced)).\
+            delete(synchronize_session=False)
+        self._commit()
+        self._patterns.clear()
+        self._pattern_ids.clear()
+        return deleted
+
+    @timed('db_read')
+    @synchronized
+    def get_snapshot_id(self, digest: str) -> int:
+        """
+        Returns the id of the snapshot with a digest
+
+        :param digest:
+        :return: id, None if there is no such snapshot
+        """
+        return self._query_snapshot_id(digest=digest)
+
+    def _query_snapshot_id(self, digest: str):
+        qr = self.session.query(Snapshot.id).filter(Snapshot.digest == digest).first()
+        return None if qr is None else qr[0]
+
+    @timed('db_write')
+    @synchronized
+    def insert_snapshot(self, digest: str, compression: str, size: int, data: bytes) -> int:
+        """
+        Inserts a snapshot, unless a snapshot with the same digest exists
+
+        :param digest: digest of the uncompressed body
+        :param compression: name of the compression of data
+        :param size: size of the uncompressed body
+        :param data: compressed body
+        :return: id of the (existing) snapshot
+        """
+        snapshot_id = self._query_snapshot_id(digest=digest)
+        if snapshot_id is not None:
+            return snapshot_id
+        snapshot = Snapshot(digest=digest, compression=compression, size=size, data=data)
+        self.session.add(snapshot)
+        self.session.flush()
+        snapshot_id = snapshot.id
+        # The body is not needed in memory anymore
+        self.session.expunge(snapshot)
+        self._commit()
+        return snapshot_id
+
+    @timed('db_read')
+    @synchronized
+    def get_snapshot(self, snapshot_id: int) -> Snapshot:
+        """
+        Returns a snapshot
+
+        :param snapshot_id:
+        :return: Snapshot
+        :raises: SnapshotNotFoundException: if the snapshot does not exist
+        """
+        qr = self.session.query(Snapshot).filter(Snapshot.id == snapshot_id).first()
+        if qr is None:
+            raise SnapshotNotFoundException(f"Snapshot with id={snapshot_id} could not be found.")
+        return qr
+
+    @synchronized
+    def release_snapshots(self, site_change_ids: list) -> int:
+        """
+        Removes the snapshot references of SiteChange entries
+
+        :param site_change_ids:
+        :return: number of entries that referenced a snapshot
+        """
+        released = 0
+        for i in range(0, len(site_change_ids), 500):
+            released += self.session.query(SiteChange).\
+                filter(SiteChange.id.in_(site_change_ids[i:i + 500])).\
+                filter(SiteChange.snapshot_id.isnot(None)).\
+                update({SiteChange.snapshot_id: None}, synchronize_session=False)
+        self._commit()
+        return released
+
+    @synchronized
+    def delete_unreferenced_snapshots(self) -> int:
+        """
+        Deletes snapshots that are not referenced by any SiteChange entry
+
+        :return: number of deleted entries
+        """
+        referenced = self.session.query(SiteChange.snapshot_id).filter(SiteChange.snapshot_id.isnot(None))
+        deleted = self.session.query(Snapshot).\
+            filter(Snapshot.id.notin_(referenced)).\
+            delete(synchronize_session=False)
+        self._commit()
+        return deleted
+
+    @synchronized
+    def insert_notification(self, recipients: str, subject: str, body: str, next_attempt: datetime.datetime):
+        """
+        Inserts a notification into the outbox
+
+        :param recipients: comma separated e-mail addresses
+        :param subject:
+        :param body:
+        :param next_attempt: datetime at which the notification may be sent
+        :return:
+        """
+        self.session.add(Notification(recipients=recipients,
+                                      subject=subject,
+                                      body=body,
+                                      created=datetime.datetime.now(),
+                                      next_attempt=next_attempt,
+                                      attempts=0))
+        self._commit()
+
+    @synchronized
+    def get_due_notifications(self, now: datetime.datetime) -> list:
+        """
+        Returns the notifications of the outbox that may be sent
+
+        :param now:
+        :return: list of Notification entries, oldest first
+        """
+        # Refresh loaded entries, which are updated in bulk by defer_notifications
+        return self.session.query(Notification).populate_existing().\
+            filter(Notification.next_attempt <= now).\
+            order_by(Notification.created, Notification.id).all()
+
+    @synchronized
+    def get_next_notification_attempt(self) -> datetime.datetime:
+        """
+        Returns when the next notification of the outbox may be sent
+
+        :return: datetime, None if the outbox is empty
+        """
+        return self.session.query(func.min(Notification.next_attempt)).scalar()
+
+    @synchronized
+    def delete_notifications(self, notification_ids: list):
+        """
+        Deletes notifications from the outbox, e.g. because they have been sent
+
+        :param notification_ids:
+        :return:
+        """
+        for i in range(0, len(notification_ids), 500):
+            self.session.query(Notification).\
+                filter(Notification.id.in_(notification_ids[i:i + 500])).\
+                delete(synchronize_session=False)
+        self._commit()
+
+    @synchronized
+    def defer_notifications(self, notification_ids: list, next_attempt: datetime.datetime, error: str):
+        """
+        Records a failed delivery of notifications
+
+        :param notification_ids:
+        :param next_attempt: datetime of the next attempt
+        :param error: reason of the failure
+        :return:
+        """
+        for i in range(0, len(notification_ids), 500):
+            self.session.query(Notification).\
+                filter(Notification.id.in_(notification_ids[i:i + 500])).\
+                update({Notification.next_attempt: next_attempt,
+                        Notification.attempts: Notification.attempts + 1,
+                        Notification.last_error: error}, synchronize_session=False)
+        self._commit()
+
+    @synchronized
+    def get_size(self) -> int:
+        """
+        Returns the size of the database file, including its write-ahead log, in bytes
+
+        :return:
+        """
+        size = 0
+        for filename in [self.db_filename, self.db_filename + '-wal']:
+            if filename != ':memory:' and os.path.exists(filename):
+                size += os.path.getsize(filename)
+        return size
+
+    @synchronized
+    def vacuum(self):
+        """
+        Checkpoints the write-ahead log and rebuilds the database file without free pages
+
+        :return:
+        """
+        self.session.commit()
+        if self.db_filename == ':memory:':
+            return
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            cursor.execute("VACUUM")
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            cursor.close()
+        finally:
+            connection.close()
+
+    @synchronized
+    def set_setting(self, key, value):
+        """
+        Adds or replaces a Setting entry
+
+        :param key: string
+        :param value: string
+        :return:
+        """
+        setting = self.session.query(Setting).filter(Setting.key == key).first()
+        if setting is None:
+            self.session.add(Setting(key=key, value=value))
+        else:
+            setting.value = value
+        self._commit()
+
+    @synchronized
     def add_setting(self, key, value):
         """
         Add Setting entry
@@ -278,8 +1299,9 @@ class SQLiteDatabase(Database):
         :return:
         """
         self.session.add(Setting(key=key, value=value))
-        self.session.commit()
+        self._commit()
 
+    @synchronized
     def remove_setting(self, key):
         """
         Remove Setting entry
@@ -290,10 +1312,11 @@ class SQLiteDatabase(Database):
         try:
             setting = self.get_setting(key)
             self.session.delete(setting)
-            self.session.commit()
+            self._commit()
         except SettingNotFoundException:
             pass
 
+    @synchronized
     def get_setting(self, key) -> str:
         """
         Returns a value from the key, value store
@@ -0,0 +1,176 @@
+import collections
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+
+def host_of(url: str):
+    """
+    Returns the host part of a URL (lower case), or an empty string.
+
+    :param url:
+    :return:
+    """
+    return (urlsplit(url).hostname or '').lower()
+
+
+def run_check_steps(steps):
+    """
+    Runs the steps of a check (see ChangeCheckStrategy.check_steps) in the calling thread.
+    The waits requested by the check are slept.
+
+    :param steps: generator that yields waits in seconds
+    :return: result of the check
+    """
+    try:
+        delay = next(steps)
+        while True:
+            time.sleep(delay)
+            delay = steps.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+class _Task(object):
+    __slots__ = ('index', 'site', 'host', 'steps')
+
+    def __init__(self, index, site, host):
+        self.index = index
+        self.site = site
+        self.host = host
+        self.steps = None
+
+
+class CheckEngine(object):
+    """
+    CheckEngine runs the checks of many sites.
+
+    A check is a generator (see ChangeCheckStrategy.check_steps): it yields
+    whenever it has to wait, e.g. between two samples of a site, and returns
+    its result. The engine runs the steps between the waits and schedules the
+    continuation of a check when its wait is over, so that waiting checks do
+    not block a worker and the waits of many sites overlap.
+
+    With more than one worker, the steps are executed by a thread pool.
+    Besides the global worker count, the number of steps that run against
+    the same host at the same time is capped by workers_per_host. Sites of a
+    host that is at its cap wait in a per-host queue, so they do not occupy
+    a worker thread of the pool. The number of started checks that are
+    waiting (and holding their samples in memory) is capped by max_waiting.
+    """
+
+    def __init__(self, check_steps, workers: int = 1, workers_per_host: int = 1, max_waiting: int = None):
+        """
+        :param check_steps: callable taking a Site, returning the generator of the check
+        :param workers: global number of worker threads
+        :param workers_per_host: max. number of concurrent steps per host
+        :param max_waiting: max. number of waiting checks before no new check is started,
+                            defaults to 8 per worker
+        """
+        self.check_steps = check_steps
+        self.workers = max(1, workers)
+        self.workers_per_host = max(1, workers_per_host)
+        self.max_waiting = 8 * self.workers if max_waiting is None else max(1, max_waiting)
+
+    def _step(self, task: _Task):
+        """
+        Runs the check of a task until it waits or ends. Exceptions are captured.
+
+        :param task:
+        :return: tuple ('wait', seconds) or ('done', result, exception)
+        """
+        try:
+            if task.steps is None:
+                task.steps = self.check_steps(task.site)
+            return 'wait', next(task.steps)
+        except StopIteration as e:
+            return 'done', e.value, None
+        except Exception as e:
+            return 'done', None, e
+
+    def _submit(self, executor, task):
+        if executor is None:
+            future = Future()
+            future.set_result(self._step(task))
+            return future
+        return executor.submit(self._step, task)
+
+    def run(self, sites: list, stop_event=None) -> list:
+        """
+        Checks all sites.
+
+        Exceptions raised by a check do not abort the run. They are returned
+        along with the site instead.
+
+        :param sites: list of Site objects
+        :param stop_event: threading.Event; once it is set, no further check is
+                           started, but started checks are completed
+        :return: list of tuples (site, result, exception) in the order of sites;
+                 result and exception are None for checks that have not been started
+        """
+        results = [(site, None, None) for site in sites]
+        ready = collections.OrderedDict()  # host -> deque of tasks
+        for i, site in enumerate(sites):
+            host = host_of(site.url)
+            ready.setdefault(host, collections.deque()).append(_Task(i, site, host))
+
+        waiting = []  # heap of (due time, sequence number, task)
+        sequence = itertools.count()
+        running = {}
+        running_per_host = collections.Counter()
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            while ready or running or waiting:
+                if stop_event is not None and stop_event.is_set():
+                    # Drop the checks that have not been started yet
+                    for host in list(ready):
+                        ready[host] = collections.deque(task for task in ready[host] if task.steps is not None)
+                        if not ready[host]:
+                            del ready[host]
+                    if not (ready or running or waiting):
+                        break
+                now = time.monotonic()
+                while waiting and waiting[0][0] <= now:
+                    task = heapq.heappop(waiting)[2]
+                    # Continue started checks first, they hold their samples in memory
+                    ready.setdefault(task.host, collections.deque()).appendleft(task)
+
+                for host in list(ready):
+                    if len(running) >= self.workers:
+                        break
+                    queue = ready[host]
+                    while (queue and len(running) < self.workers
+                           and running_per_host[host] < self.workers_per_host):
+                        if queue[0].steps is None and len(waiting) >= self.max_waiting:
+                            break
+                        task = queue.popleft()
+                        running[self._submit(executor, task)] = task
+                        running_per_host[host] += 1
+                    if not queue:
+                        del ready[host]
+
+                timeout = max(0.0, waiting[0][0] - time.monotonic()) if waiting else None
+                if running:
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = []
+                    if timeout:
+                        time.sleep(timeout)
+
+                for future in done:
+                    task = running.pop(future)
+                    running_per_host[task.host] -= 1
+                    outcome = future.result()
+                    if outcome[0] == 'wait':
+                        heapq.heappush(waiting, (time.monotonic() + outcome[1], next(sequence), task))
+                    else:
+                        results[task.index] = (task.site, outcome[1], outcome[2])
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        return results
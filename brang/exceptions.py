@@ -6,6 +6,14 @@ class RequestError(Exception):
     pass
 
 
+class ThrottledError(RequestError):
+    """Raised when a host has answered with 429/503, i.e. asks to retry later"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 class SiteNotFoundException(Exception):
     """Raised when a Site could not be found"""
     pass
@@ -18,3 +26,10 @@ class SiteChangeNotFoundException(Exception):
 class SettingNotFoundException(Exception):
     """Raised when a Setting entry could not be found"""
 
+
+class SnapshotNotFoundException(Exception):
+    """Raised when a Snapshot could not be found"""
+
+
+class SchemaOutdatedException(Exception):
+    """Raised when a database file does not exist or has an older schema than required"""
@@ -0,0 +1,67 @@
+import html
+import re
+
+import brang.config as config
+from brang.segments import Segments, changed_segments, pattern_mask
+
+_TAG_RE = re.compile(r'<[^>]*>?')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def segment_text(segment) -> str:
+    """
+    Renders a segment for a notification: its text without tags, or the tag itself
+    if it has no text. Closing tags without text are rendered empty.
+
+    :param segment: bytes or str
+    :return:
+    """
+    if isinstance(segment, bytes):
+        segment = segment.decode('utf-8', errors='replace')
+    text = _SPACE_RE.sub(' ', html.unescape(_TAG_RE.sub(' ', segment))).strip()
+    if text or segment.startswith('</'):
+        return text
+    return _SPACE_RE.sub(' ', segment).strip()
+
+
+def shorten(text: str, length: int) -> str:
+    return text if len(text) <= length else text[:max(0, length - 3)] + '...'
+
+
+def create_excerpts(old_text, old_pattern: str, new_text, new_pattern: str,
+                    max_excerpts: int = None, max_length: int = None) -> list:
+    """
+    Describes how the stable content of a document has changed.
+
+    The segments that are not masked by the hfc-patterns (i.e. not volatile)
+    are compared by their hashes (see changed_segments); no text diff is
+    computed. Added segments are listed first ("+ "), then removed ones ("- ").
+
+    :param old_text: previous version of the document (bytes or str)
+    :param old_pattern: hfc-pattern of the previous version
+    :param new_text: current version of the document
+    :param new_pattern: hfc-pattern of the current version
+    :param max_excerpts: max. number of excerpts, defaults to config.excerpt_max_count
+    :param max_length: max. length of an excerpt, defaults to config.excerpt_max_length
+    :return: list of excerpts (str); if excerpts are left out, the last entry says how many
+    """
+    max_excerpts = config.excerpt_max_count if max_excerpts is None else max_excerpts
+    max_length = config.excerpt_max_length if max_length is None else max_length
+    old_segments = Segments(old_text)
+    new_segments = Segments(new_text)
+    removed, added = changed_segments(old_segments, pattern_mask(old_segments, old_pattern),
+                                      new_segments, pattern_mask(new_segments, new_pattern))
+    excerpts = []
+    changes = [('+', new_segments, i) for i in added] + [('-', old_segments, i) for i in removed]
+    omitted = 0
+    for sign, segments, i in changes:
+        text = segment_text(segments[i])
+        if not text:
+            continue
+        if len(excerpts) < max_excerpts:
+            excerpts.append(f"{sign} {shorten(text, max_length)}")
+        else:
+            omitted += 1
+    if omitted:
+        excerpts.append(f"({omitted} more changes)")
+    return excerpts
@@ -0,0 +1,360 @@
+import datetime
+import email.utils
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+import brang.config as config
+from brang.exceptions import RequestError
+from brang.metrics import get_metrics
+
+log = logging.getLogger(__name__)
+
+# Responses with these status codes throttle the host, for the time given by their Retry-After header
+THROTTLING_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(value: str, now: float = None):
+    """
+    Parses the value of a Retry-After header, which is either seconds or an HTTP date.
+
+    :param value:
+    :param now: current time (time.time()), used for dates
+    :return: seconds to wait (>= 0), None if the value is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    now = time.time() if now is None else now
+    return max(0.0, date.timestamp() - now)
+
+
+class TokenBucket(object):
+    """
+    Token bucket of one host: a request takes a token, tokens refill at rate
+    per second up to burst. A request that finds no token has to wait until
+    one has been refilled. It is debited right away, so that the tokens of
+    waiting requests are not handed out twice.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.last = now
+
+    def delay(self, now: float) -> float:
+        """
+        :param now: time.monotonic()
+        :return: seconds until a token is available
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter(object):
+    """
+    RateLimiter spaces the requests per host by token buckets.
+
+    The rate (requests per second) and burst of a bucket are configured per
+    domain (config.rate_limit_hosts); a domain also covers its subdomains,
+    which share its bucket. Other hosts get a bucket of their own with the
+    default rate and burst (config.rate_limit_rate, config.rate_limit_burst).
+    A rate of None disables the limit.
+
+    A host that answers with 429 Too Many Requests or 503 Service Unavailable
+    is blocked for the time given by its Retry-After header (see defer).
+    """
+
+    def __init__(self, rate: float = None, burst: float = None, hosts: dict = None):
+        """
+        :param rate: default requests per second, defaults to config.rate_limit_rate
+        :param burst: default burst size, defaults to config.rate_limit_burst
+        :param hosts: domain -> tuple (rate, burst), defaults to config.rate_limit_hosts
+        """
+        self.rate = config.rate_limit_rate if rate is None else rate
+        self.burst = config.rate_limit_burst if burst is None else burst
+        self.hosts = {domain.lower(): limit
+                      for domain, limit in (config.rate_limit_hosts if hosts is None else hosts).items()}
+        self._buckets = {}  # bucket key -> TokenBucket
+        self._blocked_until = {}  # bucket key -> time.monotonic()
+        self._lock = threading.Lock()
+
+    def _limit_of(self, host: str):
+        """
+        :param host:
+        :return: tuple (bucket key, rate, burst)
+        """
+        domain = host
+        while True:
+            limit = self.hosts.get(domain)
+            if limit is not None:
+                return (domain,) + tuple(limit)
+            if '.' not in domain:
+                return host, self.rate, self.burst
+            domain = domain.split('.', 1)[1]
+
+    def _bucket(self, key: str, rate: float, burst: float, now: float):
+        bucket = self._buckets.get(key)
+        if bucket is None and rate:
+            bucket = self._buckets[key] = TokenBucket(rate=rate, burst=burst, now=now)
+        return bucket
+
+    def reserve(self, host: str, max_wait: float = None):
+        """
+        Reserves a request to a host.
+
+        :param host:
+        :param max_wait: if the request would have to wait longer, nothing is reserved
+        :return: seconds to wait before the request is sent, None if that exceeds max_wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            key, rate, burst = self._limit_of(host.lower())
+            bucket = self._bucket(key, rate, burst, now)
+            delay = 0.0 if bucket is None else bucket.delay(now)
+            delay = max(delay, self._blocked_until.get(key, now) - now)
+            if max_wait is not None and delay > max_wait:
+                return None
+            if bucket is not None:
+                bucket.take()
+            return delay
+
+    def defer(self, host: str, seconds: float):
+        """
+        Blocks a host, e.g. because of its Retry-After header.
+
+        :param host:
+        :param seconds:
+        :return:
+        """
+        with self._lock:
+            key = self._limit_of(host.lower())[0]
+            blocked_until = time.monotonic() + seconds
+            self._blocked_until[key] = max(self._blocked_until.get(key, blocked_until), blocked_until)
+        log.info(f"Host {host} is throttled for {seconds:.0f}s.")
+
+
+class DnsCache(object):
+    """
+    Caches the addresses of hosts, as resolved by socket.getaddrinfo, while it is enabled.
+
+    Every Fetcher has a DnsCache of its own, which is used only for the
+    connections of its session (see DnsCachingAdapter); name resolution of the
+    rest of the process is not affected. It is enabled while the Fetcher is
+    used as a context manager and cleared when it is left, so results are
+    cached for the duration of a check run only.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._users = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._users > 0
+
+    def getaddrinfo(self, host: str, port: int) -> list:
+        """
+        Resolves a host for a TCP connection. Failed lookups are not cached.
+
+        :param host:
+        :param port:
+        :return: see socket.getaddrinfo
+        :raises: socket.gaierror: if the host cannot be resolved
+        """
+        key = (host, port)
+        result = self._cache.get(key)
+        if result is None:
+            with get_metrics().timer('dns'):
+                result = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+            if self.enabled:
+                self._cache[key] = result
+        return result
+
+    def enable(self):
+        with self._lock:
+            self._users += 1
+
+    def disable(self):
+        with self._lock:
+            if self._users == 0:
+                return
+            self._users -= 1
+            if self._users == 0:
+                self._cache.clear()
+
+
+class _CachedResolutionMixin(object):
+    """
+    Connects an urllib3 connection to the addresses of its host from a DnsCache, one after another.
+    """
+
+    dns_cache = None
+
+    def _new_conn(self):
+        dns_cache = self.dns_cache
+        if dns_cache is None or not dns_cache.enabled:
+            return super()._new_conn()
+        host = self._dns_host
+        try:
+            addresses = dns_cache.getaddrinfo(host, self.port)
+        except socket.gaierror:
+            return super()._new_conn()  # urllib3 reports the error
+        error = None
+        try:
+            for _, _, _, _, sockaddr in addresses:
+                self._dns_host = sockaddr[0]
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    error = e
+        finally:
+            self._dns_host = host
+        raise error
+
+
+class DnsCachingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections resolve their hosts by a DnsCache.
+    """
+
+    def __init__(self, dns_cache: DnsCache, **kwargs):
+        self.dns_cache = dns_cache
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': self._caching_pool_class(HTTPConnectionPool),
+            'https': self._caching_pool_class(HTTPSConnectionPool),
+        }
+
+    def _caching_pool_class(self, pool_class):
+        connection_class = type(pool_class.ConnectionCls.__name__,
+                                (_CachedResolutionMixin, pool_class.ConnectionCls),
+                                {'dns_cache': self.dns_cache})
+        return type(pool_class.__name__, (pool_class,), {'ConnectionCls': connection_class})
+
+
+class Fetcher(object):
+    """
+    Fetcher performs the HTTP requests of brang.
+
+    It owns a requests.Session whose connection pools keep connections alive
+    and reuse them per host, e.g. for the repeated requests of the HFC strategy.
+    Used as a context manager, it caches the DNS results of its connections
+    (see DnsCache) until the block is left:
+
+        with fetcher:
+            fetcher.get(url)
+
+    The requests per host are limited by the RateLimiter of the fetcher.
+    """
+
+    def __init__(self, pool_connections: int = None, pool_maxsize: int = None, timeout: float = None,
+                 rate_limiter: RateLimiter = None):
+        """
+        :param pool_connections: number of hosts to keep a connection pool for,
+                                 defaults to config.http_pool_connections
+        :param pool_maxsize: max. number of connections kept per host, defaults to config.http_pool_maxsize
+        :param timeout: connect and read timeout in seconds, defaults to config.http_timeout
+        :param rate_limiter: defaults to a RateLimiter configured by config.rate_limit_*
+        """
+        self.pool_connections = config.http_pool_connections if pool_connections is None else pool_connections
+        self.pool_maxsize = config.http_pool_maxsize if pool_maxsize is None else pool_maxsize
+        self.timeout = config.http_timeout if timeout is None else timeout
+        self.rate_limiter = RateLimiter() if rate_limiter is None else rate_limiter
+
+        self.dns_cache = DnsCache()
+        self.session = requests.Session()
+        adapter = DnsCachingAdapter(dns_cache=self.dns_cache,
+                                    pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url: str, headers: dict = None, stream: bool = False, reserved: bool = False) -> requests.Response:
+        """
+        Performs a GET request using the pooled session.
+
+        Unless the request has been reserved with the rate limiter already,
+        it is reserved and the calling thread sleeps until it may be sent.
+        If the host answers with 429 or 503, it is blocked for the time
+        given by the Retry-After header of the response.
+
+        :param url:
+        :param headers: additional request headers
+        :param stream: if True, the body is not downloaded before it is accessed
+        :param reserved: True if the caller has reserved (and waited for) the request
+        :return: requests.Response
+        :raises: RequestError: if the host is throttled for longer than config.rate_limit_max_wait
+        """
+        host = urlsplit(url).hostname or ''
+        if not reserved:
+            delay = self.rate_limiter.reserve(host, max_wait=config.rate_limit_max_wait)
+            if delay is None:
+                raise RequestError(f"Host {host} is throttled.")
+            if delay > 0:
+                time.sleep(delay)
+        response = self.session.get(url, headers=headers, stream=stream, timeout=self.timeout)
+        if response.status_code in THROTTLING_STATUS_CODES:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                self.rate_limiter.defer(host, retry_after)
+        return response
+
+    def close(self):
+        """
+        Closes all pooled connections.
+
+        :return:
+        """
+        self.session.close()
+
+    def __enter__(self):
+        self.dns_cache.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.dns_cache.disable()
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher() -> Fetcher:
+    """
+    Returns the Fetcher that is shared by all users that do not bring their own.
+
+    :return:
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = Fetcher()
+        return _default_fetcher
@@ -0,0 +1,225 @@
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+import brang.config as config
+from brang.database import Database
+from brang.exceptions import ThrottledError
+from brang.fetcher import Fetcher, get_default_fetcher, parse_retry_after, THROTTLING_STATUS_CODES
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# A URL without scheme that starts with a host (and port), e.g. example.com:8080/path
+_HOST_RE = re.compile(r'^[^/:@?#]+(:\d+)?([/?#]|$)')
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL, so that equivalent URLs of a site compare equal:
+    URLs without a scheme get http://, scheme and host are lower-cased,
+    default ports and fragments are dropped, and an empty path becomes /.
+
+    :param url:
+    :return: normalized URL
+    :raises: ValueError: if the URL is not a valid http(s) URL
+    """
+    url = url.strip()
+    if not url or any(c.isspace() for c in url):
+        raise ValueError("URL is empty or contains whitespace.")
+    if '://' not in url:
+        if not _HOST_RE.match(url):
+            raise ValueError("URL has no http(s) scheme.")
+        url = 'http://' + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        raise ValueError(f"Scheme '{scheme}' is not supported.")
+    host = parts.hostname
+    if not host:
+        raise ValueError("URL has no host.")
+    port = parts.port  # raises ValueError for invalid ports
+    netloc = f"[{host}]" if ':' in host else host
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    if parts.username is not None:
+        userinfo = parts.netloc.rsplit('@', 1)[0]
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def read_urls(lines) -> list:
+    """
+    Reads URLs, one per line. Empty lines and lines starting with # are skipped.
+
+    :param lines: iterable of str, e.g. a file
+    :return: list of URLs
+    """
+    urls = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+    return urls
+
+
+def validate_url(url: str, fetcher: Fetcher = None, max_wait: float = None):
+    """
+    Tests if a URL can be requested. The body of the response is not downloaded.
+
+    The request waits for the rate limiter of the fetcher, like the requests of
+    a check run. A host that answers with 429 or 503 and Retry-After is asked
+    again after the time it asks for, up to config.http_max_retries times.
+
+    :param url:
+    :param fetcher: defaults to the shared Fetcher
+    :param max_wait: max. seconds to wait for the host, defaults to config.rate_limit_max_wait
+    :return: None if the URL is valid, else the reason why it is not
+    :raises: ThrottledError: if the host is throttled for longer than max_wait,
+             i.e. the URL could not be validated
+    """
+    fetcher = get_default_fetcher() if fetcher is None else fetcher
+    max_wait = config.rate_limit_max_wait if max_wait is None else max_wait
+    host = urlsplit(url).hostname or ''
+    retries = config.http_max_retries
+    while True:
+        delay = fetcher.rate_limiter.reserve(host, max_wait=max_wait)
+        if delay is None:
+            raise ThrottledError(f"Host {host} is throttled.")
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            response = fetcher.get(url, stream=True, reserved=True)
+        except Exception as e:
+            return f"Request failed. {e.__class__.__name__}: {e}"
+        try:
+            if response.status_code in THROTTLING_STATUS_CODES:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is not None:
+                    if retries <= 0 or retry_after > max_wait:
+                        raise ThrottledError(f"Host {host} is throttled.", retry_after=retry_after)
+                    retries -= 1
+                    continue
+            if response.status_code != 200:
+                return f"Status {response.status_code}."
+        finally:
+            response.close()
+        return None
+
+
+_THROTTLED = object()  # result of _validate for URLs whose host is throttled
+
+
+def _validate(url: str, fetcher: Fetcher, max_wait: float):
+    """
+    :return: see validate_url, or _THROTTLED if the URL could not be validated
+    """
+    try:
+        return validate_url(url, fetcher=fetcher, max_wait=max_wait)
+    except ThrottledError as e:
+        log.warning(f"Could not validate url={url}. {e}")
+        return _THROTTLED
+
+
+class ImportReport(object):
+    """
+    Result of an import.
+    """
+
+    def __init__(self):
+        self.accepted = []  # normalized URLs that have been inserted
+        self.rejected = []  # tuples (URL, reason)
+        self.unvalidated = []  # accepted URLs that could not be validated, because their host is throttled
+
+    def __repr__(self):
+        return (f"ImportReport(accepted={len(self.accepted)}, rejected={len(self.rejected)}, "
+                f"unvalidated={len(self.unvalidated)})")
+
+    def format(self) -> str:
+        """
+        :return: human readable report, listing every URL
+        """
+        unvalidated = set(self.unvalidated)
+        lines = [f"? {url}: Not validated (throttled)." if url in unvalidated else f"+ {url}"
+                 for url in self.accepted]
+        lines += [f"- {url}: {reason}" for url, reason in self.rejected]
+        if unvalidated:
+            lines.append(f"Accepted {len(self.accepted)} ({len(unvalidated)} not validated) "
+                         f"and rejected {len(self.rejected)} URLs.")
+        else:
+            lines.append(f"Accepted {len(self.accepted)} and rejected {len(self.rejected)} URLs.")
+        return '\n'.join(lines)
+
+
+def import_sites(db: Database, urls: list, validate: bool = True, workers: int = None,
+                 timeout: float = None, fetcher: Fetcher = None, max_wait: float = None) -> ImportReport:
+    """
+    Imports many sites at once.
+
+    The URLs are normalized (see normalize_url) and deduplicated, among
+    themselves and against the URLs of the existing sites. The remaining URLs
+    are validated concurrently by a pool of workers (see validate_url), and
+    all valid ones are inserted in a single transaction.
+
+    Validations wait for the rate limit of their host, up to config.import_max_wait.
+    URLs of a host that stays throttled longer are inserted as well, but
+    reported as not validated (ImportReport.unvalidated) rather than as invalid.
+
+    :param db:
+    :param urls: list of URLs
+    :param validate: if False, URLs are not requested
+    :param workers: number of concurrent validations, defaults to config.import_workers
+    :param timeout: timeout of a validation in seconds, defaults to config.import_timeout
+    :param fetcher: used for the validation, defaults to a Fetcher with the timeout
+    :param max_wait: max. seconds a validation waits for its host, defaults to config.import_max_wait
+    :return: ImportReport
+    """
+    workers = config.import_workers if workers is None else workers
+    max_wait = config.import_max_wait if max_wait is None else max_wait
+    report = ImportReport()
+    known = {}  # normalized URL -> reason for rejecting it again
+    for site in db.get_all_sites():
+        try:
+            known[normalize_url(site.url)] = "Site exists already."
+        except ValueError:
+            known[site.url] = "Site exists already."
+    candidates = []
+    for url in urls:
+        try:
+            normalized = normalize_url(url)
+        except ValueError as e:
+            report.rejected.append((url, f"Invalid URL. {e}"))
+            continue
+        if normalized in known:
+            report.rejected.append((url, known[normalized]))
+            continue
+        known[normalized] = f"Duplicate of {url}."
+        candidates.append(normalized)
+
+    if validate and candidates:
+        own_fetcher = fetcher is None
+        if own_fetcher:
+            fetcher = Fetcher(timeout=config.import_timeout if timeout is None else timeout)
+        log.info(f"Validating {len(candidates)} URLs with {workers} workers.")
+        try:
+            with fetcher, ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                reasons = list(executor.map(lambda url: _validate(url, fetcher, max_wait), candidates))
+        finally:
+            if own_fetcher:
+                fetcher.close()
+    else:
+        reasons = [None] * len(candidates)
+
+    for url, reason in zip(candidates, reasons):
+        if reason is None or reason is _THROTTLED:
+            report.accepted.append(url)
+            if reason is _THROTTLED:
+                report.unvalidated.append(url)
+        else:
+            report.rejected.append((url, reason))
+    if report.accepted:
+        db.insert_sites(urls=report.accepted)
+    log.info(f"Imported {len(report.accepted)} sites, rejected {len(report.rejected)} URLs.")
+    return report
@@ -0,0 +1,113 @@
+import datetime
+import logging
+
+import brang.config as config
+from brang.database import Site
+
+log = logging.getLogger(__name__)
+
+FIXED = 'fixed'
+ADAPTIVE = 'adaptive'
+
+
+class FixedIntervalPolicy(object):
+    """
+    Checks a site in its configured check_interval (config.default_check_interval if it has none).
+    """
+
+    name = FIXED
+    needs_history = False
+
+    def next_interval(self, site: Site, update_detected: bool, history: list, now: datetime.datetime) -> int:
+        """
+        :param site:
+        :param update_detected: result of the check, None if the check failed
+        :param history: check timestamps of the site's SiteChange entries, newest first
+        :param now:
+        :return: interval in seconds until the next check
+        """
+        return site.check_interval if site.check_interval else config.default_check_interval
+
+
+class AdaptiveIntervalPolicy(object):
+    """
+    Learns the check interval of a site from its SiteChange history.
+
+    Every SiteChange entry but the first one of a site records a change, so
+    the history yields an estimated change rate: the number of changes per
+    time since the first entry. The estimated interval checks a site
+    checks_per_change times per expected change.
+
+    The interval itself moves by a factor of backoff per check: it shrinks
+    when a change is detected and grows while nothing changes, but it stays
+    within a factor of backoff of the estimate (if there is one yet). Thus a
+    site that stops changing is checked less and less often, and a site that
+    starts changing is caught up with quickly. The interval is bounded by
+    min_interval and max_interval.
+    """
+
+    name = ADAPTIVE
+    needs_history = True
+
+    def __init__(self, min_interval: int = None, max_interval: int = None,
+                 backoff: float = None, checks_per_change: float = None):
+        """
+        :param min_interval: seconds, defaults to config.adaptive_min_interval
+        :param max_interval: seconds, defaults to config.adaptive_max_interval
+        :param backoff: factor > 1, defaults to config.adaptive_backoff
+        :param checks_per_change: defaults to config.adaptive_checks_per_change
+        """
+        self.min_interval = config.adaptive_min_interval if min_interval is None else min_interval
+        self.max_interval = config.adaptive_max_interval if max_interval is None else max_interval
+        self.backoff = config.adaptive_backoff if backoff is None else backoff
+        self.checks_per_change = config.adaptive_checks_per_change if checks_per_change is None \
+            else checks_per_change
+
+    def estimate(self, history: list, now: datetime.datetime):
+        """
+        Estimates the interval from the change rate.
+
+        :param history: check timestamps, newest first
+        :param now:
+        :return: seconds, None if no change has been observed yet
+        """
+        changes = len(history) - 1
+        if changes < 1:
+            return None
+        observed = (now - history[-1]).total_seconds()
+        return max(0.0, observed) / (changes * self.checks_per_change)
+
+    def next_interval(self, site: Site, update_detected: bool, history: list, now: datetime.datetime) -> int:
+        """
+        :param site:
+        :param update_detected: result of the check, None if the check failed
+        :param history: check timestamps of the site's SiteChange entries, newest first
+        :param now:
+        :return: interval in seconds until the next check
+        """
+        interval = site.check_interval if site.check_interval else config.default_check_interval
+        if update_detected is None:
+            return interval
+        interval = interval / self.backoff if update_detected else interval * self.backoff
+        estimate = self.estimate(history, now=now)
+        if estimate is not None:
+            interval = min(max(interval, estimate / self.backoff), estimate * self.backoff)
+        return int(round(min(max(interval, self.min_interval), self.max_interval)))
+
+
+POLICIES = {FIXED: FixedIntervalPolicy, ADAPTIVE: AdaptiveIntervalPolicy}
+
+
+def get_interval_policy(site: Site):
+    """
+    Returns the interval policy of a site (config.default_interval_policy if it has none).
+
+    :param site:
+    :return: FixedIntervalPolicy or AdaptiveIntervalPolicy
+    """
+    name = site.interval_policy if site.interval_policy else config.default_interval_policy
+    try:
+        return POLICIES[name]()
+    except KeyError:
+        log.warning(f"Unknown interval policy '{name}' of site {site.url}, using '{FIXED}'.")
+        return FixedIntervalPolicy()
@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Stages of a check, in pipeline order
+STAGES = ('dns', 'connect', 'download', 'decode', 'transform', 'hash', 'db_read', 'db_write')
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+
+
+class _SiteScope(object):
+    __slots__ = ('metrics', 'site', 'previous')
+
+    def __init__(self, metrics, site):
+        self.metrics = metrics
+        self.site = site
+
+    def __enter__(self):
+        local = self.metrics._local
+        self.previous = getattr(local, 'site', None)
+        local.site = self.site
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics._local.site = self.previous
+
+
+class _NullContext(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class NullMetrics(object):
+    """
+    Metrics collector that records nothing. It is installed while metrics are disabled;
+    all its methods return right away.
+    """
+
+    enabled = False
+
+    def timer(self, stage: str):
+        return _NULL_CONTEXT
+
+    def site_scope(self, site):
+        return _NULL_CONTEXT
+
+    def record(self, stage: str, seconds: float):
+        pass
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+
+class Metrics(object):
+    """
+    Metrics collects the timings of the stages of a check run (see STAGES) and counters,
+    e.g. bytes fetched and HFC re-fetches.
+
+    Every timing and counter is added to the aggregate of the run and to the
+    site whose check is being run by the current thread (see site_scope).
+    Use it like:
+
+        with get_metrics().timer('hash'):
+            ...
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self.started = time.time()
+        self.duration = None
+        self.stages = {}  # stage -> [count, total seconds, max seconds]
+        self.counters = {}  # name -> value
+        self.sites = {}  # site id -> {'url': ..., 'stages': {stage: seconds}, 'counters': {name: value}}
+
+    def timer(self, stage: str):
+        """
+        :param stage:
+        :return: context manager that records the time spent in its block
+        """
+        return _Timer(self, stage)
+
+    def site_scope(self, site):
+        """
+        :param site: Site
+        :return: context manager that attributes the timings and counters of its block (in this thread) to a site
+        """
+        return _SiteScope(self, site)
+
+    def _site_entry(self):
+        site = getattr(self._local, 'site', None)
+        if site is None:
+            return None
+        entry = self.sites.get(site.id)
+        if entry is None:
+            entry = self.sites[site.id] = {'url': site.url, 'stages': {}, 'counters': {}}
+        return entry
+
+    def record(self, stage: str, seconds: float):
+        """
+        Records time spent in a stage.
+
+        :param stage:
+        :param seconds:
+        :return:
+        """
+        with self.lock:
+            aggregate = self.stages.get(stage)
+            if aggregate is None:
+                aggregate = self.stages[stage] = [0, 0.0, 0.0]
+            aggregate[0] += 1
+            aggregate[1] += seconds
+            aggregate[2] = max(aggregate[2], seconds)
+            entry = self._site_entry()
+            if entry is not None:
+                entry['stages'][stage] = entry['stages'].get(stage, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        """
+        Adds to a counter.
+
+        :param name:
+        :param value:
+        :return:
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            entry = self._site_entry()
+            if entry is not None:
+                entry['counters'][name] = entry['counters'].get(name, 0) + value
+
+    def finish(self):
+        self.duration = time.time() - self.started
+
+    def summary(self) -> dict:
+        """
+        :return: JSON serializable summary of the run
+        """
+        with self.lock:
+            return {
+                'started': self.started,
+                'duration': self.duration,
+                'stages': {stage: {'count': count, 'seconds': total, 'max_seconds': maximum}
+                           for stage, (count, total, maximum) in self.stages.items()},
+                'counters': dict(self.counters),
+                'sites': {str(site_id): entry for site_id, entry in self.sites.items()},
+            }
+
+    def log_summary(self):
+        stages = ', '.join(f"{stage}={self.stages[stage][1]:.3f}s"
+                           for stage in sorted(self.stages, key=_stage_order))
+        counters = ', '.join(f"{name}={value}" for name, value in sorted(self.counters.items()))
+        log.info(f"Check run took {self.duration or 0:.3f}s: {stages}; {counters}")
+        for entry in self.sites.values():
+            site_stages = ', '.join(f"{stage}={seconds:.3f}s" for stage, seconds in entry['stages'].items())
+            log.debug(f"Timings of url={entry['url']}: {site_stages}")
+
+    def prometheus_text(self) -> str:
+        """
+        :return: the aggregates of the run in the Prometheus text exposition format
+        """
+        lines = ['# HELP brang_run_duration_seconds Duration of the last check run.',
+                 '# TYPE brang_run_duration_seconds gauge',
+                 f'brang_run_duration_seconds {self.duration or 0:.6f}',
+                 '# HELP brang_run_timestamp_seconds Start of the last check run.',
+                 '# TYPE brang_run_timestamp_seconds gauge',
+                 f'brang_run_timestamp_seconds {self.started:.3f}',
+                 '# HELP brang_run_stage_seconds Time spent per stage in the last check run.',
+                 '# TYPE brang_run_stage_seconds gauge']
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: _stage_order(item[0]))
+            lines += [f'brang_run_stage_seconds{{stage="{stage}"}} {total:.6f}' for stage, (_, total, _) in stages]
+            lines += ['# HELP brang_run_stage_count Number of timed operations per stage in the last check run.',
+                      '# TYPE brang_run_stage_count gauge']
+            lines += [f'brang_run_stage_count{{stage="{stage}"}} {count}' for stage, (count, _, _) in stages]
+            for name, value in sorted(self.counters.items()):
+                lines += [f'# TYPE brang_run_{name} gauge', f'brang_run_{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def export(self, textfile: str = None, json_file: str = None):
+        """
+        Writes the Prometheus textfile and the JSON summary. Files are replaced atomically.
+
+        :param textfile: path, e.g. for the textfile collector of the node exporter
+        :param json_file: path
+        :return:
+        """
+        if textfile:
+            _write_atomically(os.path.expanduser(textfile), self.prometheus_text())
+        if json_file:
+            _write_atomically(os.path.expanduser(json_file), json.dumps(self.summary(), indent=1))
+
+
+def _stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+def _write_atomically(path: str, content: str):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+NULL_METRICS = NullMetrics()
+_metrics = NULL_METRICS
+
+
+def get_metrics():
+    """
+    Returns the collector of the current check run, a NullMetrics if metrics are disabled.
+
+    :return:
+    """
+    return _metrics
+
+
+def set_metrics(metrics):
+    """
+    Installs the collector of a check run.
+
+    :param metrics: Metrics, or None to disable metrics
+    :return:
+    """
+    global _metrics
+    _metrics = NULL_METRICS if metrics is None else metrics
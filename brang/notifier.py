@@ -0,0 +1,244 @@
+import datetime
+import logging
+import re
+import smtplib
+import threading
+from email.message import EmailMessage
+
+import brang.config as config
+from brang.database import Database
+from brang.exceptions import SettingNotFoundException
+
+log = logging.getLogger(__name__)
+
+EMAIL_FROM = "notify@brang.io"
+EMAIL_SUBJECT = "Brang.io: Site changes detected"
+LAST_DIGEST_SETTING = 'notification_last_digest'
+_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_recipients(value: str) -> list:
+    """
+    Splits a list of e-mail addresses, separated by commas, semicolons or whitespace.
+
+    :param value:
+    :return: list of addresses
+    """
+    return [address for address in re.split(r'[,;\s]+', value or '') if address]
+
+
+class Notifier(object):
+    """
+    Notifier delivers the notifications of brang through a persistent outbox.
+
+    A notification is stored in the notification table first (notify), and
+    delivered later (deliver), so that check results never wait for the
+    SMTP server and a notification is not lost if it is unavailable:
+     - All due notifications of the same recipients are sent as one e-mail.
+       With a digest_interval, a notification is held back until that long
+       after the previous digest, so that frequent check runs (e.g. of the
+       daemon) do not send an e-mail each.
+     - A failed delivery is retried with exponential backoff.
+     - The SMTP connection is kept open and reused, until it has been idle
+       for smtp_idle_timeout.
+
+    Use it synchronously, e.g. deliver at the end of a cron run, or let a
+    NotificationWorker deliver in the background.
+    """
+
+    def __init__(self, db: Database, smtp_server: str = None, smtp_port: int = None,
+                 digest_interval: float = None):
+        """
+        :param db:
+        :param smtp_server: defaults to config.smtp_server
+        :param smtp_port: defaults to config.smtp_port
+        :param digest_interval: min. seconds between two e-mails to the same recipients,
+                                defaults to config.notification_digest_interval
+        """
+        self.db = db
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.digest_interval = config.notification_digest_interval if digest_interval is None \
+            else digest_interval
+        self.lock = threading.RLock()
+        self._smtp = None
+        self._smtp_address = None
+        self._smtp_last_used = None
+
+    def notify(self, body: str, subject: str = EMAIL_SUBJECT) -> bool:
+        """
+        Stores a notification to the recipients of the Setting email_to in the outbox.
+
+        :param body:
+        :param subject:
+        :return: False if there are no recipients
+        """
+        try:
+            recipients = parse_recipients(self.db.get_setting("email_to").value)
+        except SettingNotFoundException:
+            recipients = []
+        if not recipients:
+            log.error(f"Could not notify. No recipient (Setting email_to) configured.")
+            return False
+        now = datetime.datetime.now()
+        next_attempt = now
+        if self.digest_interval:
+            try:
+                last_digest = datetime.datetime.strptime(self.db.get_setting(LAST_DIGEST_SETTING).value,
+                                                         _TIMESTAMP_FORMAT)
+                next_attempt = max(now, last_digest + datetime.timedelta(seconds=self.digest_interval))
+            except (SettingNotFoundException, ValueError):
+                pass
+        self.db.insert_notification(recipients=', '.join(recipients), subject=subject, body=body,
+                                    next_attempt=next_attempt)
+        return True
+
+    def _connect(self):
+        """
+        Returns an open SMTP connection, reusing the previous one if it is still alive.
+        """
+        address = (config.smtp_server if self.smtp_server is None else self.smtp_server,
+                   config.smtp_port if self.smtp_port is None else self.smtp_port)
+        if self._smtp is not None:
+            idle = (datetime.datetime.now() - self._smtp_last_used).total_seconds()
+            reusable = address == self._smtp_address and idle < config.smtp_idle_timeout
+            try:
+                if reusable and self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self.close()
+        self._smtp = smtplib.SMTP(host=address[0], port=address[1], timeout=config.smtp_timeout)
+        self._smtp_address = address
+        return self._smtp
+
+    def close(self):
+        """
+        Closes the SMTP connection.
+
+        :return:
+        """
+        with self.lock:
+            if self._smtp is None:
+                return
+            try:
+                self._smtp.quit()
+            except Exception:
+                try:
+                    self._smtp.close()
+                except Exception:
+                    pass
+            self._smtp = None
+
+    def _send(self, recipients: str, subject: str, notifications: list):
+        if len(notifications) == 1:
+            body = notifications[0].body
+        else:
+            body = "\n\n".join(f"[{n.created.strftime('%Y-%m-%d %H:%M')}]\n{n.body}" for n in notifications)
+        msg = EmailMessage()
+        msg.set_content(body)
+        msg['Subject'] = subject
+        msg['From'] = EMAIL_FROM
+        msg['To'] = recipients
+        self._connect().send_message(msg)
+        self._smtp_last_used = datetime.datetime.now()
+
+    def retry_delay(self, attempts: int) -> float:
+        """
+        :param attempts: number of failed attempts so far
+        :return: seconds until the next attempt
+        """
+        return min(config.notification_retry_delay * 2 ** attempts, config.notification_max_retry_delay)
+
+    def deliver(self) -> int:
+        """
+        Sends the due notifications of the outbox, as one digest per recipients.
+        Failed digests stay in the outbox and are retried later.
+
+        :return: number of notifications that have been sent
+        """
+        with self.lock:
+            now = datetime.datetime.now()
+            digests = {}
+            for notification in self.db.get_due_notifications(now=now):
+                digests.setdefault((notification.recipients, notification.subject), []).append(notification)
+            sent = 0
+            for (recipients, subject), notifications in digests.items():
+                ids = [n.id for n in notifications]
+                try:
+                    self._send(recipients=recipients, subject=subject, notifications=notifications)
+                except Exception as e:
+                    self.close()
+                    attempts = max(n.attempts or 0 for n in notifications)
+                    delay = self.retry_delay(attempts)
+                    log.error(f"Could not send e-mail to {recipients}, retrying in {delay:.0f}s. {e}")
+                    self.db.defer_notifications(notification_ids=ids,
+                                                next_attempt=now + datetime.timedelta(seconds=delay),
+                                                error=str(e))
+                    continue
+                self.db.delete_notifications(notification_ids=ids)
+                sent += len(ids)
+            if sent and self.digest_interval:
+                self.db.set_setting(LAST_DIGEST_SETTING, now.strftime(_TIMESTAMP_FORMAT))
+            return sent
+
+
+class NotificationWorker(object):
+    """
+    NotificationWorker delivers the outbox of a Notifier in a background thread.
+
+    It delivers whenever it is woken up (wake) and when the next notification
+    of the outbox is due, e.g. for a retry.
+    """
+
+    def __init__(self, notifier: Notifier, max_sleep: float = None):
+        """
+        :param notifier:
+        :param max_sleep: max. seconds between two looks at the outbox, defaults to config.daemon_max_sleep
+        """
+        self.notifier = notifier
+        self.max_sleep = config.daemon_max_sleep if max_sleep is None else max_sleep
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='brang-notifier', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake_event.set()
+
+    def stop(self, timeout: float = None):
+        """
+        Stops the worker after its current delivery.
+
+        :param timeout: max. seconds to wait for the worker
+        :return:
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self.notifier.close()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+            try:
+                self.notifier.deliver()
+                next_attempt = self.notifier.db.get_next_notification_attempt()
+            except Exception as e:
+                log.error(f"Notification delivery failed. {e}")
+                next_attempt = None
+            sleep = self.max_sleep
+            if next_attempt is not None:
+                sleep = min(sleep, max(0.0, (next_attempt - datetime.datetime.now()).total_seconds()))
+            self._wake_event.wait(sleep)
@@ -0,0 +1,83 @@
+import collections
+import os
+import sqlite3
+from urllib.parse import quote
+
+from brang.exceptions import SiteNotFoundException, SiteChangeNotFoundException, SchemaOutdatedException
+from brang.schema import SCHEMA_VERSION, get_schema_version
+
+SiteRow = collections.namedtuple('SiteRow', ['id', 'url', 'check_interval', 'interval_policy', 'region_selector',
+                                             'change_threshold'])
+SnapshotRow = collections.namedtuple('SnapshotRow', ['id', 'compression', 'size', 'data'])
+
+
+class ReadOnlyDatabase(object):
+    """
+    ReadOnlyDatabase reads from the database file of brang with the sqlite3 module only.
+
+    It serves the read-only commands of the command line tool, which thus
+    neither import SQLAlchemy nor do any schema work. The database file is
+    opened read-only; a missing file, or a file with an outdated schema (see
+    brang.schema), raises SchemaOutdatedException, in which case the caller
+    uses SQLiteDatabase, which creates or migrates the tables.
+    """
+
+    def __init__(self, db_filename: str):
+        """
+        :param db_filename:
+        :raises: SchemaOutdatedException: if the file does not exist or its schema is outdated
+        """
+        if not os.path.exists(db_filename):
+            raise SchemaOutdatedException(f"Database file {db_filename} does not exist.")
+        self.connection = sqlite3.connect(f"file:{quote(os.path.abspath(db_filename))}?mode=ro", uri=True)
+        try:
+            version = get_schema_version(self.connection)
+        except sqlite3.Error as e:
+            self.close()
+            raise SchemaOutdatedException(f"Could not read the schema version. {e}")
+        if version < SCHEMA_VERSION:
+            self.close()
+            raise SchemaOutdatedException(f"Schema version {version} is older than {SCHEMA_VERSION}.")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_all_sites(self) -> list:
+        """
+        Returns all sites
+
+        :return: list of SiteRow
+        """
+        rows = self.connection.execute(
+            "SELECT id, url, check_interval, interval_policy, region_selector, change_threshold "
+            "FROM site ORDER BY id").fetchall()
+        return [SiteRow(*row) for row in rows]
+
+    def get_latest_snapshot(self, url: str):
+        """
+        Returns the snapshot of the latest SiteChange entry of a site
+
+        :param url:
+        :return: SnapshotRow, None if no snapshot is stored for the entry
+        :raises: SiteNotFoundException: if the site does not exist
+        :raises: SiteChangeNotFoundException: if the site has no SiteChange entry
+        """
+        row = self.connection.execute("SELECT id FROM site WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            raise SiteNotFoundException(f"Site with url={url} could not be found.")
+        row = self.connection.execute(
+            "SELECT snapshot_id FROM site_change WHERE site_id = ? "
+            "ORDER BY check_timestamp DESC, id DESC LIMIT 1", (row[0],)).fetchone()
+        if row is None:
+            raise SiteChangeNotFoundException(f"No SiteChange entry for url={url} could be found.")
+        if row[0] is None:
+            return None
+        row = self.connection.execute(
+            "SELECT id, compression, size, data FROM snapshot WHERE id = ?", (row[0],)).fetchone()
+        return None if row is None else SnapshotRow(*row)
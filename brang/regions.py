@@ -0,0 +1,359 @@
+import re
+from html.parser import HTMLParser
+
+# Prefix of selectors that describe a region by a start and an end marker: between:START...END
+MARKER_PREFIX = 'between:'
+MARKER_SEPARATOR = '...'
+
+# Elements without content and end tag
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta',
+                           'param', 'source', 'track', 'wbr'])
+# Elements whose start implicitly ends open elements (whose end tag may be omitted):
+# tag -> (elements it ends, elements beyond which it does not look)
+IMPLIED_ENDS = {
+    'li': ({'li'}, {'ul', 'ol'}),
+    'td': ({'td', 'th'}, {'tr', 'table'}),
+    'th': ({'td', 'th'}, {'tr', 'table'}),
+    'tr': ({'tr'}, {'table', 'thead', 'tbody', 'tfoot'}),
+    'option': ({'option'}, {'select', 'datalist', 'optgroup'}),
+    'dd': ({'dd', 'dt'}, {'dl'}),
+    'dt': ({'dd', 'dt'}, {'dl'}),
+}
+# Elements whose start implicitly ends an open p element
+P_CLOSING_ELEMENTS = frozenset(['address', 'article', 'aside', 'blockquote', 'div', 'dl', 'fieldset', 'footer',
+                                'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'main', 'nav', 'ol',
+                                'p', 'pre', 'section', 'table', 'ul'])
+
+_SIMPLE_SELECTOR_RE = re.compile(r'''^(?P<tag>[a-zA-Z][a-zA-Z0-9-]*|\*)?(?P<rest>.*)$''')
+_SELECTOR_PART_RE = re.compile(r'''#(?P<id>[\w-]+)|\.(?P<cls>[\w-]+)|'''
+                               r'''\[(?P<attr>[\w-]+)(?:=(?:"(?P<v1>[^"]*)"|'(?P<v2>[^']*)'|(?P<v3>[^\]]*)))?\]''')
+
+
+class SimpleSelector(object):
+    """
+    One step of a CSS path: tag, #id, .class and [attribute] or [attribute=value] conditions.
+    """
+
+    def __init__(self, text: str, combinator: str = ' '):
+        """
+        :param text: e.g. table#prices.large or div[data-role=news]
+        :param combinator: relation to the previous step, ' ' (descendant) or '>' (child)
+        :raises: ValueError: if the selector cannot be parsed
+        """
+        self.combinator = combinator
+        match = _SIMPLE_SELECTOR_RE.match(text)
+        tag = match.group('tag')
+        self.tag = None if tag in (None, '*') else tag.lower()
+        self.id = None
+        self.classes = set()
+        self.attributes = {}  # name -> value, None for presence only
+        rest = match.group('rest')
+        position = 0
+        while position < len(rest):
+            part = _SELECTOR_PART_RE.match(rest, position)
+            if part is None:
+                raise ValueError(f"Cannot parse selector '{text}' at '{rest[position:]}'.")
+            if part.group('id') is not None:
+                self.id = part.group('id')
+            elif part.group('cls') is not None:
+                self.classes.add(part.group('cls'))
+            else:
+                values = [part.group(g) for g in ('v1', 'v2', 'v3') if part.group(g) is not None]
+                self.attributes[part.group('attr').lower()] = values[0] if values else None
+            position = part.end()
+        if self.tag is None and self.id is None and not self.classes and not self.attributes and tag != '*':
+            raise ValueError(f"Empty selector '{text}'.")
+
+    def matches(self, tag: str, attrs: dict) -> bool:
+        """
+        :param tag: lower case tag name
+        :param attrs: dict of the attributes of the element
+        :return:
+        """
+        if self.tag is not None and tag != self.tag:
+            return False
+        if self.id is not None and attrs.get('id') != self.id:
+            return False
+        if self.classes and not self.classes.issubset((attrs.get('class') or '').split()):
+            return False
+        for name, value in self.attributes.items():
+            if name not in attrs or (value is not None and attrs[name] != value):
+                return False
+        return True
+
+
+class CssPath(object):
+    """
+    A CSS-like path of simple selectors, separated by whitespace (descendant) or > (child),
+    e.g. 'main div.news > ul'.
+
+    Elements are matched incrementally: the match state of an element is derived
+    from the state of its parent (see match_state), so that selecting an element
+    takes time linear in the number of steps, however deep the document is nested.
+    """
+
+    def __init__(self, selector: str):
+        """
+        :param selector:
+        :raises: ValueError: if the selector cannot be parsed
+        """
+        self.selector = selector
+        self.steps = []
+        combinator = ' '
+        for token in selector.replace('>', ' > ').split():
+            if token == '>':
+                if not self.steps or combinator == '>':
+                    raise ValueError(f"Misplaced '>' in selector '{selector}'.")
+                combinator = '>'
+                continue
+            self.steps.append(SimpleSelector(token, combinator=combinator))
+            combinator = ' '
+        if not self.steps or combinator == '>':
+            raise ValueError(f"Incomplete selector '{selector}'.")
+
+    def match_state(self, parent_state, tag: str, attrs: dict) -> tuple:
+        """
+        Returns the match state of an element, given the state of its parent.
+
+        The state is a tuple of two bit masks (matched, reached): bit i of matched
+        is set if the steps 0 to i match, with step i matching the element itself;
+        bit i of reached is set if it is set in matched of the element or of any
+        of its ancestors.
+
+        :param parent_state: match state of the parent element, None for the outermost element
+        :param tag: lower case tag name
+        :param attrs: dict of the attributes of the element
+        :return:
+        """
+        parent_matched, parent_reached = (0, 0) if parent_state is None else parent_state
+        matched = 0
+        for i, step in enumerate(self.steps):
+            if i > 0:
+                previous = parent_matched if step.combinator == '>' else parent_reached
+                if not previous >> (i - 1) & 1:
+                    continue
+            if step.matches(tag, attrs):
+                matched |= 1 << i
+        return matched, parent_reached | matched
+
+    def selects(self, state: tuple) -> bool:
+        """
+        :param state: match state of an element, see match_state
+        :return: True if the element is selected by the path
+        """
+        return bool(state[0] >> (len(self.steps) - 1) & 1)
+
+    def matches(self, stack: list) -> bool:
+        """
+        Tells if the innermost element of a stack of open elements is selected by the path.
+
+        :param stack: list of tuples (tag, attrs), the outermost element first
+        :return:
+        """
+        state = None
+        for tag, attrs in stack:
+            state = self.match_state(state, tag, attrs)
+        return state is not None and self.selects(state)
+
+
+class CssRegionExtractor(HTMLParser):
+    """
+    Extracts the first element selected by a CssPath from an HTML document that is fed in pieces.
+
+    The element is serialized from its tags and text; comments are left out.
+    Once the element is complete, the extractor is done and ignores further input,
+    so that the caller can stop reading the document.
+    """
+
+    def __init__(self, path: CssPath):
+        super().__init__(convert_charrefs=True)
+        self.path = path
+        self.stack = []  # open elements, tuples (tag, match state), see CssPath.match_state
+        self.capture_depth = None  # length of the stack while the selected element is open
+        self.parts = []
+        self.done = False
+
+    def _close_to(self, depth: int):
+        while len(self.stack) > depth:
+            tag = self.stack.pop()[0]
+            if self.capture_depth is not None:
+                self.parts.append(f"</{tag}>")
+                if len(self.stack) < self.capture_depth:
+                    self.done = True
+                    return
+
+    def _close_implied(self, tag: str):
+        if self.stack and self.stack[-1][0] == 'p' and tag in P_CLOSING_ELEMENTS:
+            self._close_to(len(self.stack) - 1)
+            return
+        if tag not in IMPLIED_ENDS:
+            return
+        ends, boundaries = IMPLIED_ENDS[tag]
+        for depth in range(len(self.stack) - 1, -1, -1):
+            open_tag = self.stack[depth][0]
+            if open_tag in ends:
+                self._close_to(depth)
+                return
+            if open_tag in boundaries:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        self._close_implied(tag)
+        if self.done:
+            return
+        void = tag in VOID_ELEMENTS
+        if self.capture_depth is None:
+            state = self._match_state(tag, attrs)
+            if self.path.selects(state):
+                self.capture_depth = len(self.stack) + 1
+                self.parts.append(self.get_starttag_text())
+                if void:
+                    self.done = True
+            if not void:
+                self.stack.append((tag, state))
+        else:
+            self.parts.append(self.get_starttag_text())
+            if not void:
+                self.stack.append((tag, None))  # the state is not needed while capturing
+
+    def handle_startendtag(self, tag, attrs):
+        if self.done:
+            return
+        if self.capture_depth is None:
+            if self.path.selects(self._match_state(tag, attrs)):
+                self.parts.append(self.get_starttag_text())
+                self.capture_depth = len(self.stack) + 1
+                self.done = True
+        else:
+            self.parts.append(self.get_starttag_text())
+
+    def _match_state(self, tag: str, attrs: list) -> tuple:
+        parent_state = self.stack[-1][1] if self.stack else None
+        return self.path.match_state(parent_state, tag, {name: value or '' for name, value in attrs})
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        for depth in range(len(self.stack) - 1, -1, -1):
+            if self.stack[depth][0] == tag:
+                self._close_to(depth)
+                return
+        # End tags of elements that are not open are ignored
+
+    def handle_data(self, data):
+        if self.capture_depth is not None and not self.done:
+            self.parts.append(data)
+
+    def feed(self, data: str) -> bool:
+        """
+        :param data: next piece of the document
+        :return: True once the region is complete
+        """
+        if not self.done:
+            super().feed(data)
+        return self.done
+
+    @property
+    def region(self):
+        """
+        :return: the region (str), None if no element has been selected (yet)
+        """
+        return None if self.capture_depth is None else ''.join(self.parts)
+
+
+class MarkerRegionExtractor(object):
+    """
+    Extracts the text between a start and an end marker from a document that is fed in pieces.
+    """
+
+    def __init__(self, start: str, end: str):
+        self.start = start
+        self.end = end
+        self.buffer = ''
+        self.started = False
+        self.parts = []
+        self.done = False
+
+    def feed(self, data: str) -> bool:
+        """
+        :param data: next piece of the document
+        :return: True once the region is complete
+        """
+        if self.done:
+            return True
+        self.buffer += data
+        if not self.started:
+            i = self.buffer.find(self.start)
+            if i < 0:
+                # Keep what could be the beginning of a start marker
+                self.buffer = self.buffer[max(0, len(self.buffer) - len(self.start) + 1):]
+                return False
+            self.started = True
+            self.buffer = self.buffer[i + len(self.start):]
+        i = self.buffer.find(self.end)
+        if i >= 0:
+            self.parts.append(self.buffer[:i])
+            self.buffer = ''
+            self.done = True
+            return True
+        keep = len(self.buffer) - len(self.end) + 1
+        if keep > 0:
+            self.parts.append(self.buffer[:keep])
+            self.buffer = self.buffer[keep:]
+        return False
+
+    def close(self):
+        pass
+
+    @property
+    def region(self):
+        """
+        :return: the region (str), None if the end marker has not been found (yet)
+        """
+        return ''.join(self.parts) if self.done else None
+
+
+def parse_selector(selector: str):
+    """
+    Parses a region selector, which is either a CSS-like path (see CssPath),
+    or a pair of markers: between:START...END
+
+    :param selector:
+    :return: CssPath, or tuple (start, end) of markers
+    :raises: ValueError: if the selector is not valid
+    """
+    if selector.startswith(MARKER_PREFIX):
+        start, separator, end = selector[len(MARKER_PREFIX):].partition(MARKER_SEPARATOR)
+        if not separator or not start or not end:
+            raise ValueError(f"Selector '{selector}' needs a start and an end marker: "
+                             f"{MARKER_PREFIX}START{MARKER_SEPARATOR}END")
+        return start, end
+    return CssPath(selector)
+
+
+def create_region_extractor(selector: str):
+    """
+    :param selector: see parse_selector
+    :return: CssRegionExtractor or MarkerRegionExtractor, both have feed, close and region
+    :raises: ValueError: if the selector is not valid
+    """
+    parsed = parse_selector(selector)
+    if isinstance(parsed, CssPath):
+        return CssRegionExtractor(parsed)
+    return MarkerRegionExtractor(*parsed)
+
+
+def extract_region(text: str, selector: str):
+    """
+    Extracts a region of a whole document.
+
+    :param text: html document
+    :param selector: see parse_selector
+    :return: the region (str), None if it has not been found
+    """
+    extractor = create_region_extractor(selector)
+    extractor.feed(text)
+    extractor.close()
+    return extractor.region
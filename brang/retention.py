@@ -0,0 +1,185 @@
+import datetime
+import logging
+
+import brang.config as config
+from brang.database import Database
+from brang.exceptions import SettingNotFoundException
+
+log = logging.getLogger(__name__)
+
+CURSOR_SETTING = 'retention_cursor'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class RetentionPolicy(object):
+    """
+    RetentionPolicy decides which SiteChange entries of a site are expired.
+
+    An entry is expired if any of the configured rules expires it:
+     - keep_last: only the newest keep_last entries of a site are kept
+     - max_age: entries older than max_age are dropped
+     - downsample_after/downsample_interval: of the entries older than
+       downsample_after, only the newest entry per downsample_interval
+       (counted from the epoch, so that buckets do not move) is kept
+
+    The latest entry of a site is never expired, since change checks compare against it.
+    Of the entries that are kept, only the newest keep_snapshots keep their snapshot
+    (see brang.snapshots).
+    """
+
+    def __init__(self, keep_last: int = None,
+                 max_age: datetime.timedelta = None,
+                 downsample_after: datetime.timedelta = None,
+                 downsample_interval: datetime.timedelta = datetime.timedelta(days=1),
+                 keep_snapshots: int = None):
+        self.keep_last = keep_last
+        self.max_age = max_age
+        self.downsample_after = downsample_after
+        self.downsample_interval = downsample_interval
+        self.keep_snapshots = keep_snapshots
+
+    @classmethod
+    def from_config(cls):
+        """
+        Creates the policy configured by the config.retention_* entries.
+
+        :return:
+        """
+        def days(value):
+            return None if value is None else datetime.timedelta(days=value)
+
+        return cls(keep_last=config.retention_keep_last,
+                   max_age=days(config.retention_max_age_days),
+                   downsample_after=days(config.retention_downsample_after_days),
+                   downsample_interval=days(config.retention_downsample_interval_days),
+                   keep_snapshots=config.snapshot_keep_per_site)
+
+    @property
+    def is_active(self):
+        return (self.keep_last is not None or self.max_age is not None or self.downsample_after is not None
+                or self.keep_snapshots is not None)
+
+    def expired(self, history: list, now: datetime.datetime) -> list:
+        """
+        Selects the expired entries of one site.
+
+        :param history: list of tuples (id, check_timestamp), newest first
+        :param now:
+        :return: ids of the expired entries
+        """
+        expired = []
+        kept_bucket = None
+        interval = self.downsample_interval.total_seconds() if self.downsample_interval else None
+        for rank, (site_change_id, check_timestamp) in enumerate(history):
+            if rank == 0:
+                continue
+            age = now - check_timestamp
+            if self.keep_last is not None and rank >= self.keep_last:
+                expired.append(site_change_id)
+            elif self.max_age is not None and age > self.max_age:
+                expired.append(site_change_id)
+            elif self.downsample_after is not None and interval and age > self.downsample_after:
+                bucket = int((check_timestamp - EPOCH).total_seconds() // interval)
+                if bucket == kept_bucket:
+                    expired.append(site_change_id)
+                else:
+                    kept_bucket = bucket
+        return expired
+
+    def released_snapshots(self, history: list, expired: list) -> list:
+        """
+        Selects the entries of one site whose snapshots are released.
+
+        :param history: list of tuples (id, check_timestamp), newest first
+        :param expired: ids of the expired entries, see expired
+        :return: ids of the entries
+        """
+        if self.keep_snapshots is None:
+            return []
+        expired = set(expired)
+        kept = [site_change_id for site_change_id, _ in history if site_change_id not in expired]
+        return kept[max(1, self.keep_snapshots):]
+
+
+class CompactionResult(object):
+    """
+    Statistics of a compaction.
+    """
+
+    def __init__(self):
+        self.sites = 0
+        self.deleted_site_changes = 0
+        self.deleted_patterns = 0
+        self.released_snapshots = 0
+        self.deleted_snapshots = 0
+        self.finished = False
+
+    def __repr__(self):
+        return (f"CompactionResult(sites={self.sites}, deleted_site_changes={self.deleted_site_changes}, "
+                f"deleted_patterns={self.deleted_patterns}, released_snapshots={self.released_snapshots}, "
+                f"deleted_snapshots={self.deleted_snapshots}, finished={self.finished})")
+
+
+def compact(db: Database, policy: RetentionPolicy = None,
+            batch_size: int = None, max_batches: int = None,
+            now: datetime.datetime = None) -> CompactionResult:
+    """
+    Deletes the SiteChange entries that are expired by the retention policy,
+    and releases the snapshots that are no longer kept.
+
+    The sites are processed in batches of batch_size sites, each in its own
+    transaction. After max_batches batches, compaction stops and stores the
+    position in the Setting 'retention_cursor', so that the next call
+    continues there. Once all sites have been processed, unreferenced
+    patterns and snapshots are deleted and the cursor starts over.
+
+    :param db:
+    :param policy: defaults to RetentionPolicy.from_config()
+    :param batch_size: number of sites per batch, defaults to config.retention_batch_size
+    :param max_batches: max. number of batches, None for all
+    :param now: reference time of the policy, defaults to now
+    :return: CompactionResult
+    """
+    policy = RetentionPolicy.from_config() if policy is None else policy
+    batch_size = config.retention_batch_size if batch_size is None else max(1, batch_size)
+    now = datetime.datetime.now() if now is None else now
+    result = CompactionResult()
+    if not policy.is_active:
+        result.finished = True
+        return result
+
+    try:
+        cursor = int(db.get_setting(CURSOR_SETTING).value)
+    except (SettingNotFoundException, ValueError):
+        cursor = 0
+    site_ids = sorted(site.id for site in db.get_all_sites() if site.id > cursor)
+
+    batches = 0
+    for i in range(0, len(site_ids), batch_size):
+        if max_batches is not None and batches >= max_batches:
+            db.set_setting(CURSOR_SETTING, str(cursor))
+            log.info(f"Compaction paused: {result}")
+            return result
+        batch_site_ids = site_ids[i:i + batch_size]
+        history = db.get_site_change_history(site_ids=batch_site_ids)
+        expired = []
+        released = []
+        for site_id in batch_site_ids:
+            site_expired = policy.expired(history.get(site_id, []), now=now)
+            expired.extend(site_expired)
+            released.extend(policy.released_snapshots(history.get(site_id, []), expired=site_expired))
+        with db.batch():
+            db.delete_site_changes(site_change_ids=expired)
+            if released:
+                result.released_snapshots += db.release_snapshots(site_change_ids=released)
+        result.sites += len(batch_site_ids)
+        result.deleted_site_changes += len(expired)
+        cursor = batch_site_ids[-1]
+        batches += 1
+
+    result.deleted_patterns = db.delete_unreferenced_patterns()
+    result.deleted_snapshots = db.delete_unreferenced_snapshots()
+    db.set_setting(CURSOR_SETTING, '0')
+    result.finished = True
+    log.info(f"Compaction finished: {result}")
+    return result
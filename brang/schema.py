@@ -0,0 +1,39 @@
+"""
+The version of the database schema of brang.
+
+It is stored in the database file (PRAGMA user_version). SQLiteDatabase only
+creates and migrates the tables of database files with an older version, so
+that opening an up-to-date database does no schema work. Increase
+SCHEMA_VERSION whenever a table, column or index is added to brang.database.
+
+This module must not import SQLAlchemy, it is used by the lightweight
+read path of the command line tool (see brang.readonly).
+"""
+
+SCHEMA_VERSION = 4
+
+
+def get_schema_version(connection) -> int:
+    """
+    :param connection: sqlite3 (DB-API) connection
+    :return: schema version of the database, 0 if it has never been set
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("PRAGMA user_version")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def set_schema_version(connection, version: int = SCHEMA_VERSION):
+    """
+    :param connection: sqlite3 (DB-API) connection
+    :param version:
+    :return:
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA user_version={int(version)}")
+    finally:
+        cursor.close()
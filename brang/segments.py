@@ -0,0 +1,461 @@
+import collections
+import difflib
+import functools
+import hashlib
+import re
+import zlib
+from array import array
+
+_SEPARATOR_RE = {bytes: re.compile(b'[\n<]'), str: re.compile('[\n<]')}
+_NEWLINE = {bytes: b'\n', str: '\n'}
+_EMPTY = {bytes: b'', str: ''}
+
+# Regions of a document are hashed in slices of this size, which bounds the temporary copies
+HASH_SLICE_SIZE = 64 * 1024
+
+# Aligned patterns: number of stable segments after a volatile run that anchor its end,
+# and how far (in segments) the end of a run is searched for while learning how long it may be
+ANCHOR_SEGMENTS = 3
+MAX_DRIFT = 1024
+ALIGNED_PATTERN_PREFIX = 'a:'
+
+
+class Segments(object):
+    """
+    Segments describes how the HFC transform splits a document, without copying it.
+
+    HfcInvarianceCheckStrategy.transform splits a document before every '<'
+    and at every newline (which is dropped). Instead of building that list of
+    strings, Segments records the start and end offsets of the segments in the
+    original buffer. The document can be raw bytes or str.
+    """
+
+    __slots__ = ('data', 'starts', 'ends')
+
+    def __init__(self, data):
+        """
+        :param data: document as bytes or str
+        """
+        self.data = data
+        newline = _NEWLINE[type(data)]
+        starts = array('q', [0])
+        ends = array('q')
+        for m in _SEPARATOR_RE[type(data)].finditer(data):
+            p = m.start()
+            ends.append(p)
+            starts.append(p + 1 if m.group() == newline else p)
+        ends.append(len(data))
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        """
+        Returns segment i as a copy.
+
+        :param i:
+        :return: bytes or str
+        """
+        return self.data[self.starts[i]:self.ends[i]]
+
+    def equals(self, i, other, j):
+        """
+        Compares segment i with segment j of another Segments instance.
+
+        :param i:
+        :param other: Segments
+        :param j:
+        :return: True if both segments are equal
+        """
+        length = self.ends[i] - self.starts[i]
+        if length != other.ends[j] - other.starts[j]:
+            return False
+        return self.data[self.starts[i]:self.ends[i]] == other.data[other.starts[j]:other.ends[j]]
+
+    def anchor(self, i, k):
+        """
+        Returns a short checksum of the k segments starting at segment i.
+
+        :param i:
+        :param k:
+        :return: crc32 as int, or None if the document has less segments
+        """
+        if i < 0 or i + k > len(self):
+            return None
+        crc = 0
+        is_str = isinstance(self.data, str)
+        for j in range(i, i + k):
+            segment = self[j]
+            crc = zlib.crc32(segment.encode('utf-8') if is_str else segment, crc)
+            crc = zlib.crc32(b'\n', crc)
+        return crc
+
+    def _update_region(self, h, start, end):
+        """
+        Feeds the segments that span data[start:end] into the hash object.
+        The concatenation of consecutive segments is their region without newlines.
+        """
+        newline = _NEWLINE[type(self.data)]
+        empty = _EMPTY[type(self.data)]
+        is_str = isinstance(self.data, str)
+        for slice_start in range(start, end, HASH_SLICE_SIZE):
+            region = self.data[slice_start:min(end, slice_start + HASH_SLICE_SIZE)].replace(newline, empty)
+            h.update(region.encode('utf-8') if is_str else region)
+
+    def masked_hash(self, mask):
+        """
+        Hashes all segments that are not masked, in order.
+
+        The result equals the hash of ''.join() of the transformed list after
+        deleting the masked entries. The segments are fed into the hash
+        directly; neither a list nor the joined document is built.
+        Indices beyond the last segment are ignored.
+
+        :param mask: ascending, unique segment indices
+        :return: sha224 hash object
+        """
+        h = hashlib.sha224()
+        n = len(self)
+        first = 0
+        for i in mask:
+            if i >= n:
+                break
+            if i > first:
+                self._update_region(h, self.starts[first], self.ends[i - 1])
+            first = i + 1
+        if first < n:
+            self._update_region(h, self.starts[first], self.ends[n - 1])
+        return h
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_pattern(pattern: str) -> tuple:
+    """
+    Parses a hfc-pattern.
+
+    A pattern is a comma separated list of segment indices and ranges of
+    segment indices, e.g. "3,7-12". Patterns of earlier versions, which list
+    every index, are valid patterns as well. Parsed patterns are cached.
+
+    :param pattern:
+    :return: ascending tuple of unique segment indices
+    """
+    indices = set()
+    for entry in pattern.split(','):
+        if entry == '':
+            continue
+        first, _, last = entry.partition('-')
+        if last:
+            indices.update(range(int(first), int(last) + 1))
+        else:
+            indices.add(int(first))
+    return tuple(sorted(indices))
+
+
+def format_pattern(indices) -> str:
+    """
+    Formats segment indices as hfc-pattern, using ranges for consecutive indices.
+
+    :param indices: ascending, unique segment indices
+    :return: pattern, e.g. "3,7-12"
+    """
+    entries = []
+    first = last = None
+    for i in indices:
+        if last is not None and i == last + 1:
+            last = i
+            continue
+        if first is not None:
+            entries.append(str(first) if first == last else f"{first}-{last}")
+        first = last = i
+    if first is not None:
+        entries.append(str(first) if first == last else f"{first}-{last}")
+    return ','.join(entries)
+
+
+def align(segments_1: Segments, segments_2: Segments):
+    """
+    Aligns the segments of two documents.
+
+    The common prefix and suffix are skipped by a linear scan; only the
+    segments in between are aligned by difflib's SequenceMatcher.
+
+    :param segments_1: reference document
+    :param segments_2: other document
+    :return: tuple (changed, insertions): the indices of segments of the reference
+             that differ in or are missing from the other document, and the indices
+             of reference segments before which the other document has additional ones
+    """
+    n_1 = len(segments_1)
+    n_2 = len(segments_2)
+    prefix = 0
+    while prefix < n_1 and prefix < n_2 and segments_1.equals(prefix, segments_2, prefix):
+        prefix += 1
+    suffix = 0
+    while (suffix < n_1 - prefix and suffix < n_2 - prefix
+           and segments_1.equals(n_1 - 1 - suffix, segments_2, n_2 - 1 - suffix)):
+        suffix += 1
+
+    changed = set()
+    insertions = set()
+    middle_1 = [segments_1[i] for i in range(prefix, n_1 - suffix)]
+    middle_2 = [segments_2[i] for i in range(prefix, n_2 - suffix)]
+    matcher = difflib.SequenceMatcher(None, middle_1, middle_2)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ('replace', 'delete'):
+            changed.update(range(prefix + i1, prefix + i2))
+        elif tag == 'insert':
+            insertions.add(prefix + i1)
+    return changed, insertions
+
+
+def format_aligned_pattern(segments: Segments, changed, insertions) -> str:
+    """
+    Formats the result of align as an aligned hfc-pattern.
+
+    Consecutive changed segments form a run, written as "start+length". An
+    insertion point is a run of length 0. Every run is followed by the
+    checksum of the stable segments after it ("@crc.k", see Segments.anchor),
+    which is used to find the end of the run in documents whose length has
+    drifted. A run that reaches the end of the document is open ("start+").
+    The runs may only have their reference length; see learn_run_lengths.
+
+    :param segments: reference document
+    :param changed: indices of changed segments
+    :param insertions: indices of insertion points
+    :return: pattern, e.g. "a:3+2@5e4f21ab.3,40+"
+    """
+    n = len(segments)
+    spans = []
+    for i in sorted(set(changed) | set(insertions)):
+        length = 1 if i in changed else 0
+        if spans and spans[-1][0] + spans[-1][1] >= i:
+            start, run_length = spans[-1]
+            spans[-1] = (start, max(run_length, i + length - start))
+        else:
+            spans.append((i, length))
+
+    runs = []
+    for r, (start, length) in enumerate(spans):
+        end = start + length
+        next_start = spans[r + 1][0] if r + 1 < len(spans) else n
+        k = min(ANCHOR_SEGMENTS, next_start - end)
+        if end >= n:
+            runs.append((start, None, None, None, None, None))
+        else:
+            runs.append((start, length, segments.anchor(end, k), k, length, length))
+    return format_runs(runs)
+
+
+def format_runs(runs) -> str:
+    """
+    Formats runs as an aligned hfc-pattern. A run whose length varies is
+    written with the range of its lengths, e.g. "3+2~1-4@5e4f21ab.3".
+
+    :param runs: see parse_aligned_pattern
+    :return: pattern
+    """
+    entries = []
+    for start, length, crc, k, shortest, longest in runs:
+        if length is None:
+            entries.append(f"{start}+")
+        elif shortest == longest == length:
+            entries.append(f"{start}+{length}@{crc:08x}.{k}")
+        else:
+            entries.append(f"{start}+{length}~{shortest}-{longest}@{crc:08x}.{k}")
+    return ALIGNED_PATTERN_PREFIX + ','.join(entries)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_aligned_pattern(pattern: str) -> tuple:
+    """
+    Parses an aligned hfc-pattern (see format_aligned_pattern). Parsed patterns are cached.
+
+    :param pattern:
+    :return: tuple of runs (start, length, anchor, k, shortest, longest); shortest and longest
+             are the range of lengths the run may have. All but start are None for an open run.
+    """
+    runs = []
+    for entry in pattern[len(ALIGNED_PATTERN_PREFIX):].split(','):
+        if entry == '':
+            continue
+        run, _, anchor = entry.partition('@')
+        run, _, lengths = run.partition('~')
+        start, _, length = run.partition('+')
+        if anchor:
+            crc, _, k = anchor.partition('.')
+            length = int(length)
+            shortest, longest = (int(x) for x in lengths.split('-')) if lengths else (length, length)
+            runs.append((int(start), length, int(crc, 16), int(k), shortest, longest))
+        else:
+            runs.append((int(start), None, None, None, None, None))
+    return tuple(runs)
+
+
+def map_runs(segments: Segments, runs, learning: bool = False) -> list:
+    """
+    Maps the runs of an aligned pattern onto a document.
+
+    The stable segments between two runs are expected to be unchanged. Where
+    the anchor of a run is not found right after it, the end of the run is
+    searched among the other lengths the run may have, nearest first. Content
+    next to a run can therefore not be taken for a part of it, unless the run
+    was seen that long while the pattern was learned.
+
+    :param segments: document
+    :param runs: see parse_aligned_pattern
+    :param learning: search lengths up to MAX_DRIFT segments beyond the reference length
+                     instead, to learn the lengths of the runs (see learn_run_lengths)
+    :return: list of tuples (start, end, found), one per run; if the anchor of a run
+             is not found, found is False and the run has its reference length
+    """
+    n = len(segments)
+    mapped = []
+    position = 0  # index in the document that corresponds to reference index reference_end
+    reference_end = 0
+    for start, length, crc, k, shortest, longest in runs:
+        run_start = position + start - reference_end
+        if length is None:
+            mapped.append((run_start, max(run_start, n), True))
+            break
+        if learning:
+            shortest, longest = 0, length + MAX_DRIFT
+        expected_end = run_start + length
+        lowest = run_start + shortest
+        highest = min(run_start + longest, n - k)
+        run_end = None
+        for distance in range(max(length - shortest, longest - length) + 1):
+            later = expected_end + distance
+            earlier = expected_end - distance
+            if later > highest and earlier < lowest:
+                break
+            if later <= highest and segments.anchor(later, k) == crc:
+                run_end = later
+                break
+            if distance and earlier >= lowest and segments.anchor(earlier, k) == crc:
+                run_end = earlier
+                break
+        if run_end is None:
+            mapped.append((run_start, expected_end, False))
+            run_end = expected_end
+        else:
+            mapped.append((run_start, run_end, True))
+        position = run_end
+        reference_end = start + length
+    return mapped
+
+
+def learn_run_lengths(pattern: str, samples) -> str:
+    """
+    Widens the lengths an aligned pattern allows for its runs to the lengths
+    the runs have in the samples it was created from.
+
+    :param pattern: aligned pattern
+    :param samples: list of Segments
+    :return: aligned pattern
+    """
+    runs = parse_aligned_pattern(pattern)
+    lengths = [[run[1]] for run in runs]
+    for segments in samples:
+        for r, (run_start, run_end, found) in enumerate(map_runs(segments, runs, learning=True)):
+            if found and runs[r][1] is not None:
+                lengths[r].append(run_end - run_start)
+    return format_runs([run if run[1] is None else run[:4] + (min(lengths[r]), max(lengths[r]))
+                        for r, run in enumerate(runs)])
+
+
+def aligned_mask(segments: Segments, runs) -> list:
+    """
+    Maps the runs of an aligned pattern onto a document (see map_runs).
+    A run whose anchor cannot be found is masked at its reference position.
+
+    :param segments: document
+    :param runs: see parse_aligned_pattern
+    :return: ascending list of masked segment indices
+    """
+    mask = []
+    for run_start, run_end, _ in map_runs(segments, runs):
+        mask.extend(range(run_start, run_end))
+    return mask
+
+
+def pattern_fits(segments: Segments, pattern: str) -> bool:
+    """
+    Tells if the runs of a hfc-pattern can be mapped onto a document. If not,
+    the document has changed around a run, and the pattern needs to be learned anew.
+
+    :param segments: document
+    :param pattern: aligned or plain hfc-pattern
+    :return: True for plain patterns, which mask segments by index
+    """
+    if not pattern.startswith(ALIGNED_PATTERN_PREFIX):
+        return True
+    return all(found for _, _, found in map_runs(segments, parse_aligned_pattern(pattern)))
+
+
+def pattern_mask(segments: Segments, pattern: str):
+    """
+    Returns the segments of a document that are masked by a hfc-pattern.
+
+    Aligned patterns are mapped onto the document (see aligned_mask), plain
+    patterns of earlier versions mask segments by index.
+
+    :param segments: document
+    :param pattern: aligned or plain hfc-pattern
+    :return: ascending segment indices
+    """
+    if pattern.startswith(ALIGNED_PATTERN_PREFIX):
+        return aligned_mask(segments, parse_aligned_pattern(pattern))
+    return parse_pattern(pattern)
+
+
+def segment_hashes(segments: Segments, mask) -> list:
+    """
+    Hashes every segment that is not masked. Empty segments are skipped.
+
+    :param segments: document
+    :param mask: ascending segment indices
+    :return: list of tuples (segment index, hash)
+    """
+    masked = set(mask)
+    hashes = []
+    for i in range(len(segments)):
+        if i in masked or segments.starts[i] == segments.ends[i]:
+            continue
+        hashes.append((i, hash(segments[i])))
+    return hashes
+
+
+def changed_segments(segments_1: Segments, mask_1, segments_2: Segments, mask_2):
+    """
+    Compares the stable (not masked) segments of two versions of a document.
+
+    Segments are compared by their hashes, as multisets: a segment counts as
+    unchanged if the other version has an equal segment anywhere, so moved
+    segments are not reported. This is linear in the number of segments.
+
+    :param segments_1: old version
+    :param mask_1: volatile segments of the old version
+    :param segments_2: new version
+    :param mask_2: volatile segments of the new version
+    :return: tuple (removed, added): indices of old segments without counterpart in the
+             new version, and of new segments without counterpart in the old version
+    """
+    hashes_1 = segment_hashes(segments_1, mask_1)
+    hashes_2 = segment_hashes(segments_2, mask_2)
+    unmatched = collections.Counter(h for _, h in hashes_1)
+    added = []
+    for i, h in hashes_2:
+        if unmatched[h] > 0:
+            unmatched[h] -= 1
+        else:
+            added.append(i)
+    removed = []
+    for i, h in reversed(hashes_1):
+        if unmatched[h] > 0:
+            unmatched[h] -= 1
+            removed.append(i)
+    removed.reverse()
+    return removed, added
@@ -0,0 +1,153 @@
+import collections
+import hashlib
+import re
+
+from brang.segments import Segments
+
+SIMHASH_BITS = 64
+# Repeated features are recognized among this many recently added distinct features,
+# which bounds the memory of a SimHasher
+SEEN_FEATURES = 4096
+# Longer segments are split into features of this size, which bounds the buffer of SimHasher.update
+MAX_FEATURE_SIZE = 64 * 1024
+
+# The bit counts of all features are summed up in one big integer, in lanes of
+# this width: lane i of the sum counts the features whose hash has bit i set.
+# A feature is added with 8 table lookups instead of 64 bit operations.
+_LANE_BITS = 32
+_LANE_MASK = (1 << _LANE_BITS) - 1
+# _BYTE_LANES[j][b]: the lanes of byte b at byte position j of a feature hash
+_BYTE_LANES = [[sum(((b >> k) & 1) << ((8 * j + k) * _LANE_BITS) for k in range(8)) for b in range(256)]
+               for j in range(SIMHASH_BITS // 8)]
+
+_SEPARATOR_RE = re.compile(b'[\n<]')
+
+
+def feature_hash(feature: bytes) -> bytes:
+    """
+    :param feature:
+    :return: 8 byte hash of a feature, stable across processes (unlike hash())
+    """
+    return hashlib.blake2b(feature, digest_size=SIMHASH_BITS // 8).digest()
+
+
+class SimHasher(object):
+    """
+    SimHasher computes the SimHash of a document: a 64 bit fingerprint that differs
+    in few bits for similar documents, and in about half of the bits for unrelated ones.
+
+    The features are the non-empty segments of the document, as split by the HFC
+    transform (see brang.segments.Segments); segments longer than MAX_FEATURE_SIZE
+    are split into several features. A feature that repeats one of the last
+    SEEN_FEATURES distinct features, such as a closing tag, is skipped; otherwise
+    repeated features would outvote the content. The features are added in a
+    single pass, either segment by segment (add_segment) or from a body that
+    arrives in chunks (update). Memory usage does not depend on the size of the
+    document.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.seen = collections.OrderedDict()  # hashes of recently added features, least recent first
+        self.pending = b''  # incomplete segment at the end of the data passed to update
+
+    def add(self, feature: bytes):
+        """
+        Adds a feature. Empty and recently repeated features are skipped.
+
+        :param feature:
+        :return:
+        """
+        if not feature:
+            return
+        h = feature_hash(feature)
+        seen = self.seen
+        if h in seen:
+            seen.move_to_end(h)
+            return
+        seen[h] = None
+        if len(seen) > SEEN_FEATURES:
+            seen.popitem(last=False)
+        lanes = _BYTE_LANES
+        self.total += (lanes[0][h[0]] + lanes[1][h[1]] + lanes[2][h[2]] + lanes[3][h[3]] +
+                       lanes[4][h[4]] + lanes[5][h[5]] + lanes[6][h[6]] + lanes[7][h[7]])
+        self.count += 1
+
+    def update(self, data: bytes):
+        """
+        Adds the segments of the next chunk of a document.
+
+        :param data: raw bytes
+        :return:
+        """
+        data = self.pending + data
+        start = 0
+        for m in _SEPARATOR_RE.finditer(data):
+            p = m.start()
+            self.add_segment(data[start:p])
+            start = p + 1 if m.group() == b'\n' else p
+        # The pending segment is added in pieces of MAX_FEATURE_SIZE, like add_segment does
+        # once it is complete, so that it never grows beyond that size.
+        end = len(data) - MAX_FEATURE_SIZE
+        while start < end:
+            self.add(data[start:start + MAX_FEATURE_SIZE])
+            start += MAX_FEATURE_SIZE
+        self.pending = data[start:]
+
+    def add_segment(self, segment: bytes):
+        """
+        Adds a segment, split into features of at most MAX_FEATURE_SIZE bytes.
+
+        :param segment:
+        :return:
+        """
+        if len(segment) <= MAX_FEATURE_SIZE:
+            self.add(segment)
+            return
+        for start in range(0, len(segment), MAX_FEATURE_SIZE):
+            self.add(segment[start:start + MAX_FEATURE_SIZE])
+
+    def hexdigest(self) -> str:
+        """
+        Completes the document and returns its SimHash. Bit i is set if the
+        majority of the features has bit i set.
+
+        :return: 16 hex digits
+        """
+        if self.pending:
+            self.add_segment(self.pending)
+            self.pending = b''
+        simhash = 0
+        for i in range(SIMHASH_BITS):
+            if 2 * ((self.total >> (i * _LANE_BITS)) & _LANE_MASK) > self.count:
+                simhash |= 1 << i
+        return format(simhash, '016x')
+
+
+def create_simhash(segments: Segments, mask=()) -> str:
+    """
+    Creates the SimHash of a document, see SimHasher.
+
+    :param segments: document
+    :param mask: indices of segments that are left out, e.g. the volatile ones (see pattern_mask)
+    :return: 16 hex digits
+    """
+    masked = set(mask)
+    is_str = isinstance(segments.data, str)
+    hasher = SimHasher()
+    for i in range(len(segments)):
+        if i in masked or segments.starts[i] == segments.ends[i]:
+            continue
+        segment = segments[i]
+        hasher.add_segment(segment.encode('utf-8') if is_str else segment)
+    return hasher.hexdigest()
+
+
+def simhash_distance(simhash_1: str, simhash_2: str) -> int:
+    """
+    :param simhash_1: 16 hex digits
+    :param simhash_2: 16 hex digits
+    :return: number of differing bits (0 to 64)
+    """
+    return bin(int(simhash_1, 16) ^ int(simhash_2, 16)).count('1')
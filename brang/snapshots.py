@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import lzma
+import zlib
+from typing import TYPE_CHECKING
+
+import brang.config as config
+
+if TYPE_CHECKING:
+    # brang.database imports SQLAlchemy, which the read-only commands of the command line tool do not load
+    from brang.database import Database
+
+log = logging.getLogger(__name__)
+
+
+def _zlib_compress(data: bytes, level: int) -> bytes:
+    return zlib.compress(data, 6 if level is None else level)
+
+
+def _lzma_compress(data: bytes, level: int) -> bytes:
+    return lzma.compress(data, preset=6 if level is None else level)
+
+
+def _no_compress(data: bytes, level: int) -> bytes:
+    return data
+
+
+# name -> (compress, decompress)
+COMPRESSIONS = {
+    'zlib': (_zlib_compress, zlib.decompress),
+    'lzma': (_lzma_compress, lzma.decompress),
+    'none': (_no_compress, bytes),
+}
+
+
+def decompress(compression: str, data: bytes) -> bytes:
+    """
+    Decompresses the data of a stored snapshot.
+
+    :param compression: see COMPRESSIONS
+    :param data:
+    :return: raw bytes
+    """
+    return COMPRESSIONS[compression][1](data)
+
+
+def create_digest(body: bytes) -> str:
+    """
+    Creates the content address of a body.
+
+    :param body:
+    :return:
+    """
+    return hashlib.sha256(body).hexdigest()
+
+
+class SnapshotStore(object):
+    """
+    SnapshotStore keeps the fetched bodies of pages, compressed and content-addressed.
+
+    A snapshot is stored once per distinct body (sha256 digest), no matter
+    how many SiteChange entries, of how many sites, refer to it. Sites that
+    do not change do not create SiteChange entries, and thus no snapshots.
+    Bodies larger than max_size are not kept. The snapshots of the older
+    SiteChange entries of a site are released by the compaction (see
+    brang.retention and config.snapshot_keep_per_site).
+    """
+
+    def __init__(self, db: 'Database', compression: str = None, level: int = None, max_size: int = None):
+        """
+        :param db:
+        :param compression: 'zlib', 'lzma' or 'none', defaults to config.snapshot_compression
+        :param level: compression level, defaults to config.snapshot_compression_level
+        :param max_size: max. size of a body in bytes, defaults to config.snapshot_max_size
+        """
+        self.db = db
+        self.compression = config.snapshot_compression if compression is None else compression
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown snapshot compression '{self.compression}'.")
+        self.level = config.snapshot_compression_level if level is None else level
+        self.max_size = config.snapshot_max_size if max_size is None else max_size
+
+    def store(self, body: bytes):
+        """
+        Stores a body, unless an equal body is stored already.
+
+        :param body: raw bytes
+        :return: snapshot id, None if the body is too large to be kept
+        """
+        if len(body) > self.max_size:
+            log.debug(f"Body of {len(body)} bytes exceeds the snapshot size limit.")
+            return None
+        digest = create_digest(body)
+        snapshot_id = self.db.get_snapshot_id(digest=digest)
+        if snapshot_id is None:
+            compress = COMPRESSIONS[self.compression][0]
+            snapshot_id = self.db.insert_snapshot(digest=digest,
+                                                  compression=self.compression,
+                                                  size=len(body),
+                                                  data=compress(body, self.level))
+        return snapshot_id
+
+    def load(self, snapshot_id: int) -> bytes:
+        """
+        Loads a stored body.
+
+        :param snapshot_id:
+        :return: raw bytes
+        :raises: SnapshotNotFoundException: if the snapshot does not exist
+        """
+        snapshot = self.db.get_snapshot(snapshot_id=snapshot_id)
+        return decompress(compression=snapshot.compression, data=snapshot.data)
+
+
+def get_default_snapshot_store(db: 'Database'):
+    """
+    Returns a SnapshotStore if snapshots are enabled (config.snapshots_enabled).
+
+    :param db:
+    :return: SnapshotStore or None
+    """
+    return SnapshotStore(db=db) if config.snapshots_enabled else None
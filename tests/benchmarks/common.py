@@ -0,0 +1,97 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_benchmark(name: str, label: str, options: dict, results: list, output_dir: str = None) -> dict:
+    """
+    Saves the results of a benchmark as JSON, together with the version and platform they were measured on.
+
+    :param name: name of the benchmark, prefix of the file name
+    :param label: name of the results, defaults to a timestamp
+    :param options: options of the benchmark
+    :param results: list of dicts
+    :param output_dir: defaults to DEFAULT_OUTPUT_DIR
+    :return: the saved benchmark, its path is benchmark['meta']['path']
+    """
+    output_dir = DEFAULT_OUTPUT_DIR if output_dir is None else output_dir
+    label = label or datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(output_dir, f"{name}-{label}.json")
+    benchmark = {
+        'meta': {
+            'benchmark': name,
+            'label': label,
+            'revision': git_revision(),
+            'created': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'path': path,
+        },
+        'options': options,
+        'results': results,
+    }
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(path, 'w') as f:
+        json.dump(benchmark, f, indent=1)
+    return benchmark
+
+
+def load_benchmark(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def relative_changes(result: dict, before: dict, metrics: tuple, threshold: float = 5.0) -> str:
+    """
+    Describes the relative change of the metrics of a result against an earlier result.
+
+    :param result:
+    :param before: earlier result
+    :param metrics: tuples (metric, True if higher is better)
+    :param threshold: changes for the worse by at least this many percent are marked
+    :return:
+    """
+    changes = []
+    for metric, higher_is_better in metrics:
+        if not before.get(metric) or result.get(metric) is None:
+            continue
+        change = (result[metric] - before[metric]) / before[metric] * 100
+        worse = change < 0 if higher_is_better else change > 0
+        changes.append(f"{metric} {change:+.1f}%{' (worse)' if worse and abs(change) >= threshold else ''}")
+    return ', '.join(changes)
+
+
+def print_comparison(results: list, options: dict, baseline: dict, key, metrics: tuple, compared_options: tuple):
+    """
+    Prints the relative changes of results against the results of an earlier benchmark.
+
+    :param results:
+    :param options: options of the benchmark
+    :param baseline: earlier benchmark, see load_benchmark
+    :param key: function that returns the key matching a result with an earlier one, as str
+    :param metrics: see relative_changes
+    :param compared_options: options that have to be equal for comparable results
+    :return:
+    """
+    previous = {key(r): r for r in baseline['results']}
+    print(f"\nCompared with {baseline['meta'].get('label')} ({baseline['meta'].get('revision')}):")
+    differences = [option for option in compared_options if baseline['options'].get(option) != options.get(option)]
+    if differences:
+        print(f"  Warning: the benchmarks differ in {', '.join(differences)}.")
+    for result in results:
+        before = previous.get(key(result))
+        if before is not None:
+            print(f"  {key(result)}: {relative_changes(result, before, metrics)}")
@@ -0,0 +1,105 @@
+import datetime
+import random
+
+_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+          'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua', 'über', 'café')
+_TAGS = ('div', 'p', 'span', 'li', 'a', 'td', 'em')
+_VOLATILE_KINDS = ('timestamp', 'nonce', 'counter', 'ad')
+
+
+class CorpusDocument(object):
+    """
+    CorpusDocument is a synthetic HTML document, of which any number of samples can be rendered.
+
+    The stable elements are the same in all samples, the volatile elements
+    (timestamps, nonces, counters and ad blocks of varying length) differ.
+    A revision changes a few stable elements, as an update of a site would.
+    """
+
+    def __init__(self, size: int, tag_density: float = 20.0, volatile_fraction: float = 0.05, seed: int = 0):
+        """
+        :param size: approx. size in bytes
+        :param tag_density: tags per KB; words per element are chosen to match it
+        :param volatile_fraction: fraction of the elements that are volatile (0..1)
+        :param seed:
+        """
+        self.size = size
+        self.tag_density = tag_density
+        self.volatile_fraction = volatile_fraction
+        self.seed = seed
+        self._elements = self._create_elements()
+
+    def _create_elements(self) -> list:
+        """
+        :return: list of elements, str for stable ones, the kind (see _VOLATILE_KINDS) for volatile ones
+        """
+        rng = random.Random(self.seed)
+        # An element has two tags, its text is sized to match the tag density
+        words_per_element = max(1, int(2 * 1024 / self.tag_density / 7) - 3)
+        elements = []
+        length = 0
+        i = 0
+        while length < self.size:
+            if rng.random() < self.volatile_fraction:
+                kind = rng.choice(_VOLATILE_KINDS)
+                elements.append((kind, i))
+                length += 60
+            else:
+                tag = rng.choice(_TAGS)
+                words = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(1, 2 * words_per_element)))
+                element = f'<{tag} class="c{i % 50}">{words}</{tag}>\n'
+                elements.append(element)
+                length += len(element.encode('utf-8'))
+            i += 1
+        return elements
+
+    def sample(self, sample: int = 0, revision: int = 0, encoding: str = 'utf-8'):
+        """
+        Renders a sample of the document.
+
+        :param sample: number of the sample, determines the volatile elements
+        :param revision: number of the revision, determines the changed stable elements
+        :param encoding: None for str
+        :return: bytes, or str if encoding is None
+        """
+        rng = random.Random(f"{self.seed}:{sample}")
+        revision_rng = random.Random(f"{self.seed}:r{revision}")
+        changed = set(revision_rng.sample(range(len(self._elements)), min(3, len(self._elements)))) \
+            if revision else set()
+        timestamp = datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=sample * 3607)
+        parts = ['<!DOCTYPE html>\n<html><head><title>Corpus</title></head>\n<body>\n']
+        for i, element in enumerate(self._elements):
+            if isinstance(element, tuple):
+                kind, n = element
+                if kind == 'timestamp':
+                    parts.append(f'<span class="time">{timestamp.isoformat()}</span>\n')
+                elif kind == 'nonce':
+                    parts.append(f'<input type="hidden" name="csrf" value="{rng.getrandbits(128):032x}">\n')
+                elif kind == 'counter':
+                    parts.append(f'<span class="views">{rng.randint(0, 10 ** rng.randint(1, 6))} views</span>\n')
+                else:
+                    ad = ''.join(f'<li>{rng.choice(_WORDS)}</li>' for _ in range(rng.randint(0, 3)))
+                    parts.append(f'<ul class="ad">{ad}</ul>\n')
+            elif i in changed:
+                parts.append(element.replace('>', f'>revision {revision} ', 1))
+            else:
+                parts.append(element)
+        parts.append('</body></html>\n')
+        text = ''.join(parts)
+        return text if encoding is None else text.encode(encoding)
+
+
+def create_samples(size: int, tag_density: float = 20.0, volatile_fraction: float = 0.05,
+                   samples: int = 3, seed: int = 0) -> list:
+    """
+    Creates samples of one synthetic document, see CorpusDocument.
+
+    :param size: approx. size in bytes
+    :param tag_density: tags per KB
+    :param volatile_fraction: fraction of the elements that are volatile (0..1)
+    :param samples: number of samples
+    :param seed:
+    :return: list of bytes
+    """
+    document = CorpusDocument(size=size, tag_density=tag_density, volatile_fraction=volatile_fraction, seed=seed)
+    return [document.sample(sample=i) for i in range(samples)]
@@ -0,0 +1,223 @@
+"""
+  Microbenchmarks of the fingerprinting of HfcInvarianceCheckStrategy.
+
+  Measures transform, create_pattern, apply_pattern, create_fingerprint,
+  create_raw_fingerprint and create_simhash on synthetic HTML documents (see
+  tests.benchmarks.corpus) of several sizes, tag densities and volatile
+  fractions. Reports the time per operation (min and median of repeated runs)
+  and the peak memory allocated by an operation (tracemalloc). Every pattern
+  is also checked for being stable across samples and for detecting a
+  revision of the document.
+
+  Results are saved as JSON (see --output-dir) and can be compared with the
+  results of an earlier version (--compare).
+
+  Usage, from the root of the repository:
+    python -m tests.benchmarks.fingerprinting
+    python -m tests.benchmarks.fingerprinting --sizes 10K,1M --operations apply_pattern
+    python -m tests.benchmarks.fingerprinting --compare tests/benchmarks/results/fingerprinting-<earlier>.json
+"""
+import argparse
+import math
+import statistics
+import time
+import tracemalloc
+
+import brang.config as config
+from brang.change_checker import HfcInvarianceCheckStrategy, create_fingerprint, create_raw_fingerprint
+from tests.benchmarks.common import DEFAULT_OUTPUT_DIR, save_benchmark, load_benchmark, print_comparison
+from tests.benchmarks.corpus import CorpusDocument
+
+OPERATIONS = ('transform', 'create_pattern', 'apply_pattern', 'create_fingerprint', 'create_raw_fingerprint',
+              'create_simhash')
+# Metrics compared by --compare; True if higher is better
+COMPARED_METRICS = (('seconds_median', False), ('peak_alloc_bytes', False))
+# Options that have to be equal for comparable results
+COMPARED_OPTIONS = ('seed', 'samples')
+_SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2}
+
+
+def parse_size(value: str) -> int:
+    """
+    :param value: bytes, e.g. 10000, 10K or 10M
+    :return:
+    """
+    value = value.strip().upper()
+    if value[-1:] in _SIZE_SUFFIXES:
+        return int(float(value[:-1]) * _SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def format_size(size: int) -> str:
+    for suffix, factor in sorted(_SIZE_SUFFIXES.items(), key=lambda item: -item[1]):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{suffix}"
+    return str(size)
+
+
+def measure_time(operation, min_time: float, max_repeat: int) -> list:
+    """
+    Runs an operation repeatedly, until min_time has passed or max_repeat runs are done.
+    Operations that take less than min_time are warmed up by a first, unmeasured run.
+
+    :param operation: function without arguments
+    :param min_time: seconds
+    :param max_repeat:
+    :return: list of seconds per run
+    """
+    start = time.perf_counter()
+    operation()
+    first = time.perf_counter() - start
+    if first >= min_time:
+        return [first]
+    times = []
+    for _ in range(max(1, min(max_repeat, math.ceil(min_time / max(first, 1e-9))))):
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def measure_allocations(operation) -> int:
+    """
+    :param operation: function without arguments
+    :return: peak bytes allocated during the operation
+    """
+    tracemalloc.start()
+    try:
+        operation()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def create_operations(samples: list, pattern: str) -> dict:
+    """
+    :param samples: samples of a document, bytes
+    :param pattern: hfc-pattern of the samples
+    :return: operation name -> function without arguments
+    """
+    texts = [sample.decode('utf-8') for sample in samples]
+    return {
+        'transform': lambda: HfcInvarianceCheckStrategy.transform(samples[0]),
+        'create_pattern': lambda: HfcInvarianceCheckStrategy.create_pattern(*samples),
+        'apply_pattern': lambda: HfcInvarianceCheckStrategy.apply_pattern(pattern, samples[-1]),
+        'create_fingerprint': lambda: create_fingerprint(texts[0]),
+        'create_raw_fingerprint': lambda: create_raw_fingerprint(samples[0]),
+        'create_simhash': lambda: HfcInvarianceCheckStrategy.create_simhash(pattern, samples[-1]),
+    }
+
+
+def run_benchmarks(sizes: list, tag_densities: list, volatile_fractions: list, operations: list,
+                   samples: int = None, seed: int = 0, min_time: float = 1.0, max_repeat: int = 20,
+                   allocations: bool = True, verbose: bool = False) -> list:
+    """
+    Runs the microbenchmarks for all combinations of the corpus parameters.
+
+    :param sizes: document sizes in bytes
+    :param tag_densities: tags per KB
+    :param volatile_fractions: fractions of volatile elements
+    :param operations: see OPERATIONS
+    :param samples: samples a pattern is created of, defaults to config.hfc_sample_count
+    :param seed:
+    :param min_time: min. seconds to measure an operation
+    :param max_repeat: max. runs of an operation
+    :param allocations: measure the peak allocations (tracemalloc) as well
+    :param verbose: print every result
+    :return: list of results
+    """
+    samples = config.hfc_sample_count if samples is None else samples
+    results = []
+    for size in sizes:
+        for tag_density in tag_densities:
+            for volatile_fraction in volatile_fractions:
+                document = CorpusDocument(size=size, tag_density=tag_density,
+                                          volatile_fraction=volatile_fraction, seed=seed)
+                bodies = [document.sample(sample=i) for i in range(samples + 1)]
+                pattern = HfcInvarianceCheckStrategy.create_pattern(*bodies[:samples])
+                fingerprint = HfcInvarianceCheckStrategy.apply_pattern(pattern, bodies[0])
+                revised = HfcInvarianceCheckStrategy.apply_pattern(pattern, document.sample(sample=0, revision=1))
+                corpus = {
+                    'size': format_size(size),
+                    'bytes': len(bodies[0]),
+                    'tag_density': tag_density,
+                    'volatile_fraction': volatile_fraction,
+                    'pattern_stable': HfcInvarianceCheckStrategy.apply_pattern(pattern, bodies[-1]) == fingerprint,
+                    'detects_revision': revised != fingerprint,
+                }
+                functions = create_operations(samples=bodies[:samples], pattern=pattern)
+                for operation in operations:
+                    times = measure_time(functions[operation], min_time=min_time, max_repeat=max_repeat)
+                    median = statistics.median(times)
+                    result = dict(corpus,
+                                  operation=operation,
+                                  repeat=len(times),
+                                  seconds_min=min(times),
+                                  seconds_median=median,
+                                  mb_per_second=len(bodies[0]) / 2 ** 20 / median if median else None,
+                                  peak_alloc_bytes=measure_allocations(functions[operation]) if allocations
+                                  else None)
+                    results.append(result)
+                    if verbose:
+                        print_result(result)
+    return results
+
+
+def result_key(result: dict) -> str:
+    return f"{result['operation']} {result['size']} d={result['tag_density']} v={result['volatile_fraction']}"
+
+
+def print_header():
+    print(f"{'operation':24} {'size':>5} {'tags/KB':>7} {'volatile':>8} {'median ms':>10} {'MB/s':>8} "
+          f"{'peak alloc':>10} {'stable':>6} {'revision':>8}")
+
+
+def print_result(r: dict):
+    alloc = '-' if r['peak_alloc_bytes'] is None else f"{r['peak_alloc_bytes'] / max(1, r['bytes']):.2f}x"
+    print(f"{r['operation']:24} {r['size']:>5} {r['tag_density']:>7} {r['volatile_fraction']:>8} "
+          f"{r['seconds_median'] * 1000:>10.3f} {r['mb_per_second'] or 0:>8.1f} {alloc:>10} "
+          f"{str(r['pattern_stable']):>6} {str(r['detects_revision']):>8}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the HFC fingerprinting.")
+    parser.add_argument('--sizes', default='10K,100K,1M,10M', help="document sizes, e.g. 10K,1M")
+    parser.add_argument('--tag-densities', default='5,40', help="tags per KB")
+    parser.add_argument('--volatile-fractions', default='0.01,0.1', help="fractions of volatile elements")
+    parser.add_argument('--operations', default=','.join(OPERATIONS))
+    parser.add_argument('--samples', type=int, default=None, help="samples per pattern, default hfc_sample_count")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-time', type=float, default=1.0, help="min. seconds to measure an operation")
+    parser.add_argument('--max-repeat', type=int, default=20)
+    parser.add_argument('--no-allocations', action='store_true', help="do not measure allocations")
+    parser.add_argument('--label', default=None, help="name of the results, defaults to a timestamp")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--compare', default=None, help="results of an earlier benchmark (JSON)")
+    args = parser.parse_args(args)
+
+    operations = args.operations.split(',')
+    for operation in operations:
+        if operation not in OPERATIONS:
+            parser.error(f"Unknown operation '{operation}'.")
+    print_header()
+    results = run_benchmarks(sizes=[parse_size(size) for size in args.sizes.split(',')],
+                             tag_densities=[float(d) for d in args.tag_densities.split(',')],
+                             volatile_fractions=[float(v) for v in args.volatile_fractions.split(',')],
+                             operations=operations,
+                             samples=args.samples,
+                             seed=args.seed,
+                             min_time=args.min_time,
+                             max_repeat=args.max_repeat,
+                             allocations=not args.no_allocations,
+                             verbose=True)
+    benchmark = save_benchmark(name='fingerprinting', label=args.label, options=vars(args), results=results,
+                               output_dir=args.output_dir)
+    print(f"\nResults saved to {benchmark['meta']['path']}")
+    if args.compare:
+        print_comparison(results=results, options=vars(args), baseline=load_benchmark(args.compare),
+                         key=result_key, metrics=COMPARED_METRICS, compared_options=COMPARED_OPTIONS)
+    return benchmark
+
+
+if __name__ == '__main__':
+    main()
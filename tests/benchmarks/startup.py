@@ -0,0 +1,137 @@
+"""
+  Startup-time benchmark of the command line tool (bin/brang).
+
+  Runs commands of the tool repeatedly in fresh processes, with a temporary
+  home directory holding a database of --sites sites, and reports the wall
+  time per command (min and median) next to the startup time of a bare
+  Python interpreter. It also reports whether a command loads SQLAlchemy
+  or requests.
+
+  Results are saved as JSON (see --output-dir) and can be compared with the
+  results of an earlier version (--compare).
+
+  Usage, from the root of the repository:
+    python -m tests.benchmarks.startup
+    python -m tests.benchmarks.startup --compare tests/benchmarks/results/startup-<earlier>.json
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.benchmarks.common import DEFAULT_OUTPUT_DIR, save_benchmark, load_benchmark, print_comparison
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+BRANG = os.path.join(ROOT_DIR, 'bin', 'brang')
+SITE_URL = 'http://localhost:5000/site/{}/'
+# name -> arguments of the python interpreter
+COMMANDS = {
+    'python': ['-c', 'pass'],
+    'help': [BRANG, '--help'],
+    'list': [BRANG, 'list'],
+    'snapshot': [BRANG, 'snapshot', SITE_URL.format(0)],
+}
+HEAVY_MODULES = ('sqlalchemy', 'requests')
+# Metrics compared by --compare; True if higher is better
+COMPARED_METRICS = (('seconds_median', False),)
+COMPARED_OPTIONS = ('sites',)
+
+
+def create_database(home: str, sites: int):
+    """
+    Creates the database of brang in a home directory, with sites and a snapshot of the first site.
+
+    :param home:
+    :param sites:
+    :return:
+    """
+    code = ("import datetime\n"
+            "from brang.database import SQLiteDatabase\n"
+            "from brang.snapshots import SnapshotStore\n"
+            "db = SQLiteDatabase(db_filename='.brang/brang.db')\n"
+            "with db.batch():\n"
+            f"    for n in range({sites}):\n"
+            f"        db.insert_site(url={SITE_URL!r}.format(n))\n"
+            f"site = db.get_site(url={SITE_URL!r}.format(0))\n"
+            "snapshot_id = SnapshotStore(db=db).store(b'<html>site 0</html>')\n"
+            "db.insert_site_change_entry(site=site, fingerprint='f', pattern='',\n"
+            "                            timestamp=datetime.datetime.now(), snapshot_id=snapshot_id)\n")
+    os.makedirs(os.path.join(home, '.brang'))
+    subprocess.check_call([sys.executable, '-c', code], cwd=home, env=environment(home))
+
+
+def environment(home: str) -> dict:
+    env = dict(os.environ, HOME=home)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def loaded_modules(home: str, arguments: list) -> list:
+    """
+    :return: the heavy modules (HEAVY_MODULES) a command loads
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime'] + arguments, env=environment(home),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).stderr.decode()
+    imported = {line.split('|')[-1].strip() for line in output.splitlines() if line.startswith('import time:')}
+    return [module for module in HEAVY_MODULES if module in imported]
+
+
+def measure(home: str, arguments: list, repeat: int) -> list:
+    """
+    :return: list of seconds per run
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, env=environment(home),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Startup-time benchmark of the command line tool.")
+    parser.add_argument('--sites', type=int, default=100, help="sites in the database")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--commands', default=','.join(COMMANDS))
+    parser.add_argument('--label', default=None, help="name of the results, defaults to a timestamp")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--compare', default=None, help="results of an earlier benchmark (JSON)")
+    args = parser.parse_args(args)
+
+    home = tempfile.mkdtemp(prefix='brang-startup-')
+    results = []
+    try:
+        create_database(home=home, sites=args.sites)
+        print(f"{'command':10} {'min ms':>8} {'median ms':>10}  heavy modules")
+        for name in args.commands.split(','):
+            arguments = COMMANDS[name]
+            times = measure(home=home, arguments=arguments, repeat=args.repeat)
+            result = {
+                'command': name,
+                'repeat': len(times),
+                'seconds_min': min(times),
+                'seconds_median': statistics.median(times),
+                'heavy_modules': loaded_modules(home=home, arguments=arguments),
+            }
+            results.append(result)
+            print(f"{name:10} {result['seconds_min'] * 1000:>8.1f} {result['seconds_median'] * 1000:>10.1f}  "
+                  f"{', '.join(result['heavy_modules']) or '-'}")
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    benchmark = save_benchmark(name='startup', label=args.label, options=vars(args), results=results,
+                               output_dir=args.output_dir)
+    print(f"\nResults saved to {benchmark['meta']['path']}")
+    if args.compare:
+        print_comparison(results=results, options=vars(args), baseline=load_benchmark(args.compare),
+                         key=lambda r: r['command'], metrics=COMPARED_METRICS, compared_options=COMPARED_OPTIONS)
+    return benchmark
+
+
+if __name__ == '__main__':
+    main()
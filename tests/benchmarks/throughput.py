@@ -0,0 +1,241 @@
+"""
+  Throughput benchmark of ChangeChecker.check_all_sites against a local WebFarm.
+
+  Every strategy is measured in a fresh process (peak RSS), with a fresh
+  database, over several runs: the first run creates the fingerprints, the
+  farm advances to its next generation before every further run (some sites
+  change, see WebFarm). Per run, the benchmark reports sites/second, p50/p99
+  latency of the checks of a site, peak RSS and database growth.
+
+  Results are saved as JSON (see --output-dir) and can be compared with the
+  results of an earlier version (--compare).
+
+  Usage, from the root of the repository:
+    python -m tests.benchmarks.throughput --sites 1000 --strategies naive,hfc
+    python -m tests.benchmarks.throughput --compare tests/benchmarks/results/throughput-<earlier>.json
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from tests.benchmarks.common import DEFAULT_OUTPUT_DIR, save_benchmark, load_benchmark, print_comparison
+from tests.benchmarks.web_farm import WebFarm
+
+log = logging.getLogger(__name__)
+
+STRATEGIES = ('naive', 'hfc')
+# Metrics compared by --compare; True if higher is better
+COMPARED_METRICS = (('sites_per_second', True), ('latency_p50', False), ('latency_p99', False),
+                    ('peak_rss_bytes', False), ('db_growth_bytes', False))
+# Options that have to be equal for comparable results
+COMPARED_OPTIONS = ('sites', 'size', 'volatility', 'change_rate', 'latency', 'error_rate', 'hosts', 'seed',
+                    'runs', 'workers', 'workers_per_host', 'rate', 'sample_delay', 'snapshots')
+
+
+def percentile(values: list, p: float):
+    """
+    :param values:
+    :param p: 0..100
+    :return: nearest-rank percentile, None for no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(p / 100.0 * len(values)))
+    return values[rank - 1]
+
+
+def peak_rss() -> int:
+    """
+    :return: peak resident set size of this process in bytes, None if unknown
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def database_size(db_filename: str) -> int:
+    return sum(os.path.getsize(path) for path in (db_filename, db_filename + '-wal') if os.path.exists(path))
+
+
+def create_strategy(name: str, db, options: dict):
+    from brang.change_checker import NaiveCheckStrategy, HfcInvarianceCheckStrategy
+    from brang.fetcher import Fetcher
+    if name == 'naive':
+        return NaiveCheckStrategy(db=db, fetcher=Fetcher())
+    if name == 'hfc':
+        return HfcInvarianceCheckStrategy(db=db, fetcher=Fetcher(),
+                                          sample_delay=options['sample_delay'],
+                                          recheck_delay=options['sample_delay'])
+    raise ValueError(f"Unknown strategy '{name}'.")
+
+
+def timed_check_steps(check_steps, latencies: list, outcomes: dict):
+    """
+    Wraps the check_steps of a strategy, recording the time from the start to the end of the check of each site.
+    """
+    def steps(site):
+        start = time.perf_counter()
+        try:
+            update_detected = yield from check_steps(site=site)
+        except Exception:
+            outcomes['errors'] += 1
+            raise
+        finally:
+            latencies.append(time.perf_counter() - start)
+        if update_detected:
+            outcomes['changes'] += 1
+        return update_detected
+    return steps
+
+
+def run_strategy(name: str, urls: list, options: dict) -> list:
+    """
+    Benchmarks a strategy, to be run in a fresh process.
+
+    :param name: see STRATEGIES
+    :param urls: sites of the farm
+    :param options: see main
+    :return: list of results, one per run
+    """
+    logging.basicConfig(level=options['log_level'])
+    import requests
+    import brang.config as config
+    from brang.change_checker import ChangeChecker
+    from brang.database import SQLiteDatabase
+
+    hosts = {url.split('/')[2].split(':')[0] for url in urls}
+    config.rate_limit_hosts = {host: (options['rate'], options['rate']) for host in hosts}
+    config.http_pool_maxsize = max(config.http_pool_maxsize, options['workers_per_host'])
+    config.snapshots_enabled = options['snapshots']
+
+    tmp_dir = tempfile.mkdtemp(prefix='brang-benchmark-')
+    try:
+        db_filename = os.path.join(tmp_dir, 'brang.db')
+        db = SQLiteDatabase(db_filename=db_filename)
+        with db.batch():
+            for url in urls:
+                db.insert_site(url=url)
+        strategy = create_strategy(name=name, db=db, options=options)
+        latencies = []
+        outcomes = {'errors': 0, 'changes': 0}
+        strategy.check_steps = timed_check_steps(strategy.check_steps, latencies=latencies, outcomes=outcomes)
+        checker = ChangeChecker(db=db, change_check_strategy=strategy,
+                                workers=options['workers'], workers_per_host=options['workers_per_host'])
+
+        results = []
+        for run in range(options['runs']):
+            if run > 0:
+                requests.post(options['farm_url'] + 'advance/').raise_for_status()
+            del latencies[:]
+            outcomes.update(errors=0, changes=0)
+            size_before = database_size(db_filename)
+            requests_before = requests.get(options['farm_url'] + 'stats/').json()['requests']
+            start = time.perf_counter()
+            checker.check_all_sites()
+            elapsed = time.perf_counter() - start
+            db_bytes = database_size(db_filename)
+            farm_requests = requests.get(options['farm_url'] + 'stats/').json()['requests'] - requests_before
+            results.append({
+                'strategy': name,
+                'run': run,
+                'sites': len(urls),
+                'seconds': elapsed,
+                'sites_per_second': len(urls) / elapsed,
+                'latency_p50': percentile(latencies, 50),
+                'latency_p99': percentile(latencies, 99),
+                'errors': outcomes['errors'],
+                'changes': outcomes['changes'],
+                'requests_per_site': farm_requests / len(urls),
+                'peak_rss_bytes': peak_rss(),
+                'db_bytes': db_bytes,
+                'db_growth_bytes': db_bytes - size_before,
+            })
+            log.info(f"{name} run {run}: {results[-1]['sites_per_second']:.1f} sites/s")
+        strategy.fetcher.close()
+        db.session.close()
+        return results
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def print_results(results: list):
+    print(f"\n{'strategy':8} {'run':>3} {'sites/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6} "
+          f"{'changes':>7} {'peak RSS MB':>11} {'DB growth KB':>12}")
+    for r in results:
+        rss = '-' if r['peak_rss_bytes'] is None else f"{r['peak_rss_bytes'] / 2 ** 20:.1f}"
+        print(f"{r['strategy']:8} {r['run']:>3} {r['sites_per_second']:>9.1f} {(r['latency_p50'] or 0) * 1000:>8.1f} "
+              f"{(r['latency_p99'] or 0) * 1000:>8.1f} {r['errors']:>6} {r['changes']:>7} {rss:>11} "
+              f"{r['db_growth_bytes'] / 1024:>12.1f}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Throughput benchmark of brang against a local web farm.")
+    parser.add_argument('--sites', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=20000, help="approx. bytes per page")
+    parser.add_argument('--volatility', type=float, default=0.05, help="fraction of volatile elements")
+    parser.add_argument('--change-rate', type=float, default=0.1, help="fraction of sites changing per run")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of responses with status 500")
+    parser.add_argument('--hosts', type=int, default=1, help="loopback addresses to spread the sites over (Linux)")
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--strategies', default=','.join(STRATEGIES))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--workers-per-host', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=None, help="requests per second and host, default unlimited")
+    parser.add_argument('--sample-delay', type=float, default=0.0, help="seconds between the samples of hfc")
+    parser.add_argument('--snapshots', action='store_true', help="keep snapshots of the bodies")
+    parser.add_argument('--label', default=None, help="name of the results, defaults to a timestamp")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--compare', default=None, help="results of an earlier benchmark (JSON)")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(args)
+    logging.basicConfig(level=args.log_level)
+    # Do not log every request to the farm
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    options = {
+        'runs': args.runs,
+        'workers': args.workers,
+        'workers_per_host': args.workers_per_host,
+        'rate': args.rate,
+        'sample_delay': args.sample_delay,
+        'snapshots': args.snapshots,
+        'log_level': args.log_level,
+        'farm_url': f"http://127.0.0.1:{args.port}/",
+    }
+    farm = WebFarm(sites=args.sites, size=args.size, volatility=args.volatility, change_rate=args.change_rate,
+                   latency=args.latency, error_rate=args.error_rate, hosts=args.hosts, port=args.port,
+                   seed=args.seed)
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with farm:
+        for name in args.strategies.split(','):
+            farm.reset()
+            with context.Pool(processes=1) as pool:
+                results += pool.apply(run_strategy, (name, farm.urls(), options))
+
+    print_results(results)
+    benchmark = save_benchmark(name='throughput', label=args.label, options=vars(args), results=results,
+                               output_dir=args.output_dir)
+    print(f"\nResults saved to {benchmark['meta']['path']}")
+    if args.compare:
+        print_comparison(results=results, options=vars(args), baseline=load_benchmark(args.compare),
+                         key=lambda r: f"{r['strategy']} run {r['run']}",
+                         metrics=COMPARED_METRICS, compared_options=COMPARED_OPTIONS)
+    return benchmark
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import threading
+import logging
+import datetime
+import hashlib
+import random
+import time
+
+import flask
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+log = logging.getLogger(__name__)
+
+_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+          'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua')
+# Placeholders of the volatile parts of a page
+_TIMESTAMP = '\0ts\0'
+_NONCE = '\0nonce\0'
+
+
+class _KeepAliveRequestHandler(WSGIRequestHandler):
+    # Keeps connections open, as most web servers do
+    protocol_version = 'HTTP/1.1'
+
+
+class WebFarm(object):
+    """
+    WebFarm serves many synthetic sites from a local server, e.g. for benchmarks.
+
+    Site n is served at /site/n/. Its page is generated deterministically from
+    the seed and n, and contains:
+     - stable content, which changes with probability change_rate whenever
+       the farm advances to the next generation (advance, or POST /advance/),
+     - volatile elements (timestamps and nonces) that change with every request;
+       volatility is the fraction of the elements of a page that are volatile.
+
+    Responses are delayed by latency seconds, and fail with status 500 with
+    probability error_rate. The sites can be spread over several loopback
+    addresses (127.0.0.1 to 127.0.0.<hosts>, Linux only) to exercise the
+    per-host limits of the checker.
+    """
+
+    def __init__(self, sites: int = 1000, size: int = 20000, volatility: float = 0.05,
+                 change_rate: float = 0.1, latency: float = 0.0, error_rate: float = 0.0,
+                 hosts: int = 1, port: int = 5100, seed: int = 0):
+        """
+        :param sites: number of sites
+        :param size: approx. size of a page in bytes
+        :param volatility: fraction of volatile elements (0..1)
+        :param change_rate: probability that a site changes per generation (0..1)
+        :param latency: seconds a response is delayed
+        :param error_rate: probability of a response with status 500 (0..1)
+        :param hosts: number of loopback addresses the sites are spread over
+        :param port:
+        :param seed:
+        """
+        self.sites = sites
+        self.size = size
+        self.volatility = volatility
+        self.change_rate = change_rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hosts = hosts
+        self.port = port
+        self.seed = seed
+        self.generation = 0
+        self.requests = 0
+        self._pages = {}  # site -> (version, list of parts)
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._servers = []
+
+    def host(self, n: int) -> str:
+        return f"127.0.0.{n % self.hosts + 1}"
+
+    def url(self, n: int) -> str:
+        return f"http://{self.host(n)}:{self.port}/site/{n}/"
+
+    def urls(self) -> list:
+        return [self.url(n) for n in range(self.sites)]
+
+    def _changes(self, n: int, generation: int) -> bool:
+        digest = hashlib.sha1(f"{self.seed}:{n}:{generation}".encode('ascii')).digest()
+        return int.from_bytes(digest[:4], 'big') / 2 ** 32 < self.change_rate
+
+    def version(self, n: int) -> int:
+        """
+        :param n: site
+        :return: version of the stable content of the site in the current generation
+        """
+        return sum(1 for generation in range(1, self.generation + 1) if self._changes(n, generation))
+
+    def advance(self):
+        """
+        Advances to the next generation: the stable content of some sites changes (see change_rate).
+
+        :return:
+        """
+        with self._lock:
+            self.generation += 1
+
+    def reset(self):
+        with self._lock:
+            self.generation = 0
+            self.requests = 0
+            self._random.seed(self.seed)
+
+    def _parts(self, n: int, version: int) -> list:
+        cached = self._pages.get(n)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        rng = random.Random(f"{self.seed}:{n}")
+        parts = [f"<!DOCTYPE html>\n<html><head><title>Site {n}</title></head>\n<body>\n",
+                 f"<h1>Site {n}, version {version}</h1>\n"]
+        length = sum(len(part) for part in parts)
+        i = 0
+        while length < self.size:
+            if rng.random() < self.volatility:
+                volatile = ['<p class="meta">Updated <span>', _TIMESTAMP, '</span></p>\n'] if i % 2 == 0 \
+                    else ['<input type="hidden" name="nonce" value="', _NONCE, '">\n']
+                parts += volatile
+                length += sum(len(part) for part in volatile) + 26
+            else:
+                words = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(5, 40)))
+                part = f'<div class="item-{i}"><p>{words}</p></div>\n'
+                parts.append(part)
+                length += len(part)
+            i += 1
+        parts.append("</body></html>\n")
+        self._pages[n] = (version, parts)
+        return parts
+
+    def page(self, n: int) -> str:
+        """
+        Renders the current page of a site.
+
+        :param n: site
+        :return:
+        """
+        with self._lock:
+            nonce = '%032x' % self._random.getrandbits(128)
+        timestamp = datetime.datetime.now().isoformat()
+        return ''.join(timestamp if part is _TIMESTAMP else nonce if part is _NONCE else part
+                       for part in self._parts(n, self.version(n)))
+
+    def create_app(self):
+        app = flask.Flask('web_farm')
+
+        @app.route('/site/<int:n>/')
+        def site(n):
+            if n >= self.sites:
+                flask.abort(404)
+            with self._lock:
+                self.requests += 1
+                failed = self._random.random() < self.error_rate
+            if self.latency:
+                time.sleep(self.latency)
+            if failed:
+                return flask.Response("error", status=500)
+            return self.page(n)
+
+        @app.route('/advance/', methods=['POST'])
+        def advance():
+            self.advance()
+            return str(self.generation)
+
+        @app.route('/reset/', methods=['POST'])
+        def reset():
+            self.reset()
+            return "0"
+
+        @app.route('/stats/')
+        def stats():
+            return flask.jsonify(generation=self.generation, requests=self.requests)
+
+        return app
+
+    def start(self):
+        app = self.create_app()
+        for i in range(min(self.hosts, self.sites)):
+            server = make_server(self.host(i), self.port, app, threaded=True,
+                                 request_handler=_KeepAliveRequestHandler)
+            thread = threading.Thread(target=server.serve_forever, name=f'web-farm-{i}', daemon=True)
+            thread.start()
+            self._servers.append((server, thread))
+        log.info(f"Web farm of {self.sites} sites started on port {self.port}.")
+
+    def stop(self):
+        for server, thread in self._servers:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self._servers = []
+        log.info("Web farm stopped.")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -45,6 +45,41 @@ def start_server():
         """
         return "void"
 
+    @app.route('/etag/')
+    def etag():
+        """
+        This mimics a website that never changes and supports conditional requests.
+        :return:
+        """
+        response = flask.make_response("void")
+        response.set_etag("void-v1")
+        response.headers['Last-Modified'] = 'Sat, 15 Oct 1988 00:00:00 GMT'
+        return response.make_conditional(flask.request)
+
+    @app.route('/region/')
+    def region():
+        """
+        This mimics a website whose news never change, while the rest of the page is always changing.
+        :return:
+        """
+        s = datetime.datetime.now().isoformat()
+        return (f"<html><head><title>{s}</title></head><body>"
+                f"<div id=\"news\"><ul><li>Stable news<li>More news</ul></div>"
+                f"<p>{s}</body></html>")
+
+    throttled = {'count': 0}
+
+    @app.route('/throttled/')
+    def throttled_once():
+        """
+        This mimics a website that asks every other request to retry after a second.
+        :return:
+        """
+        throttled['count'] += 1
+        if throttled['count'] % 2 == 1:
+            return flask.Response("busy", status=429, headers={'Retry-After': '1'})
+        return "void"
+
     server = ServerThread(app)
     server.start()
     log.info('server started')
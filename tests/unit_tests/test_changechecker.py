@@ -6,8 +6,9 @@ import mailtest
 
 import tests.test_server as test_server
 import brang.database as database
-from brang.change_checker import request_site
-from brang.change_checker import ChangeChecker, NaiveCheckStrategy
+from brang.change_checker import request_site, fetch_site
+from brang.change_checker import create_fingerprint, create_raw_fingerprint, create_streaming_fingerprints
+from brang.change_checker import ChangeChecker, NaiveCheckStrategy, HfcInvarianceCheckStrategy
 from brang.exceptions import RequestError
 from brang.database import Site, SiteChange
 from brang import config
@@ -20,6 +21,7 @@ class ChangeCheckerTests(unittest.TestCase):
         logging.info("setUp")
         self.url_fix = 'http://localhost:5000/fix'
         self.url_changing = 'http://localhost:5000/changing'
+        self.url_etag = 'http://localhost:5000/etag/'
         self.db = database.SQLiteDatabase(db_filename=':memory:')
         test_server.start_server()
         self.naive_check_strategy = NaiveCheckStrategy(db=self.db)
@@ -34,6 +36,49 @@ class ChangeCheckerTests(unittest.TestCase):
         ex = cm.exception
         logging.info(ex)
 
+    def test_fetch_site_not_modified(self):
+        self.db.insert_site(url=self.url_etag)
+        site = self.db.get_site(url=self.url_etag)
+        self.assertIsNotNone(fetch_site(site=site, conditional=True))
+        self.naive_check_strategy.store_validators(site, fetch_site(site=site))
+        self.assertEqual('"void-v1"', self.db.get_site(url=self.url_etag).etag)
+        self.assertIsNone(fetch_site(site=site, conditional=True))
+
+    def test_check_site_not_modified(self):
+        self.db.insert_site(url=self.url_etag)
+        site = self.db.get_site(url=self.url_etag)
+        for strategy in [self.naive_check_strategy, HfcInvarianceCheckStrategy(db=self.db)]:
+            self.checker.change_check_strategy = strategy
+            self.checker.check_site(site=site)
+            self.assertEqual('"void-v1"', site.etag)
+            self.assertFalse(self.checker.check_site(site=site))
+        qr = self.db.session.query(SiteChange).filter(SiteChange.site_id == site.id).all()
+        self.assertEqual(1, len(qr))
+
+    def test_streaming_fingerprint(self):
+        site = Site(url=self.url_fix)
+        response = fetch_site(site=site)
+        fingerprints = create_streaming_fingerprints(response=fetch_site(site=site, stream=True),
+                                                     legacy=True, chunk_size=1)
+        self.assertEqual((create_raw_fingerprint(data=response.content),
+                          create_fingerprint(text=response.text)), fingerprints)
+
+    def test_streaming_fingerprint_max_body_size(self):
+        site = Site(url=self.url_fix)
+        with self.assertRaises(RequestError):
+            create_streaming_fingerprints(response=fetch_site(site=site, stream=True), max_body_size=2)
+
+    def test_check_site_legacy_fingerprint(self):
+        self.db.insert_site(url=self.url_fix)
+        site = self.db.get_site(url=self.url_fix)
+        for strategy in [self.naive_check_strategy, HfcInvarianceCheckStrategy(db=self.db)]:
+            self.db.insert_site_change_entry(site=site, fingerprint=create_fingerprint(text="void"))
+            self.checker.change_check_strategy = strategy
+            self.assertFalse(self.checker.check_site(site=site))
+            self.assertEqual(create_raw_fingerprint(data=b"void"),
+                             self.db.get_latest_sitechange(site=site).fingerprint)
+            self.db.session.query(SiteChange).delete()
+
     def test_check_site_changing_empty(self):
         self.db.insert_site(url=self.url_changing)
         site = self.db.get_site(url=self.url_changing)
@@ -82,6 +127,34 @@ class ChangeCheckerTests(unittest.TestCase):
             logging.info(res)
         self.assertEqual(3, len(qr))
 
+    def test_check_all_sites_concurrent(self):
+        for i in range(4):
+            self.db.insert_site(url=f"{self.url_fix}?n={i}")
+            self.db.insert_site(url=f"{self.url_changing}?n={i}")
+        checker = ChangeChecker(db=self.db, change_check_strategy=self.naive_check_strategy,
+                                workers=4, workers_per_host=2)
+        checker.check_all_sites()
+        checker.check_all_sites()
+        qr = self.db.session.query(SiteChange).all()
+        self.assertEqual(12, len(qr))
+
+    def test_check_all_sites_hfc_samples(self):
+        self.db.insert_site(url=self.url_changing)
+        self.db.insert_site(url=self.url_fix)
+        strategy = HfcInvarianceCheckStrategy(db=self.db, sample_count=3, sample_delay=0.01, recheck_delay=0.01)
+        checker = ChangeChecker(db=self.db, change_check_strategy=strategy, workers=2)
+        checker.check_all_sites()
+        checker.check_all_sites()
+        qr = self.db.session.query(SiteChange).all()
+        self.assertEqual(2, len(qr))
+
+    def test_check_all_sites_broken_url(self):
+        self.db.insert_site(url='http://localhost:5001/doesnotexists')
+        self.db.insert_site(url=self.url_fix)
+        self.checker.check_all_sites()
+        qr = self.db.session.query(SiteChange).all()
+        self.assertEqual(1, len(qr))
+
     def test_send_email(self):
         recipient = "root@localhost"
         self.db.add_setting(key="email_to", value=recipient)
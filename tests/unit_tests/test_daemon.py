@@ -0,0 +1,91 @@
+import unittest
+import logging
+import datetime
+import threading
+
+import brang.database as database
+from brang.change_checker import ChangeChecker, ChangeCheckStrategy
+from brang.daemon import Daemon, Scheduler
+from brang import config
+
+logging.basicConfig(level=logging.INFO)
+
+
+class RecordingStrategy(ChangeCheckStrategy):
+    def __init__(self, db):
+        super().__init__(db=db)
+        self.checked = []
+
+    def change_check(self, site):
+        self.checked.append(site.url)
+        return False
+
+
+class SchedulerTests(unittest.TestCase):
+    def test_pop_due(self):
+        now = datetime.datetime(2020, 1, 1)
+        scheduler = Scheduler()
+        scheduler.schedule(1, now + datetime.timedelta(seconds=10))
+        scheduler.schedule(2, now - datetime.timedelta(seconds=10))
+        scheduler.schedule(3, now)
+        scheduler.schedule(1, now - datetime.timedelta(seconds=5))  # rescheduled
+        scheduler.schedule(4, now + datetime.timedelta(seconds=20))
+        scheduler.remove(4)
+        self.assertEqual(3, len(scheduler))
+        self.assertEqual([2, 1, 3], scheduler.pop_due(now))
+        self.assertIsNone(scheduler.next_due())
+        self.assertEqual(0, len(scheduler))
+
+
+class DaemonTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.strategy = RecordingStrategy(db=self.db)
+        self.checker = ChangeChecker(db=self.db, change_check_strategy=self.strategy, workers=1)
+        self.daemon = Daemon(db=self.db, checker=self.checker, reload_interval=3600, max_sleep=10)
+        self.db.insert_site(url='http://hot.example/')
+        self.db.insert_site(url='http://cold.example/')
+        self.db.set_site_check_interval(site=self.db.get_site(url='http://hot.example/'), check_interval=60)
+
+    def test_run_once(self):
+        sleep = self.daemon.run_once()
+        self.assertEqual(['http://hot.example/', 'http://cold.example/'], self.strategy.checked)
+        self.assertLessEqual(sleep, 10)
+
+        hot = self.db.get_site(url='http://hot.example/')
+        cold = self.db.get_site(url='http://cold.example/')
+        now = datetime.datetime.now()
+        self.assertAlmostEqual(60, (hot.next_check - now).total_seconds(), delta=5)
+        self.assertAlmostEqual(config.default_check_interval, (cold.next_check - now).total_seconds(), delta=5)
+
+        # Nothing is due
+        self.daemon.run_once()
+        self.assertEqual(2, len(self.strategy.checked))
+
+        # Only the hot site is due
+        self.daemon.run_due_checks(now=now + datetime.timedelta(seconds=120))
+        self.assertEqual(['http://hot.example/'], self.strategy.checked[2:])
+
+    def test_schedule_is_persisted(self):
+        next_check = datetime.datetime.now() + datetime.timedelta(hours=1)
+        for site in self.db.get_all_sites():
+            self.db.update_site_schedule(site=site, next_check=next_check, check_interval=None)
+        self.daemon.run_once()
+        self.assertEqual([], self.strategy.checked)
+
+    def test_stop(self):
+        thread = threading.Thread(target=self.daemon.run, kwargs={'handle_signals': False})
+        thread.start()
+        self.daemon.stop()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+
+    def test_stopped_checks_stay_due(self):
+        self.daemon.stop_event.set()
+        self.daemon.run_once()
+        self.assertEqual([], self.strategy.checked)
+        self.assertEqual(2, len(self.daemon.scheduler.pop_due(datetime.datetime.now())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,16 @@
 import unittest
 import logging
 import datetime
+import os
+import sqlite3
+import tempfile
 
 import sqlalchemy
 
 import brang.database as database
-from brang.database import Site, SiteChange
+from brang.database import Site, SiteChange, HfcPattern
 from brang.exceptions import SiteChangeNotFoundException, SettingNotFoundException
+from brang.schema import SCHEMA_VERSION
 
 logging.basicConfig(level=logging.INFO)
 
@@ -98,6 +102,18 @@ class DatabaseTests(unittest.TestCase):
         logging.info(site_change)
         self.assertEqual("xyz", site_change.fingerprint)
 
+    def test_get_latest_sitechanges(self):
+        site_changing = self.db.get_site(self.url_changing)
+        site_fix = self.db.get_site(self.url_fix)
+        latest_site_changes = self.db.get_latest_sitechanges()
+        self.assertEqual({site_changing.id}, set(latest_site_changes))
+        self.assertEqual("xyz", latest_site_changes[site_changing.id].fingerprint)
+        self.assertEqual({}, self.db.get_latest_sitechanges(sites=[site_fix]))
+
+    def test_site_change_index(self):
+        indexes = sqlalchemy.inspect(self.db.engine).get_indexes('site_change')
+        self.assertIn(['site_id', 'check_timestamp'], [index['column_names'] for index in indexes])
+
     def test_get_latest_sitechange_none(self):
         """
         Test if exception is raised if no sitechange entry could be found.
@@ -122,6 +138,73 @@ class DatabaseTests(unittest.TestCase):
         logging.info(qr)
         self.assertEqual(site.id, qr.site_id)
 
+    def test_insert_sitechange_entry_pattern(self):
+        site = self.db.get_site(url=self.url_fix)
+        for i in range(3):
+            self.db.insert_site_change_entry(site=site,
+                                             fingerprint=str(i),
+                                             pattern="1,3-5",
+                                             timestamp=datetime.datetime(2000, 1, 1, i))
+        self.assertEqual(1, self.db.session.query(HfcPattern).count())
+        self.db._patterns.clear()
+        site_change = self.db.get_latest_sitechange(site=site)
+        self.assertEqual("1,3-5", self.db.get_pattern(site_change=site_change))
+
+    def test_get_pattern_legacy(self):
+        site_change = SiteChange(site_id=1, fingerprint="x", pattern="1,2,3")
+        self.assertEqual("1,2,3", self.db.get_pattern(site_change=site_change))
+        self.assertEqual("", self.db.get_pattern(site_change=SiteChange(site_id=1, fingerprint="x")))
+
+    def test_insert_sitechange_entry_default_timestamp(self):
+        site = self.db.get_site(url=self.url_fix)
+        before = datetime.datetime.now()
+        self.db.insert_site_change_entry(site=site, fingerprint="123")
+        self.assertLessEqual(before, self.db.get_latest_sitechange(site=site).check_timestamp)
+
+    def test_batch(self):
+        db_filename = os.path.join(tempfile.mkdtemp(), 'brang.db')
+        db = database.SQLiteDatabase(db_filename=db_filename)
+        db.insert_site(url=self.url_fix)
+        site = db.get_site(url=self.url_fix)
+
+        def count_committed():
+            connection = sqlite3.connect(db_filename)
+            count = connection.execute("SELECT COUNT(*) FROM site_change").fetchone()[0]
+            connection.close()
+            return count
+
+        with db.batch(flush_size=2):
+            for i in range(3):
+                db.insert_site_change_entry(site=site, fingerprint=str(i))
+            self.assertEqual(3, db.session.query(SiteChange).count())
+            self.assertEqual(2, count_committed())
+        self.assertEqual(3, count_committed())
+        journal_mode = db.session.execute(sqlalchemy.text("PRAGMA journal_mode")).scalar()
+        self.assertEqual('wal', journal_mode)
+        db.destroy_sqlite_db_file()
+
+    def test_batch_failed_write(self):
+        db_filename = os.path.join(tempfile.mkdtemp(), 'brang.db')
+        db = database.SQLiteDatabase(db_filename=db_filename)
+        db.insert_site(url=self.url_fix)
+        site = db.get_site(url=self.url_fix)
+
+        with db.batch(flush_size=10):
+            db.insert_site_change_entry(site=site, fingerprint='lost', pattern='1,2')
+            with self.assertRaises(sqlalchemy.exc.IntegrityError):
+                db.insert_site(url=self.url_fix)  # duplicate
+            # The batch goes on after the failed write
+            db.insert_site_change_entry(site=site, fingerprint='kept', pattern='1,2')
+            db.insert_site(url=self.url_changing)
+
+        connection = sqlite3.connect(db_filename)
+        fingerprints = [row[0] for row in connection.execute("SELECT fingerprint FROM site_change")]
+        connection.close()
+        self.assertEqual(['kept'], fingerprints)
+        self.assertEqual('1,2', db.get_pattern(site_change=db.get_latest_sitechange(site=site)))
+        self.assertEqual(2, len(db.get_all_sites()))
+        db.destroy_sqlite_db_file()
+
     def test_setting_insert(self):
         test_value = "bar"
         self.db.add_setting("foo", test_value)
@@ -138,6 +221,65 @@ class DatabaseTests(unittest.TestCase):
         with self.assertRaises(SettingNotFoundException):
             self.db.get_setting("foo")
 
+    def test_update_site_validators(self):
+        site = self.db.get_site(self.url_fix)
+        self.db.update_site_validators(site=site, etag='"abc"', last_modified=None)
+        self.db.session.expire_all()
+        site = self.db.get_site(self.url_fix)
+        self.assertEqual('"abc"', site.etag)
+        self.assertIsNone(site.last_modified)
+
+    def test_set_site_region_selector(self):
+        site = self.db.get_site(self.url_fix)
+        self.db.update_site_validators(site=site, etag='"abc"', last_modified='Sat, 15 Oct 1988 00:00:00 GMT')
+        self.db.set_site_region_selector(site=site, region_selector='#news')
+        self.db.session.expire_all()
+        site = self.db.get_site(self.url_fix)
+        self.assertEqual('#news', site.region_selector)
+        self.assertIsNone(site.etag)
+        self.assertIsNone(site.last_modified)
+
+        self.db.update_site_validators(site=site, etag='"abc"', last_modified=None)
+        self.db.set_site_region_selector(site=site, region_selector='#news')
+        self.assertEqual('"abc"', site.etag)
+        self.db.set_site_region_selector(site=site, region_selector=None)
+        self.assertIsNone(site.etag)
+
+    def test_migrate_tables(self):
+        db_filename = os.path.join(tempfile.mkdtemp(), 'brang.db')
+        connection = sqlite3.connect(db_filename)
+        connection.execute("CREATE TABLE site (id INTEGER NOT NULL, url VARCHAR, PRIMARY KEY (id), UNIQUE (url))")
+        connection.execute("INSERT INTO site (url) VALUES ('http://brang.io')")
+        connection.commit()
+        connection.close()
+
+        db = database.SQLiteDatabase(db_filename=db_filename)
+        site = db.get_site(url='http://brang.io')
+        self.assertIsNone(site.etag)
+        db.destroy_sqlite_db_file()
+
+    def test_schema_version(self):
+        db_filename = os.path.join(tempfile.mkdtemp(), 'brang.db')
+        db = database.SQLiteDatabase(db_filename=db_filename)
+        self.assertEqual(SCHEMA_VERSION, db.get_schema_version())
+        db.insert_site(url='http://brang.io')
+
+        migrations = []
+
+        class CountingDatabase(database.SQLiteDatabase):
+            def migrate_tables(self):
+                migrations.append(self.db_filename)
+                super().migrate_tables()
+
+        db = CountingDatabase(db_filename=db_filename)
+        self.assertEqual([], migrations)  # an up-to-date database needs no schema work
+        self.assertEqual('http://brang.io', db.get_all_sites()[0].url)
+        db.set_schema_version(SCHEMA_VERSION - 1)
+        db = CountingDatabase(db_filename=db_filename)
+        self.assertEqual([db_filename], migrations)
+        self.assertEqual(SCHEMA_VERSION, db.get_schema_version())
+        db.destroy_sqlite_db_file()
+
     def tearDown(self) -> None:
         logging.info("tear down")
         self.db.destroy_sqlite_db_file()
@@ -0,0 +1,51 @@
+import unittest
+import logging
+import threading
+import time
+
+from brang.database import Site
+from brang.engine import CheckEngine, run_check_steps, host_of
+
+logging.basicConfig(level=logging.INFO)
+
+
+class CheckEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.sites = [Site(id=i, url=f"http://host{i % 2}.example/{i}") for i in range(6)]
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+
+    def check_steps(self, site):
+        host = host_of(site.url)
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.max_running[host] = max(self.max_running.get(host, 0), self.running[host])
+        time.sleep(0.05)
+        with self.lock:
+            self.running[host] -= 1
+        yield 0.3
+        if site.id == 5:
+            raise ValueError("broken")
+        return site.id % 3 == 0
+
+    def test_run(self):
+        engine = CheckEngine(check_steps=self.check_steps, workers=4, workers_per_host=1)
+        results = engine.run(self.sites)
+        self.assertEqual([True, False, False, True, False, None], [r[1] for r in results])
+        self.assertIsInstance(results[5][2], ValueError)
+        self.assertEqual({'host0.example': 1, 'host1.example': 1}, self.max_running)
+
+    def test_waits_overlap(self):
+        engine = CheckEngine(check_steps=self.check_steps, workers=1)
+        start = time.monotonic()
+        results = engine.run(self.sites)
+        self.assertLess(time.monotonic() - start, 6 * 0.3)
+        self.assertEqual(self.sites, [r[0] for r in results])
+
+    def test_run_check_steps(self):
+        self.assertTrue(run_check_steps(self.check_steps(self.sites[0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import logging
+
+import brang.database as database
+from brang.change_checker import ChangeChecker, ChangeCheckStrategy, HfcInvarianceCheckStrategy
+from brang.excerpts import create_excerpts, segment_text
+from brang.segments import Segments, changed_segments
+from brang.snapshots import SnapshotStore
+
+logging.basicConfig(level=logging.INFO)
+
+
+def page(clock, news, footer='<p>Contact</p>'):
+    return (f'<html><body><div class="clock">{clock}</div>\n'
+            + ''.join(f'<li>{item}</li>\n' for item in news)
+            + f'{footer}</body></html>').encode()
+
+
+class ExcerptTests(unittest.TestCase):
+    def setUp(self):
+        self.old = page('10:00', ['Brang 1.0 released', 'Welcome'])
+        self.pattern = HfcInvarianceCheckStrategy.create_pattern(self.old, page('10:01', ['Brang 1.0 released',
+                                                                                        'Welcome']))
+
+    def test_changed_segments(self):
+        old = Segments(b'<a>1<b>2<c>3<b>2')
+        new = Segments(b'<b>2<a>1<d>4<b>2')
+        self.assertEqual(([3], [3]), changed_segments(old, [], new, []))
+        self.assertEqual(([], []), changed_segments(old, [3], new, [3]))
+
+    def test_segment_text(self):
+        self.assertEqual('Tom & Jerry', segment_text(b'<li class="x">Tom &amp;  Jerry'))
+        self.assertEqual('<img src="a.png">', segment_text(b'<img src="a.png">'))
+        self.assertEqual('', segment_text(b'</li>'))
+
+    def test_create_excerpts(self):
+        new = page('11:30', ['Brang 1.1 released', 'Brang 1.0 released', 'Welcome'], footer='<p>Imprint</p>')
+        self.assertEqual(['+ Brang 1.1 released', '+ Imprint', '- Contact'],
+                         create_excerpts(self.old, self.pattern, new, self.pattern))
+        self.assertEqual(['+ Brang...', '(2 more changes)'],
+                         create_excerpts(self.old, self.pattern, new, self.pattern, max_excerpts=1, max_length=8))
+        self.assertEqual([], create_excerpts(self.old, self.pattern, page('12:00', ['Brang 1.0 released',
+                                                                                    'Welcome']), self.pattern))
+
+
+class ChangeDetailsTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.store = SnapshotStore(db=self.db)
+        self.db.insert_site(url='http://localhost:5000/news/')
+        self.site = self.db.get_site(url='http://localhost:5000/news/')
+        self.old = page('10:00', ['Welcome'])
+        self.pattern = HfcInvarianceCheckStrategy.create_pattern(self.old, page('10:01', ['Welcome']))
+        self.db.insert_site_change_entry(site=self.site, fingerprint='', pattern=self.pattern,
+                                         snapshot_id=self.store.store(self.old))
+
+    def test_describe_change(self):
+        strategy = HfcInvarianceCheckStrategy(db=self.db, snapshot_store=self.store)
+        latest = self.db.get_latest_sitechange(site=self.site)
+        strategy.describe_change(site=self.site, latest_site_change=latest, latest_pattern=self.pattern,
+                                 current_text=page('10:05', ['News', 'Welcome']), current_pattern=self.pattern)
+        self.assertEqual(['+ News'], strategy.pop_change_details(site=self.site))
+        self.assertIsNone(strategy.pop_change_details(site=self.site))
+
+    def test_notification(self):
+        class DescribingStrategy(ChangeCheckStrategy):
+            def change_check(self, site):
+                self.change_details[site.id] = ['+ News']
+                return True
+
+        checker = ChangeChecker(db=self.db, change_check_strategy=DescribingStrategy(db=self.db), workers=1)
+        messages = []
+        checker.send_email = lambda msg_body: messages.append(msg_body)
+        checker.check_all_sites()
+        self.assertEqual(["* http://localhost:5000/news/\n    + News"], messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import logging
+import socket
+import time
+
+import tests.test_server as test_server
+from brang.change_checker import NaiveCheckStrategy, fetch_site
+from brang.database import SQLiteDatabase, Site
+from brang.exceptions import ThrottledError
+from brang.fetcher import Fetcher, DnsCache, RateLimiter, parse_retry_after
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class DnsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.original_getaddrinfo = socket.getaddrinfo
+
+        def counting_getaddrinfo(*args, **kwargs):
+            if args[0] == 'localhost':  # lookups of addresses need no DNS
+                self.calls.append(args)
+            return self.original_getaddrinfo(*args, **kwargs)
+        socket.getaddrinfo = counting_getaddrinfo
+
+    def test_cache_while_enabled(self):
+        cache = DnsCache()
+        cache.enable()
+        cache.enable()
+        cache.getaddrinfo('localhost', 5000)
+        cache.getaddrinfo('localhost', 5000)
+        self.assertEqual(1, len(self.calls))
+        cache.disable()
+        cache.getaddrinfo('localhost', 5000)
+        self.assertEqual(1, len(self.calls))
+        cache.disable()
+        self.assertFalse(cache.enabled)
+        cache.getaddrinfo('localhost', 5000)
+        self.assertEqual(2, len(self.calls))
+
+    def test_fetcher_connections_only(self):
+        test_server.start_server()
+        try:
+            fetcher = Fetcher(timeout=5)
+            with fetcher:
+                # Every request opens a new connection
+                for _ in range(3):
+                    self.assertEqual(200, fetcher.get('http://localhost:5000/fix/',
+                                                      headers={'Connection': 'close'}).status_code)
+                self.assertEqual(1, len(self.calls))
+                # Name resolution of the rest of the process is not cached
+                socket.getaddrinfo('localhost', 25)
+                socket.getaddrinfo('localhost', 25)
+                self.assertEqual(3, len(self.calls))
+                with Fetcher(timeout=5) as other_fetcher:
+                    other_fetcher.get('http://localhost:5000/fix/')
+                self.assertEqual(4, len(self.calls))
+                self.assertTrue(fetcher.dns_cache.enabled)
+            fetcher.get('http://localhost:5000/fix/', headers={'Connection': 'close'})
+            self.assertEqual(5, len(self.calls))
+            fetcher.close()
+        finally:
+            test_server.stop_server()
+
+    def tearDown(self) -> None:
+        socket.getaddrinfo = self.original_getaddrinfo
+
+
+class FetcherTests(unittest.TestCase):
+    def setUp(self):
+        test_server.start_server()
+        self.url_fix = 'http://localhost:5000/fix/'
+
+    def test_get(self):
+        fetcher = Fetcher(pool_connections=2, pool_maxsize=2, timeout=5)
+        with fetcher:
+            r1 = fetcher.get(self.url_fix)
+            r2 = fetcher.get(self.url_fix)
+        fetcher.close()
+        self.assertEqual(200, r1.status_code)
+        self.assertEqual(r1.text, r2.text)
+        self.assertFalse(fetcher.dns_cache.enabled)
+
+    def test_cached_addresses_in_turn(self):
+        fetcher = Fetcher(timeout=5)
+        with fetcher:
+            # Nothing listens on the first address
+            addresses = socket.getaddrinfo('127.0.0.2', 5000, 0, socket.SOCK_STREAM)
+            addresses += socket.getaddrinfo('127.0.0.1', 5000, 0, socket.SOCK_STREAM)
+            fetcher.dns_cache._cache[('localhost', 5000)] = addresses
+            self.assertEqual(200, fetcher.get(self.url_fix).status_code)
+        fetcher.close()
+
+    def tearDown(self) -> None:
+        test_server.stop_server()
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=10.0, burst=2, hosts={'example.com': (1.0, 1), 'free.example': (None, None)})
+        self.assertEqual(0.0, limiter.reserve('a.example'))
+        self.assertEqual(0.0, limiter.reserve('a.example'))
+        self.assertAlmostEqual(0.1, limiter.reserve('a.example'), delta=0.01)
+        self.assertAlmostEqual(0.2, limiter.reserve('a.example'), delta=0.01)
+        self.assertIsNone(limiter.reserve('a.example', max_wait=0.1))
+        # Domains cover their subdomains, which share the bucket
+        self.assertEqual(0.0, limiter.reserve('www.example.com'))
+        self.assertAlmostEqual(1.0, limiter.reserve('EXAMPLE.com'), delta=0.01)
+        for _ in range(100):
+            self.assertEqual(0.0, limiter.reserve('free.example'))
+
+    def test_defer(self):
+        limiter = RateLimiter(rate=None, hosts={})
+        self.assertEqual(0.0, limiter.reserve('a.example'))
+        limiter.defer('a.example', 30)
+        self.assertAlmostEqual(30, limiter.reserve('a.example'), delta=0.1)
+        self.assertIsNone(limiter.reserve('a.example', max_wait=10))
+        self.assertEqual(0.0, limiter.reserve('b.example'))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(120, parse_retry_after('120'))
+        self.assertEqual(60, parse_retry_after('Wed, 21 Oct 2015 07:29:00 GMT', now=1445412480))
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_retry_after(self):
+        test_server.start_server()
+        try:
+            fetcher = Fetcher(rate_limiter=RateLimiter(rate=None, hosts={}))
+            strategy = NaiveCheckStrategy(db=SQLiteDatabase(db_filename=':memory:'), fetcher=fetcher)
+            site = Site(url='http://localhost:5000/throttled/')
+            start = time.monotonic()
+            self.assertEqual(200, strategy.request(site=site).status_code)
+            self.assertGreaterEqual(time.monotonic() - start, 0.9)
+            with self.assertRaises(ThrottledError):
+                fetch_site(site=site, fetcher=fetcher)
+        finally:
+            test_server.stop_server()
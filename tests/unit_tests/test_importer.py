@@ -0,0 +1,97 @@
+import unittest
+import logging
+
+import tests.test_server as test_server
+import brang.config as config
+import brang.database as database
+from brang.exceptions import ThrottledError
+from brang.fetcher import Fetcher, RateLimiter
+from brang.importer import import_sites, normalize_url, read_urls, validate_url
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ImporterTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.db.insert_site(url='http://localhost:5000/fix/')
+
+    def test_normalize_url(self):
+        self.assertEqual('http://example.com/', normalize_url(' Example.COM '))
+        self.assertEqual('https://example.com/a?b=1', normalize_url('HTTPS://example.com:443/a?b=1#top'))
+        self.assertEqual('http://example.com:8080/A', normalize_url('http://example.com:8080/A'))
+        self.assertEqual('http://user:pw@example.com/', normalize_url('http://user:pw@Example.com:80'))
+        for url in ['', 'ftp://example.com', 'mailto:root@localhost', 'http://', 'http://example.com/a b',
+                    'http://example.com:99999/']:
+            with self.assertRaises(ValueError):
+                normalize_url(url)
+
+    def test_read_urls(self):
+        self.assertEqual(['http://a', 'b'], read_urls(['http://a\n', '\n', '# comment\n', '  b  \n']))
+
+    def test_import_sites(self):
+        urls = ['http://localhost:5000/fix/',  # exists already
+                'http://LOCALHOST:5000/changing/',
+                'http://localhost:5000/changing/#top',  # duplicate
+                'http://localhost:5000/doesnotexist/',
+                'mailto:root@localhost',
+                'http://localhost:5000/etag/']
+        test_server.start_server()
+        try:
+            report = import_sites(db=self.db, urls=urls, workers=4, timeout=5)
+        finally:
+            test_server.stop_server()
+        logging.info(report.format())
+        self.assertEqual(['http://localhost:5000/changing/', 'http://localhost:5000/etag/'], report.accepted)
+        rejected = dict(report.rejected)
+        self.assertEqual(4, len(rejected))
+        self.assertIn('exists', rejected['http://localhost:5000/fix/'])
+        self.assertIn('Duplicate', rejected['http://localhost:5000/changing/#top'])
+        self.assertIn('404', rejected['http://localhost:5000/doesnotexist/'])
+        self.assertIn('Invalid', rejected['mailto:root@localhost'])
+        self.assertEqual(['http://localhost:5000/fix/', 'http://localhost:5000/changing/',
+                          'http://localhost:5000/etag/'], [site.url for site in self.db.get_all_sites()])
+
+    def test_import_sites_without_validation(self):
+        report = import_sites(db=self.db, urls=['localhost:5001/a', 'localhost:5001/b'], validate=False)
+        self.assertEqual(['http://localhost:5001/a', 'http://localhost:5001/b'], report.accepted)
+        self.assertEqual(3, len(self.db.get_all_sites()))
+        self.assertIn('Accepted 2 and rejected 0 URLs.', report.format())
+
+    def test_validate_url(self):
+        self.assertIn('Request failed', validate_url('http://localhost:5001/doesnotexist'))
+        fetcher = Fetcher(rate_limiter=RateLimiter(rate=1, burst=1))
+        fetcher.rate_limiter.defer('localhost', 60)
+        with self.assertRaises(ThrottledError):
+            validate_url('http://localhost:5001/', fetcher=fetcher, max_wait=1)
+
+    def test_import_sites_of_one_host(self):
+        urls = [f'http://localhost:5000/fix/?page={i}' for i in range(20)]
+        rate_limit_max_wait = config.rate_limit_max_wait
+        config.rate_limit_max_wait = 0  # the rate limit of the checks does not apply
+        test_server.start_server()
+        try:
+            fetcher = Fetcher(rate_limiter=RateLimiter(rate=40, burst=1))
+            report = import_sites(db=self.db, urls=urls[:10], workers=4, fetcher=fetcher)
+            self.assertEqual(urls[:10], report.accepted)
+            self.assertEqual([], report.rejected + report.unvalidated)
+
+            # A host that stays throttled longer than max_wait is not validated
+            fetcher.rate_limiter.defer('localhost', 60)
+            report = import_sites(db=self.db, urls=urls[10:], workers=4, fetcher=fetcher, max_wait=1)
+        finally:
+            config.rate_limit_max_wait = rate_limit_max_wait
+            test_server.stop_server()
+        logging.info(report.format())
+        self.assertEqual(urls[10:], report.accepted)
+        self.assertEqual(urls[10:], report.unvalidated)
+        self.assertEqual([], report.rejected)
+        self.assertIn('Accepted 10 (10 not validated) and rejected 0 URLs.', report.format())
+        self.assertEqual(21, len(self.db.get_all_sites()))
+
+    def tearDown(self):
+        self.db.destroy_sqlite_db_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
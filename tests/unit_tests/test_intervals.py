@@ -0,0 +1,86 @@
+import unittest
+import logging
+import datetime
+
+import brang.database as database
+from brang.change_checker import ChangeChecker, ChangeCheckStrategy
+from brang.database import Site
+from brang.intervals import AdaptiveIntervalPolicy, FixedIntervalPolicy, get_interval_policy, ADAPTIVE
+from brang import config
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ChangingStrategy(ChangeCheckStrategy):
+    def __init__(self, db, changed):
+        super().__init__(db=db)
+        self.changed = changed
+        self.checked = []
+
+    def change_check(self, site):
+        self.checked.append(site.url)
+        self.db.insert_site_change_entry(site=site, fingerprint=str(len(self.checked)))
+        return self.changed
+
+
+class IntervalPolicyTests(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2020, 1, 31)
+        self.policy = AdaptiveIntervalPolicy(min_interval=60, max_interval=30 * 86400,
+                                             backoff=2.0, checks_per_change=4)
+
+    def test_get_interval_policy(self):
+        self.assertIsInstance(get_interval_policy(Site(url='a')), FixedIntervalPolicy)
+        self.assertIsInstance(get_interval_policy(Site(url='a', interval_policy='adaptive')), AdaptiveIntervalPolicy)
+        self.assertIsInstance(get_interval_policy(Site(url='a', interval_policy='unknown')), FixedIntervalPolicy)
+        self.assertEqual(90, FixedIntervalPolicy().next_interval(Site(check_interval=90), True, [], self.now))
+
+    def test_backoff(self):
+        site = Site(url='a', check_interval=3600)
+        self.assertEqual(7200, self.policy.next_interval(site, False, [self.now], self.now))
+        self.assertEqual(1800, self.policy.next_interval(site, True, [self.now], self.now))
+        self.assertEqual(3600, self.policy.next_interval(site, None, [self.now], self.now))
+        site.check_interval = 20 * 86400
+        self.assertEqual(30 * 86400, self.policy.next_interval(site, False, [], self.now))
+        site.check_interval = 100
+        self.assertEqual(60, self.policy.next_interval(site, True, [], self.now))
+
+    def test_estimate(self):
+        # Daily changes over 30 days: the interval is kept near 6 hours
+        history = [self.now - datetime.timedelta(days=d) for d in range(31)]
+        self.assertAlmostEqual(6 * 3600, self.policy.estimate(history, self.now))
+        site = Site(url='a', check_interval=60)
+        self.assertEqual(3 * 3600, self.policy.next_interval(site, False, history, self.now))
+        site.check_interval = 30 * 86400
+        self.assertEqual(12 * 3600, self.policy.next_interval(site, True, history, self.now))
+        self.assertIsNone(self.policy.estimate(history[:1], self.now))
+
+
+class AdaptiveCheckTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.db.insert_site(url='http://adaptive.example/')
+        self.db.insert_site(url='http://fixed.example/')
+        site = self.db.get_site(url='http://adaptive.example/')
+        self.db.set_site_interval_policy(site=site, interval_policy=ADAPTIVE)
+
+    def test_check_all_sites(self):
+        strategy = ChangingStrategy(db=self.db, changed=False)
+        checker = ChangeChecker(db=self.db, change_check_strategy=strategy, workers=1)
+        checker.check_all_sites()
+        adaptive = self.db.get_site(url='http://adaptive.example/')
+        fixed = self.db.get_site(url='http://fixed.example/')
+        self.assertEqual(int(config.default_check_interval * config.adaptive_backoff), adaptive.check_interval)
+        self.assertIsNone(fixed.check_interval)
+        self.assertIsNotNone(adaptive.next_check)
+        self.assertIsNone(fixed.next_check)  # only the daemon schedules sites that are checked in every run
+
+        # The adaptive site is not due yet, the fixed one is checked in every run
+        checker.check_all_sites()
+        self.assertEqual(['http://fixed.example/'], sorted(set(strategy.checked[2:])))
+        checker.check_all_sites(force=True)
+        self.assertEqual(5, len(strategy.checked))
+
+
+if __name__ == '__main__':
+    unittest.main()
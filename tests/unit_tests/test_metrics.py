@@ -0,0 +1,96 @@
+import unittest
+import logging
+import json
+import os
+import shutil
+import tempfile
+
+import tests.test_server as test_server
+import brang.database as database
+from brang.change_checker import ChangeChecker, HfcInvarianceCheckStrategy
+from brang.database import Site
+from brang.intervals import ADAPTIVE
+from brang.metrics import Metrics, NullMetrics, get_metrics, set_metrics
+from brang import config
+
+logging.basicConfig(level=logging.INFO)
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def test_record(self):
+        metrics = Metrics()
+        site = Site(id=1, url='http://localhost/')
+        metrics.record('download', 0.5)
+        with metrics.site_scope(site):
+            metrics.record('download', 0.25)
+            metrics.count('bytes_fetched', 100)
+            with metrics.timer('hash'):
+                pass
+        metrics.finish()
+        summary = metrics.summary()
+        self.assertEqual({'count': 2, 'seconds': 0.75, 'max_seconds': 0.5}, summary['stages']['download'])
+        self.assertEqual(1, summary['stages']['hash']['count'])
+        self.assertEqual({'bytes_fetched': 100}, summary['counters'])
+        self.assertEqual(0.25, summary['sites']['1']['stages']['download'])
+        self.assertEqual('http://localhost/', summary['sites']['1']['url'])
+
+    def test_null_metrics(self):
+        self.assertIsInstance(get_metrics(), NullMetrics)
+        with get_metrics().timer('hash'):
+            get_metrics().count('bytes_fetched')
+        self.assertFalse(get_metrics().enabled)
+
+    def test_export(self):
+        metrics = Metrics()
+        metrics.record('dns', 0.125)
+        metrics.count('hfc_refetches', 2)
+        metrics.finish()
+        textfile = os.path.join(self.tmp_dir, 'metrics', 'brang.prom')
+        json_file = os.path.join(self.tmp_dir, 'last_run.json')
+        metrics.export(textfile=textfile, json_file=json_file)
+        with open(textfile) as f:
+            text = f.read()
+        self.assertIn('brang_run_stage_seconds{stage="dns"} 0.125000', text)
+        self.assertIn('brang_run_hfc_refetches 2', text)
+        with open(json_file) as f:
+            self.assertEqual(2, json.load(f)['counters']['hfc_refetches'])
+        self.assertEqual(['last_run.json', 'metrics'], sorted(os.listdir(self.tmp_dir)))
+
+    def test_check_run(self):
+        test_server.start_server()
+        db = database.SQLiteDatabase(db_filename=':memory:')
+        db.insert_site(url='http://localhost:5000/fix')
+        # The schedule of an adaptive site is learned from its history (db_read)
+        db.set_site_interval_policy(site=db.get_site(url='http://localhost:5000/fix'), interval_policy=ADAPTIVE)
+        checker = ChangeChecker(db=db, change_check_strategy=HfcInvarianceCheckStrategy(db=db, sample_delay=0))
+        metrics_enabled, textfile, json_file = config.metrics_enabled, config.metrics_textfile, config.metrics_json
+        config.metrics_enabled = True
+        config.metrics_textfile = None
+        config.metrics_json = os.path.join(self.tmp_dir, 'last_run.json')
+        try:
+            checker.check_all_sites()
+        finally:
+            config.metrics_enabled, config.metrics_textfile, config.metrics_json = metrics_enabled, textfile, json_file
+            test_server.stop_server()
+        self.assertIsInstance(get_metrics(), NullMetrics)
+        with open(os.path.join(self.tmp_dir, 'last_run.json')) as f:
+            summary = json.load(f)
+        logging.info(summary)
+        self.assertEqual(1, summary['counters']['sites_checked'])
+        self.assertGreater(summary['counters']['bytes_fetched'], 0)
+        self.assertEqual(HfcInvarianceCheckStrategy(db=db).sample_count - 1, summary['counters']['hfc_refetches'])
+        for stage in ('connect', 'download', 'transform', 'hash', 'db_read', 'db_write'):
+            self.assertIn(stage, summary['stages'])
+        site_id = str(db.get_all_sites()[0].id)
+        self.assertIn('transform', summary['sites'][site_id]['stages'])
+
+    def tearDown(self):
+        set_metrics(None)
+        shutil.rmtree(self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import logging
+import datetime
+
+import mailtest
+
+import brang.database as database
+from brang.database import Notification
+from brang.notifier import Notifier, NotificationWorker, parse_recipients
+from brang import config
+
+logging.basicConfig(level=logging.INFO)
+
+
+class NotifierTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.db.add_setting(key="email_to", value="root@localhost, admin@localhost")
+        self.notifier = Notifier(db=self.db, smtp_server='localhost', smtp_port=1025)
+        self.retry_delay = config.notification_retry_delay
+
+    def outbox(self):
+        return self.db.session.query(Notification).populate_existing().all()
+
+    def test_parse_recipients(self):
+        self.assertEqual(['a@b.c', 'd@e.f', 'g@h.i'], parse_recipients(' a@b.c,d@e.f; g@h.i '))
+        self.assertEqual([], parse_recipients(None))
+
+    def test_digest(self):
+        self.notifier.notify(body="first")
+        self.notifier.notify(body="second")
+        with mailtest.Server(smtp_port=1025) as s:
+            self.assertEqual(2, self.notifier.deliver())
+            smtp = self.notifier._smtp
+            self.notifier.notify(body="third")
+            self.assertEqual(1, self.notifier.deliver())
+            self.assertIs(smtp, self.notifier._smtp)  # the connection is reused
+            self.notifier.close()
+        self.assertEqual(2, len(s.emails))
+        self.assertEqual(['root@localhost', 'admin@localhost'], s.emails[0].to)
+        self.assertIn('first', s.emails[0].msg)
+        self.assertIn('second', s.emails[0].msg)
+        self.assertEqual('third', s.emails[1].msg)
+        self.assertEqual([], self.outbox())
+
+    def test_digest_interval(self):
+        notifier = Notifier(db=self.db, smtp_server='localhost', smtp_port=1025, digest_interval=3600)
+        notifier.notify(body="first")
+        with mailtest.Server(smtp_port=1025) as s:
+            self.assertEqual(1, notifier.deliver())
+            notifier.notify(body="second")
+            self.assertEqual(0, notifier.deliver())
+            notifier.close()
+        self.assertEqual(1, len(s.emails))
+        held = self.outbox()
+        self.assertEqual(1, len(held))
+        self.assertGreater(held[0].next_attempt, datetime.datetime.now() + datetime.timedelta(minutes=59))
+
+    def test_retry(self):
+        config.notification_retry_delay = 0
+        self.notifier.notify(body="lost?")
+        self.notifier.smtp_port = 1026  # nothing listens there
+        self.assertEqual(0, self.notifier.deliver())
+        self.assertEqual(0, self.notifier.deliver())
+        notification = self.outbox()[0]
+        self.assertEqual(2, notification.attempts)
+        self.assertIsNotNone(notification.last_error)
+
+        self.notifier.smtp_port = 1025
+        with mailtest.Server(smtp_port=1025) as s:
+            self.assertEqual(1, self.notifier.deliver())
+            self.notifier.close()
+        self.assertEqual(['lost?'], [email.msg for email in s.emails])
+
+    def test_worker(self):
+        worker = NotificationWorker(notifier=self.notifier, max_sleep=0.1)
+        with mailtest.Server(smtp_port=1025) as s:
+            worker.start()
+            self.notifier.notify(body="background")
+            worker.wake()
+            for _ in range(50):
+                if s.emails:
+                    break
+                worker._stop_event.wait(0.1)
+            worker.stop(timeout=5)
+        self.assertFalse(worker.is_running)
+        self.assertEqual(['background'], [email.msg for email in s.emails])
+
+    def tearDown(self):
+        config.notification_retry_delay = self.retry_delay
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import logging
+import datetime
+import os
+import sqlite3
+import tempfile
+
+import brang.database as database
+from brang.readonly import ReadOnlyDatabase
+from brang.snapshots import SnapshotStore, decompress
+from brang.exceptions import SiteNotFoundException, SiteChangeNotFoundException, SchemaOutdatedException
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ReadOnlyDatabaseTests(unittest.TestCase):
+    def setUp(self):
+        self.db_filename = os.path.join(tempfile.mkdtemp(), 'brang.db')
+        self.db = database.SQLiteDatabase(db_filename=self.db_filename)
+        self.db.insert_site(url='http://localhost:5000/fix')
+        self.db.insert_site(url='http://localhost:5000/changing')
+        self.db.set_site_check_interval(site=self.db.get_site(url='http://localhost:5000/changing'),
+                                        check_interval=60)
+
+    def test_get_all_sites(self):
+        with ReadOnlyDatabase(db_filename=self.db_filename) as readonly_db:
+            sites = readonly_db.get_all_sites()
+        self.assertEqual(['http://localhost:5000/fix', 'http://localhost:5000/changing'], [s.url for s in sites])
+        self.assertEqual([None, 60], [s.check_interval for s in sites])
+        self.assertEqual([s.id for s in self.db.get_all_sites()], [s.id for s in sites])
+
+    def test_get_latest_snapshot(self):
+        site = self.db.get_site(url='http://localhost:5000/fix')
+        with ReadOnlyDatabase(db_filename=self.db_filename) as readonly_db:
+            with self.assertRaises(SiteNotFoundException):
+                readonly_db.get_latest_snapshot(url='http://localhost:5000/unknown')
+            with self.assertRaises(SiteChangeNotFoundException):
+                readonly_db.get_latest_snapshot(url=site.url)
+        self.db.insert_site_change_entry(site=site, fingerprint='a', pattern='',
+                                         timestamp=datetime.datetime(2020, 1, 1))
+        snapshot_id = SnapshotStore(db=self.db).store(b'<html>fix</html>')
+        self.db.insert_site_change_entry(site=site, fingerprint='b', pattern='',
+                                         timestamp=datetime.datetime(2020, 1, 2), snapshot_id=snapshot_id)
+        with ReadOnlyDatabase(db_filename=self.db_filename) as readonly_db:
+            snapshot = readonly_db.get_latest_snapshot(url=site.url)
+        self.assertEqual(b'<html>fix</html>', decompress(compression=snapshot.compression, data=snapshot.data))
+
+    def test_outdated_schema(self):
+        with self.assertRaises(SchemaOutdatedException):
+            ReadOnlyDatabase(db_filename=self.db_filename + '.missing')
+        self.db.set_schema_version(0)
+        with self.assertRaises(SchemaOutdatedException):
+            ReadOnlyDatabase(db_filename=self.db_filename)
+        self.assertFalse(os.path.exists(self.db_filename + '.missing'))
+
+    def test_read_only(self):
+        with ReadOnlyDatabase(db_filename=self.db_filename) as readonly_db:
+            with self.assertRaises(sqlite3.OperationalError):
+                readonly_db.connection.execute("DELETE FROM site")
+
+    def tearDown(self):
+        self.db.destroy_sqlite_db_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import logging
+import time
+
+import tests.test_server as test_server
+import brang.database as database
+from brang.change_checker import ChangeChecker, HfcInvarianceCheckStrategy, NaiveCheckStrategy, RegionCheckStrategy
+from brang.change_checker import extract_streaming_region
+from brang.database import SiteChange
+from brang.regions import CssPath, create_region_extractor, extract_region, parse_selector
+from brang.snapshots import SnapshotStore
+
+logging.basicConfig(level=logging.INFO)
+
+DOCUMENT = ("<html><head><title>Today</title></head><body>"
+            "<div class=\"nav main\"><a href=\"/\">Home</a></div>"
+            "<main><div id=\"news\" class=\"box\"><ul><li>First<li>Second <!-- volatile --><br></ul>"
+            "<p>More<div>inside</div></div>"
+            "<table><tr><td>1<td>2<tr><td>3</table>"
+            "<p data-role=\"footer\">Footer &amp; more</main></body></html>")
+
+
+class FakeResponse(object):
+    """
+    Streams a body in chunks and records how many chunks have been read.
+    """
+
+    def __init__(self, body: bytes, chunk_size: int = 16):
+        self.chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+        self.read = 0
+        self.closed = False
+        self.encoding = 'utf-8'
+        self.url = 'http://localhost/'
+        self.headers = {}
+
+    def iter_content(self, chunk_size=None):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class RegionTests(unittest.TestCase):
+    def test_parse_selector(self):
+        path = parse_selector('main div#news.box > ul')
+        self.assertIsInstance(path, CssPath)
+        self.assertEqual(['main', 'div', 'ul'], [step.tag for step in path.steps])
+        self.assertEqual('news', path.steps[1].id)
+        self.assertEqual({'box'}, path.steps[1].classes)
+        self.assertEqual('>', path.steps[2].combinator)
+        self.assertEqual({'data-role': 'footer'}, parse_selector('p[data-role="footer"]').steps[0].attributes)
+        self.assertEqual(('<main>', '</main>'), parse_selector('between:<main>...</main>'))
+        for selector in ['', '> ul', 'div >', 'div > > ul', 'div#', 'between:<main>', 'between:...x']:
+            with self.assertRaises(ValueError):
+                parse_selector(selector)
+
+    def test_extract_css_region(self):
+        self.assertEqual('<div id="news" class="box"><ul><li>First</li><li>Second <br></li></ul>'
+                         '<p>More</p><div>inside</div></div>', extract_region(DOCUMENT, '#news'))
+        self.assertEqual('<ul><li>First</li><li>Second <br></li></ul>', extract_region(DOCUMENT, 'div.box > ul'))
+        self.assertEqual('<a href="/">Home</a>', extract_region(DOCUMENT, 'div.nav a'))
+        self.assertEqual('<div>inside</div>', extract_region(DOCUMENT, 'main div > div'))
+        self.assertEqual('<tr><td>1</td><td>2</td></tr>', extract_region(DOCUMENT, 'table tr'))
+        self.assertEqual('<p data-role="footer">Footer & more</p>', extract_region(DOCUMENT, 'p[data-role=footer]'))
+        self.assertEqual('<br>', extract_region(DOCUMENT, 'li br'))
+        self.assertIsNone(extract_region(DOCUMENT, 'body > ul'))
+        self.assertIsNone(extract_region(DOCUMENT, '#missing'))
+
+    def test_extract_css_region_ancestors(self):
+        # The nearest article is not a child of div, an outer article is
+        document = '<div><article><section><article><span>x</span></article></section></article></div>'
+        self.assertEqual('<span>x</span>', extract_region(document, 'div > article span'))
+        self.assertIsNone(extract_region(document, 'div > article > span'))
+
+    def test_extract_deeply_nested(self):
+        document = '<div>' * 2000 + '<p>x</p>' + '</div>' * 2000
+        start = time.perf_counter()
+        # Every step but the first matches, which old versions explored in O(depth^steps)
+        self.assertIsNone(extract_region(document, 'section div div div div p'))
+        self.assertEqual('<p>x</p>', extract_region(document, 'div div div div div div p'))
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_extract_marker_region(self):
+        self.assertEqual('<li>First<li>Second <!-- volatile --><br>',
+                         extract_region(DOCUMENT, 'between:<ul>...</ul>'))
+        self.assertIsNone(extract_region(DOCUMENT, 'between:<ul>...</missing>'))
+        self.assertIsNone(extract_region(DOCUMENT, 'between:<missing>...</ul>'))
+
+    def test_extract_in_pieces(self):
+        for selector in ['#news', 'between:<ul>...</ul>', 'p[data-role=footer]']:
+            extractor = create_region_extractor(selector)
+            for i in range(len(DOCUMENT)):
+                if extractor.feed(DOCUMENT[i]):
+                    break
+            extractor.close()
+            self.assertEqual(extract_region(DOCUMENT, selector), extractor.region)
+
+    def test_extract_streaming_region(self):
+        body = (DOCUMENT + '<p>filler</p>' * 1000).encode('utf-8')
+        response = FakeResponse(body)
+        self.assertEqual('<a href="/">Home</a>', extract_streaming_region(response, 'div.nav a'))
+        self.assertTrue(response.closed)
+        self.assertLess(response.read, 10)  # the body has not been read beyond the region
+        response = FakeResponse('<p>Grüße</p>'.encode('utf-8'), chunk_size=4)
+        self.assertEqual('<p>Grüße</p>', extract_streaming_region(response, 'p'))
+        response = FakeResponse(body)
+        self.assertIsNone(extract_streaming_region(response, '#missing'))
+        self.assertEqual(len(response.chunks), response.read)
+
+
+class RegionCheckStrategyTests(unittest.TestCase):
+    def setUp(self):
+        self.url = 'http://localhost:5000/region/'
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.db.insert_site(url=self.url)
+        self.site = self.db.get_site(url=self.url)
+        test_server.start_server()
+
+    def site_changes(self):
+        return self.db.session.query(SiteChange).filter(SiteChange.site_id == self.site.id).all()
+
+    def test_region_check(self):
+        strategy = RegionCheckStrategy(db=self.db, snapshot_store=SnapshotStore(db=self.db))
+        self.db.set_site_region_selector(site=self.site, region_selector='#news ul')
+        self.assertFalse(strategy.change_check(site=self.site))
+        self.assertFalse(strategy.change_check(site=self.site))
+        self.assertEqual(1, len(self.site_changes()))
+        self.assertEqual(b'<ul><li>Stable news</li><li>More news</li></ul>',
+                         strategy.snapshot_store.load(self.site_changes()[0].snapshot_id))
+
+        # Another region starts over without reporting a change
+        self.db.set_site_region_selector(site=self.site, region_selector='title')
+        self.assertFalse(strategy.change_check(site=self.site))
+        self.assertEqual(2, len(self.site_changes()))
+        self.assertTrue(strategy.change_check(site=self.site))
+        self.assertEqual(3, len(self.site_changes()))
+        self.assertEqual(2, len(strategy.pop_change_details(site=self.site)))
+
+    def test_missing_region(self):
+        strategy = RegionCheckStrategy(db=self.db)
+        self.db.set_site_region_selector(site=self.site, region_selector='#missing')
+        self.assertFalse(strategy.change_check(site=self.site))
+        self.assertFalse(strategy.change_check(site=self.site))
+        self.assertEqual(1, len(self.site_changes()))
+
+    def test_checker_uses_region_strategy(self):
+        checker = ChangeChecker(db=self.db, change_check_strategy=NaiveCheckStrategy(db=self.db), workers=1)
+        self.assertIs(checker.change_check_strategy, checker.strategy_for(self.site))
+        checker.check_site(site=self.site)
+        self.assertTrue(checker.check_site(site=self.site))
+
+        self.db.set_site_region_selector(site=self.site, region_selector='div#news')
+        self.assertIsInstance(checker.strategy_for(self.site), RegionCheckStrategy)
+        results = checker.check_sites(sites=[self.site])
+        self.assertEqual([(self.site, False, None)], results)
+        results = checker.check_sites(sites=[self.site])
+        self.assertEqual([(self.site, False, None)], results)
+        self.assertEqual(3, len(self.site_changes()))
+
+    def test_remove_region_selector(self):
+        region_strategy = RegionCheckStrategy(db=self.db)
+        for strategy in [NaiveCheckStrategy(db=self.db),
+                         HfcInvarianceCheckStrategy(db=self.db, sample_count=2, sample_delay=0, recheck_delay=0)]:
+            self.db.set_site_region_selector(site=self.site, region_selector='#news')
+            region_strategy.change_check(site=self.site)
+            count = len(self.site_changes())
+
+            # The whole site starts over without reporting a change
+            self.db.set_site_region_selector(site=self.site, region_selector=None)
+            self.assertFalse(strategy.change_check(site=self.site))
+            self.assertEqual(count + 1, len(self.site_changes()))
+            self.assertFalse(self.db.get_latest_sitechange(site=self.site).fingerprint.startswith('r:'))
+
+    def tearDown(self):
+        test_server.stop_server()
+        self.db.destroy_sqlite_db_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import logging
+import datetime
+
+import brang.database as database
+from brang.database import SiteChange, HfcPattern
+from brang.retention import RetentionPolicy, compact
+
+logging.basicConfig(level=logging.INFO)
+
+
+class RetentionTests(unittest.TestCase):
+    def setUp(self):
+        logging.info("setUp")
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.now = datetime.datetime(2020, 6, 1, 12)
+        for i in range(3):
+            self.db.insert_site(url=f"http://localhost:5000/fix?n={i}")
+        for site in self.db.get_all_sites():
+            for hours in range(0, 24 * 10, 6):
+                self.db.insert_site_change_entry(site=site,
+                                                 fingerprint=str(hours),
+                                                 pattern=f"{site.id},{hours}",
+                                                 timestamp=self.now - datetime.timedelta(hours=hours))
+
+    def history(self):
+        return [(i, self.now - datetime.timedelta(hours=6 * i)) for i in range(40)]
+
+    def test_disabled_by_default(self):
+        self.assertFalse(RetentionPolicy.from_config().is_active)
+        result = compact(db=self.db, now=self.now)
+        self.assertEqual(0, result.deleted_site_changes)
+        self.assertEqual(3 * 40, self.db.session.query(SiteChange).count())
+
+    def test_keep_last(self):
+        policy = RetentionPolicy(keep_last=5)
+        self.assertEqual(list(range(5, 40)), policy.expired(self.history(), now=self.now))
+
+    def test_max_age(self):
+        policy = RetentionPolicy(max_age=datetime.timedelta(days=1))
+        self.assertEqual(list(range(5, 40)), policy.expired(self.history(), now=self.now))
+        self.assertEqual([], policy.expired(self.history()[-1:], now=self.now))
+
+    def test_downsample(self):
+        policy = RetentionPolicy(downsample_after=datetime.timedelta(days=2),
+                                 downsample_interval=datetime.timedelta(days=1))
+        expired = policy.expired(self.history(), now=self.now)
+        kept = [i for i in range(40) if i not in expired]
+        self.assertEqual(list(range(0, 9)), kept[:9])
+        self.assertEqual(9, len(kept) - 9)  # one per day from May 22 to May 30
+
+    def test_compact_incremental(self):
+        policy = RetentionPolicy(keep_last=2)
+        result = compact(db=self.db, policy=policy, batch_size=2, max_batches=1, now=self.now)
+        self.assertFalse(result.finished)
+        self.assertEqual(2, result.sites)
+        self.assertEqual(2 * 38, result.deleted_site_changes)
+
+        result = compact(db=self.db, policy=policy, batch_size=2, max_batches=1, now=self.now)
+        self.assertTrue(result.finished)
+        self.assertEqual(1, result.sites)
+        self.assertEqual(3 * 2, self.db.session.query(SiteChange).count())
+        self.assertEqual(3 * 2, self.db.session.query(HfcPattern).count())
+        for site in self.db.get_all_sites():
+            self.assertEqual("0", self.db.get_latest_sitechange(site=site).fingerprint)
+
+    def tearDown(self) -> None:
+        logging.info("tear down")
+        self.db.destroy_sqlite_db_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import logging
+import hashlib
+
+import brang.segments as segments
+from brang.segments import Segments, parse_pattern, format_pattern
+from brang.change_checker import HfcInvarianceCheckStrategy
+
+logging.basicConfig(level=logging.INFO)
+
+
+class SegmentsTests(unittest.TestCase):
+    def setUp(self):
+        self.text = "<html>\n<head><title>x</title></head>\n\n<body>a<b>b</b>\nc</body></html>"
+
+    def test_segments_like_transform(self):
+        for text in [self.text, self.text.encode('utf-8'), "", "<", "\n"]:
+            s = Segments(text)
+            t_list = HfcInvarianceCheckStrategy.transform(text=text)
+            self.assertEqual(t_list, [s[i] for i in range(len(s))])
+
+    def test_masked_hash(self):
+        mask = [1, 4, 5, 11]
+        t_list = HfcInvarianceCheckStrategy.transform(text=self.text.encode('utf-8'))
+        expected = hashlib.sha224(b''.join([t for i, t in enumerate(t_list) if i not in mask])).hexdigest()
+        segments.HASH_SLICE_SIZE = 3
+        try:
+            masked_hash = Segments(self.text.encode('utf-8')).masked_hash(mask).hexdigest()
+        finally:
+            segments.HASH_SLICE_SIZE = 64 * 1024
+        self.assertEqual(expected, masked_hash)
+
+    def test_create_pattern_aligned(self):
+        def page(items, timestamp):
+            body = ''.join(f'<li>item {i}</li>\n' for i in items)
+            return (f'<html><body><div class="ts">{timestamp}</div><ul>\n{body}</ul>'
+                    f'<p>footer</p></body></html>').encode('utf-8')
+
+        pattern = HfcInvarianceCheckStrategy.create_pattern(page(range(5), '12:00'), page(range(7), '12:01'))
+        fingerprint = HfcInvarianceCheckStrategy.apply_pattern(pattern, page(range(5), '12:00'))
+        self.assertEqual(fingerprint, HfcInvarianceCheckStrategy.apply_pattern(pattern, page(range(6), '14:00')))
+        self.assertEqual(fingerprint, HfcInvarianceCheckStrategy.apply_pattern(pattern, page(range(7), '15:00')))
+        changed_page = page(range(5), '12:00').replace(b'footer', b'new footer')
+        self.assertNotEqual(fingerprint, HfcInvarianceCheckStrategy.apply_pattern(pattern, changed_page))
+
+        # The list is longer than in any sample
+        longer_page = page(range(9), '13:00')
+        self.assertNotEqual(fingerprint, HfcInvarianceCheckStrategy.apply_pattern(pattern, longer_page))
+        self.assertFalse(segments.pattern_fits(Segments(longer_page), pattern))
+        self.assertTrue(segments.pattern_fits(Segments(page(range(6), '14:00')), pattern))
+
+    def test_insertion_next_to_volatile_segment(self):
+        def page(timestamp, alert=''):
+            return (f'<html><body><p>Updated: {timestamp}</p>\n{alert}'
+                    + ''.join(f'<p>Paragraph {i}</p>\n' for i in range(5))
+                    + '</body></html>').encode('utf-8')
+
+        pattern = HfcInvarianceCheckStrategy.create_pattern(page('12:00:01'), page('12:00:02'), page('12:00:03'))
+        fingerprint = HfcInvarianceCheckStrategy.apply_pattern(pattern, page('12:00:01'))
+        self.assertEqual(fingerprint, HfcInvarianceCheckStrategy.apply_pattern(pattern, page('13:30:00')))
+        alert_page = page('13:30:00', alert='<p>ALERT: site closed</p>\n')
+        self.assertNotEqual(fingerprint, HfcInvarianceCheckStrategy.apply_pattern(pattern, alert_page))
+        self.assertFalse(segments.pattern_fits(Segments(alert_page), pattern))
+
+    def test_aligned_pattern_format(self):
+        runs = ((3, 2, 0x5e4f21ab, 3, 1, 4), (9, 0, 0x1, 2, 0, 0), (12, None, None, None, None, None))
+        pattern = segments.format_runs(runs)
+        self.assertEqual("a:3+2~1-4@5e4f21ab.3,9+0@00000001.2,12+", pattern)
+        self.assertEqual(runs, segments.parse_aligned_pattern(pattern))
+
+    def test_create_pattern_shorter_sample(self):
+        text_1 = b"<a>1<b>2<c>3<d>4"
+        text_2 = b"<a>1<c>3"
+        pattern = HfcInvarianceCheckStrategy.create_pattern(text_1, text_2)
+        self.assertEqual(HfcInvarianceCheckStrategy.apply_pattern(pattern, text_1),
+                         HfcInvarianceCheckStrategy.apply_pattern(pattern, text_2))
+
+    def test_pattern_format(self):
+        self.assertEqual((), parse_pattern(""))
+        self.assertEqual((1, 3, 7), parse_pattern("7,1,3"))
+        self.assertEqual((1, 3, 4, 5, 9), parse_pattern("1,3-5,9"))
+        self.assertEqual("1,3-5,9-10", format_pattern([1, 3, 4, 5, 9, 10]))
+        self.assertEqual("", format_pattern([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import unittest
+import logging
+import random
+import time
+import tracemalloc
+
+import tests.test_server as test_server
+import brang.database as database
+from brang.change_checker import ChangeChecker, ChangeCheckStrategy, HfcInvarianceCheckStrategy, NaiveCheckStrategy
+from brang.change_checker import RegionCheckStrategy
+from brang.change_checker import ChangeMagnitude, create_streaming_fingerprints
+from brang.exceptions import SiteChangeNotFoundException
+from brang.metrics import Metrics, set_metrics
+from brang.segments import Segments
+from brang.simhash import MAX_FEATURE_SIZE, SimHasher, create_simhash, simhash_distance
+
+logging.basicConfig(level=logging.INFO)
+
+
+def page(items, seed=0):
+    rnd = random.Random(seed)
+    return ('<html><body><ul>\n'
+            + ''.join(f'<li class="item">{item} {rnd.random()}</li>\n' for item in items)
+            + '</ul></body></html>').encode()
+
+
+class GeneratedResponse(object):
+    """
+    Streams a body of generated chunks, which are not kept in memory.
+    """
+
+    def __init__(self, chunk, count: int):
+        self.chunk = chunk  # function chunk number -> bytes
+        self.count = count
+        self.encoding = 'utf-8'
+        self.url = 'http://localhost/'
+        self.headers = {}
+
+    def iter_content(self, chunk_size=None):
+        for i in range(self.count):
+            yield self.chunk(i)
+
+    def close(self):
+        pass
+
+
+def peak_memory(operation) -> int:
+    tracemalloc.start()
+    try:
+        operation()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class SimHashTests(unittest.TestCase):
+    def setUp(self):
+        self.items = [f'Item {i}' for i in range(100)]
+        self.document = page(self.items)
+
+    def test_create_simhash(self):
+        simhash = create_simhash(Segments(self.document))
+        self.assertEqual(16, len(simhash))
+        self.assertEqual(simhash, create_simhash(Segments(self.document.decode())))
+        self.assertEqual(simhash, create_simhash(Segments(self.document.replace(b'\n', b'\n\n'))))
+        self.assertEqual(0, simhash_distance(simhash, simhash))
+        self.assertEqual('0000000000000000', SimHasher().hexdigest())
+
+    def test_streaming(self):
+        simhash = create_simhash(Segments(self.document))
+        for chunk_size in [1, 7, 100, len(self.document)]:
+            hasher = SimHasher()
+            for i in range(0, len(self.document), chunk_size):
+                hasher.update(self.document[i:i + chunk_size])
+            self.assertEqual(simhash, hasher.hexdigest())
+
+    def test_long_segments(self):
+        document = b'<p>' + b'x' * (3 * MAX_FEATURE_SIZE + 5) + b'<p>' + b'y' * MAX_FEATURE_SIZE
+        for chunk_size in [1000, MAX_FEATURE_SIZE + 1]:
+            hasher = SimHasher()
+            for i in range(0, len(document), chunk_size):
+                hasher.update(document[i:i + chunk_size])
+            self.assertEqual(create_simhash(Segments(document)), hasher.hexdigest())
+
+    def test_streaming_memory(self):
+        # Many distinct segments
+        response = GeneratedResponse(lambda i: b''.join(b'<li>%d</li>\n' % (i * 1000 + j) for j in range(1000)),
+                                     count=100)
+        peak = peak_memory(lambda: create_streaming_fingerprints(response=response, simhasher=SimHasher()))
+        logging.info(f"Peak memory of streaming {100 * 1000} distinct segments: {peak} bytes")
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+        # No separators at all
+        response = GeneratedResponse(lambda i: b'x' * 16 * 1024, count=512)
+        start = time.perf_counter()
+        peak = peak_memory(lambda: create_streaming_fingerprints(response=response, simhasher=SimHasher()))
+        logging.info(f"Peak memory of streaming 8 MB without separators: {peak} bytes "
+                     f"in {time.perf_counter() - start:.2f}s")
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+    def test_distance(self):
+        simhash = create_simhash(Segments(self.document))
+        minor = create_simhash(Segments(page(self.items[:-1] + ['Changed'])))
+        major = create_simhash(Segments(page(self.items[:30] + [f'News {i}' for i in range(70)])))
+        unrelated = create_simhash(Segments(page(self.items, seed=1)))
+        logging.info(f"minor: {simhash_distance(simhash, minor)}, major: {simhash_distance(simhash, major)}, "
+                     f"unrelated: {simhash_distance(simhash, unrelated)}")
+        self.assertLess(simhash_distance(simhash, minor), 10)
+        self.assertLess(simhash_distance(simhash, minor), simhash_distance(simhash, major))
+        self.assertGreater(simhash_distance(simhash, unrelated), 16)
+        self.assertEqual(64, simhash_distance('0' * 16, 'f' * 16))
+
+    def test_masked_segments(self):
+        pattern = HfcInvarianceCheckStrategy.create_pattern(self.document, page(self.items, seed=1))
+        self.assertEqual(HfcInvarianceCheckStrategy.create_simhash(pattern, self.document),
+                         HfcInvarianceCheckStrategy.create_simhash(pattern, page(self.items, seed=2)))
+
+
+class ChangeThresholdTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.db.insert_site(url='http://localhost:5000/news/')
+        self.site = self.db.get_site(url='http://localhost:5000/news/')
+
+    def test_measure_change(self):
+        strategy = NaiveCheckStrategy(db=self.db)
+        self.db.insert_site_change_entry(site=self.site, fingerprint='', simhash='00000000000000ff')
+        latest = self.db.get_latest_sitechange(site=self.site)
+        self.assertEqual('00000000000000ff', latest.simhash)
+        strategy.measure_change(site=self.site, latest_site_change=latest, current_simhash='000000000000000f')
+        self.assertEqual(ChangeMagnitude(distance=4, baseline='00000000000000ff', simhash='000000000000000f'),
+                         strategy.pop_change_magnitude(site=self.site))
+        self.assertIsNone(strategy.pop_change_magnitude(site=self.site))
+
+        # The version notified last is the baseline
+        self.db.set_site_notified_simhash(site=self.site, notified_simhash='0000000000000000')
+        strategy.measure_change(site=self.site, latest_site_change=latest, current_simhash='000000000000000f')
+        self.assertEqual(4, strategy.pop_change_magnitude(site=self.site).distance)
+
+    def test_notification(self):
+        class MeasuringStrategy(ChangeCheckStrategy):
+            def change_check(self, site):
+                self.change_magnitudes[site.id] = ChangeMagnitude(distance=3, baseline='0' * 16, simhash='7'.zfill(16))
+                return True
+
+        checker = ChangeChecker(db=self.db, change_check_strategy=MeasuringStrategy(db=self.db), workers=1)
+        messages = []
+        checker.send_email = lambda msg_body: messages.append(msg_body)
+        self.db.set_site_change_threshold(site=self.site, change_threshold=4)
+        results = checker.check_sites(sites=[self.site])
+        self.assertEqual([(self.site, True, None)], results)
+        self.assertEqual([], messages)
+
+        self.assertEqual('0' * 16, self.site.notified_simhash)
+
+        self.db.set_site_change_threshold(site=self.site, change_threshold=3)
+        checker.check_sites(sites=[self.site])
+        self.assertEqual(["* http://localhost:5000/news/"], messages)
+        self.assertEqual('7'.zfill(16), self.site.notified_simhash)
+
+    def test_small_changes_add_up(self):
+        class DriftingStrategy(ChangeCheckStrategy):
+            """
+            Every check changes one more bit of the simhash.
+            """
+            version = 0
+
+            def change_check(self, site):
+                simhash = format((1 << self.version) - 1, '016x')
+                self.version += 1
+                try:
+                    latest_site_change = self.get_latest_sitechange(site=site)
+                except SiteChangeNotFoundException:
+                    latest_site_change = None
+                if latest_site_change is not None:
+                    self.measure_change(site=site, latest_site_change=latest_site_change, current_simhash=simhash)
+                self.db.insert_site_change_entry(site=site, fingerprint=simhash, simhash=simhash)
+                return latest_site_change is not None
+
+        checker = ChangeChecker(db=self.db, change_check_strategy=DriftingStrategy(db=self.db), workers=1)
+        messages = []
+        checker.send_email = lambda msg_body: messages.append(msg_body)
+        self.db.set_site_change_threshold(site=self.site, change_threshold=3)
+        notified = []
+        for _ in range(8):
+            checker.check_sites(sites=[self.site])
+            notified.append(len(messages))
+        # Each check differs from the one before in 1 bit only, changes of 3 bits are notified
+        self.assertEqual([0, 0, 0, 1, 1, 1, 2, 2], notified)
+
+    def test_simhash_of_new_entries_only(self):
+        def new_site(name):
+            self.db.insert_site(url=f'http://localhost:5000/fix/?{name}')
+            return self.db.get_site(url=f'http://localhost:5000/fix/?{name}')
+
+        test_server.start_server()
+        metrics = Metrics()
+        set_metrics(metrics)
+        try:
+            for name, strategy in [('naive', NaiveCheckStrategy(db=self.db, streaming=False)),
+                                   ('region', RegionCheckStrategy(db=self.db))]:
+                site = new_site(name)
+                metrics.counters.clear()
+                for _ in range(3):
+                    self.assertFalse(strategy.change_check(site=site))
+                self.assertEqual(1, metrics.counters['simhashes'])
+                self.assertIsNotNone(self.db.get_latest_sitechange(site=site).simhash)
+
+            # Streamed bodies get a simhash only if the changes of the site are measured
+            strategy = NaiveCheckStrategy(db=self.db, streaming=True)
+            site = new_site('streamed')
+            strategy.change_check(site=site)
+            self.assertIsNone(self.db.get_latest_sitechange(site=site).simhash)
+            site = new_site('measured')
+            self.db.set_site_change_threshold(site=site, change_threshold=4)
+            strategy.change_check(site=site)
+            self.assertIsNotNone(self.db.get_latest_sitechange(site=site).simhash)
+        finally:
+            set_metrics(None)
+            test_server.stop_server()
+
+    def tearDown(self):
+        self.db.destroy_sqlite_db_file()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import logging
+import datetime
+
+import tests.test_server as test_server
+import brang.database as database
+from brang.change_checker import NaiveCheckStrategy, HfcInvarianceCheckStrategy
+from brang.database import SiteChange, Snapshot
+from brang.exceptions import SnapshotNotFoundException
+from brang.retention import RetentionPolicy, compact
+from brang.snapshots import SnapshotStore
+
+logging.basicConfig(level=logging.INFO)
+
+
+class SnapshotStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.body = b'<html>' + b'<p>brang</p>\n' * 1000 + b'</html>'
+
+    def test_store(self):
+        for compression in ['zlib', 'lzma', 'none']:
+            store = SnapshotStore(db=self.db, compression=compression)
+            body = compression.encode() + self.body
+            snapshot_id = store.store(body)
+            self.assertEqual(snapshot_id, store.store(body))
+            self.assertEqual(body, store.load(snapshot_id))
+            snapshot = self.db.get_snapshot(snapshot_id)
+            self.assertEqual(len(body), snapshot.size)
+            if compression != 'none':
+                self.assertLess(len(snapshot.data), len(body) // 10)
+        self.assertEqual(3, self.db.session.query(Snapshot).count())
+
+    def test_limits(self):
+        self.assertIsNone(SnapshotStore(db=self.db, max_size=10).store(self.body))
+        with self.assertRaises(ValueError):
+            SnapshotStore(db=self.db, compression='zip')
+        with self.assertRaises(SnapshotNotFoundException):
+            SnapshotStore(db=self.db).load(42)
+
+    def test_retention(self):
+        store = SnapshotStore(db=self.db)
+        now = datetime.datetime(2020, 6, 1)
+        self.db.insert_site(url='http://localhost:5000/fix/')
+        site = self.db.get_site(url='http://localhost:5000/fix/')
+        for i in range(6):
+            self.db.insert_site_change_entry(site=site, fingerprint=str(i), pattern='',
+                                             timestamp=now - datetime.timedelta(hours=i),
+                                             snapshot_id=store.store(b'body %d' % (i % 4)))
+        result = compact(db=self.db, policy=RetentionPolicy(keep_last=5, keep_snapshots=2), now=now)
+        self.assertEqual(1, result.deleted_site_changes)
+        self.assertEqual(3, result.released_snapshots)
+        self.assertEqual(2, result.deleted_snapshots)
+        site_changes = self.db.session.query(SiteChange).order_by(SiteChange.check_timestamp.desc()).all()
+        self.assertEqual([b'body 0', b'body 1'], [store.load(sc.snapshot_id) for sc in site_changes[:2]])
+        self.assertEqual([None] * 3, [sc.snapshot_id for sc in site_changes[2:]])
+        self.assertEqual(2, self.db.session.query(Snapshot).count())
+
+
+class SnapshotCheckTests(unittest.TestCase):
+    def setUp(self):
+        self.db = database.SQLiteDatabase(db_filename=':memory:')
+        self.store = SnapshotStore(db=self.db)
+        test_server.start_server()
+
+    def test_check_stores_snapshots(self):
+        url = 'http://localhost:5000/changing/'
+        self.db.insert_site(url=url)
+        site = self.db.get_site(url=url)
+        for strategy in [NaiveCheckStrategy(db=self.db, snapshot_store=self.store),
+                         HfcInvarianceCheckStrategy(db=self.db, snapshot_store=self.store, sample_delay=0.1)]:
+            strategy.change_check(site=site)
+            site_change = self.db.get_latest_sitechange(site=site)
+            self.assertIsNotNone(site_change.snapshot_id)
+            self.assertTrue(self.store.load(site_change.snapshot_id).startswith(b'20'))
+
+    def tearDown(self):
+        test_server.stop_server()
+
+
+if __name__ == '__main__':
+    unittest.main()